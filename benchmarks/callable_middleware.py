@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+Compares ZipkinCallableMiddleware with the legacy ZipkinMiddleware under the Django test client
+
+Both are measured on sampled and unsampled requests to a trivial view. Django versions before 1.10 don't load
+middleware from the MIDDLEWARE setting, there the callable middleware is wrapped around the handler the same way.
+"""
+import logging
+import optparse
+
+from helpers import configure_django, best_of, report
+
+
+def view(request, *args, **kwargs):
+    from django.http import HttpResponse
+    return HttpResponse('OK')
+
+
+urlpatterns = []
+
+
+def make_client(callable_middleware):
+    import django
+    from django.test import Client
+    from django.test.utils import override_settings
+    from django_zipkin.middleware import ZipkinCallableMiddleware
+
+    if not callable_middleware:
+        with override_settings(MIDDLEWARE_CLASSES=['django_zipkin.middleware.ZipkinMiddleware']):
+            client = Client()
+            client.handler.load_middleware()
+        return client
+    if django.VERSION >= (1, 10):
+        with override_settings(MIDDLEWARE=['django_zipkin.middleware.ZipkinCallableMiddleware']):
+            client = Client()
+            client.handler.load_middleware()
+        return client
+    with override_settings(MIDDLEWARE_CLASSES=[]):
+        client = Client()
+        client.handler.load_middleware()
+    middleware = ZipkinCallableMiddleware(client.handler.get_response)
+    client.handler._view_middleware.insert(0, middleware.process_view)
+    client.handler.get_response = middleware
+    return client
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--number', type='int', default=2000)
+    options, _ = parser.parse_args()
+
+    configure_django(ROOT_URLCONF=__name__, MIDDLEWARE_CLASSES=[])
+    from django.conf.urls import url
+    urlpatterns.append(url(r'^users/(?P<user_id>\d+)/$', view, name='user'))
+    logging.getLogger('zipkin').addHandler(logging.NullHandler())
+    logging.getLogger('zipkin').propagate = False
+
+    for callable_middleware in (False, True):
+        client = make_client(callable_middleware)
+        name = 'ZipkinCallableMiddleware' if callable_middleware else 'ZipkinMiddleware'
+        for sampled in ('false', 'true'):
+            report('%s, sampled=%s' % (name, sampled), best_of(
+                lambda: client.get('/users/42/', HTTP_X_B3_SAMPLED=sampled), options.number))
+
+
+if __name__ == '__main__':
+    main()
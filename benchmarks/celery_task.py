@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Measures what tracing costs per Celery task execution
+
+Calls the task_prerun and task_postrun handlers of CeleryTracer the way a worker does, for sampled and unsampled
+tasks, so the numbers don't depend on a broker. The handlers log sampled spans to a logger without handlers.
+"""
+import logging
+import optparse
+
+from helpers import configure_django, best_of, report
+
+
+class Request(object):
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class Task(object):
+    name = 'benchmarks.tasks.resize'
+
+    def __init__(self, headers):
+        self.request = Request(headers)
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--number', type='int', default=20000)
+    options, _ = parser.parse_args()
+
+    configure_django()
+    from django_zipkin.celery_tracing import CeleryTracer
+    logging.getLogger('zipkin').addHandler(logging.NullHandler())
+    logging.getLogger('zipkin').propagate = False
+
+    tracer = CeleryTracer()
+    for sampled in ('false', 'true'):
+        task = Task({'X-B3-TraceId': '5af7183fb1d4cf5f', 'X-B3-SpanId': '6b221d5bc9e6496c', 'X-B3-Sampled': sampled})
+
+        def run_task():
+            tracer.task_prerun(task_id='a2c1b64e', task=task, args=(), kwargs={})
+            tracer.task_postrun(task_id='a2c1b64e', task=task, args=(), kwargs={}, retval=None, state='SUCCESS')
+        report('task_prerun + task_postrun, sampled=%s' % sampled, best_of(run_task, options.number))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def configure_django(**overrides):
+    import django
+    from django.conf import settings
+    options = dict(
+        INSTALLED_APPS=['django_zipkin'],
+        DATABASES={},
+        ROOT_URLCONF=__name__,
+    )
+    options.update(overrides)
+    settings.configure(**options)
+    if hasattr(django, 'setup'):
+        django.setup()
+
+
+urlpatterns = []
+
+
+def best_of(func, number, repeat=5):
+    """
+    Microseconds per call of func, the best of repeat runs of number calls
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000 * 1000
+
+
+def report(name, us_per_call):
+    print('%-50s %10.2f us' % (name, us_per_call))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""
+Measures what importing django_zipkin and building the middleware cost at startup
+
+Each measurement runs in a fresh interpreter, so nothing is cached from previous runs. Host name lookups are made
+slow on purpose with --dns-delay, and the run fails if startup takes longer than --max-startup milliseconds, ie.
+if it waits for the lookup.
+"""
+import os
+import optparse
+import subprocess
+import sys
+
+from helpers import report
+
+
+CHILD = '''
+import socket, sys, time
+sys.path.insert(0, %(benchmarks)r)
+real_gethostbyname = socket.gethostbyname
+def slow_gethostbyname(name):
+    time.sleep(%(dns_delay)f)
+    return real_gethostbyname(name)
+socket.gethostbyname = slow_gethostbyname
+from helpers import configure_django
+configure_django()
+start = time.time()
+import django_zipkin.middleware
+imported = time.time()
+django_zipkin.middleware.ZipkinMiddleware()
+built = time.time()
+print('%%f %%f' %% (imported - start, built - imported))
+'''
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--repeat', type='int', default=5)
+    parser.add_option('--dns-delay', type='float', default=1.0, help='seconds each host name lookup takes')
+    parser.add_option('--max-startup', type='float', default=500.0, help='maximum startup time in milliseconds')
+    options, _ = parser.parse_args()
+
+    source = CHILD % dict(benchmarks=os.path.dirname(os.path.abspath(__file__)), dns_delay=options.dns_delay)
+    timings = []
+    for _ in range(options.repeat):
+        output = subprocess.check_output([sys.executable, '-c', source])
+        timings.append([float(value) for value in output.split()])
+    import_time = min(imported for imported, _ in timings) * 1000 * 1000
+    build_time = min(built for _, built in timings) * 1000 * 1000
+    report('import django_zipkin.middleware', import_time)
+    report('ZipkinMiddleware()', build_time)
+    if (import_time + build_time) / 1000 > options.max_startup:
+        print('FAIL: startup took longer than %.0f ms' % options.max_startup)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Measures what tail sampling costs on requests that end up being dropped
+
+Runs the middleware hooks on unsampled requests with and without tail sampling, and fails if the difference
+per request exceeds --max-overhead microseconds.
+"""
+import optparse
+import sys
+
+from helpers import configure_django, best_of, report
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--number', type='int', default=20000)
+    parser.add_option('--max-overhead', type='float', default=50.0, help='maximum overhead per request in microseconds')
+    options, _ = parser.parse_args()
+
+    configure_django()
+    from django.http import HttpResponse
+    from django.test import RequestFactory
+    from django_zipkin.middleware import ZipkinMiddleware
+    from django_zipkin.sampler import TailSampler
+
+    request = RequestFactory().get('/api/v1/users/42/?fields=name,email')
+    response = HttpResponse()
+
+    def view(request, *args, **kwargs):
+        return response
+
+    def run(middleware):
+        def handle():
+            middleware.process_request(request)
+            middleware.process_view(request, view, (), {'user_id': '42', 'format': 'json'})
+            middleware.process_response(request, response)
+        return handle
+
+    untraced = best_of(run(ZipkinMiddleware()), options.number)
+    tail_sampled = best_of(run(ZipkinMiddleware(tail_sampler=TailSampler(latency_threshold=1000 * 1000))),
+                           options.number)
+    report('unsampled request', untraced)
+    report('unsampled request, recorded for tail sampling', tail_sampled)
+    report('overhead', tail_sampled - untraced)
+    if tail_sampled - untraced > options.max_overhead:
+        print('Overhead exceeds %.2f us' % options.max_overhead)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
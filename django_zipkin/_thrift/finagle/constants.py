@@ -0,0 +1,8 @@
+#
+# Structs of Finagle's tracing.thrift, see ttypes.py
+#
+
+from thrift.Thrift import TType, TMessageType, TException, TApplicationException
+from ttypes import *
+
+CAN_TRACE_METHOD_NAME = "__can__finagleTracerV1__"
@@ -0,0 +1,133 @@
+#
+# The structs of Finagle's TTwitter protocol upgrade, from
+# https://github.com/twitter/finagle/blob/develop/finagle-thrift/src/main/thrift/tracing.thrift
+# in the form the Thrift Compiler (0.9.1) generates with "py:dynamic,slots". Fields this package doesn't use are
+# left out, they are skipped when read.
+#
+
+from thrift.Thrift import TType, TMessageType, TException, TApplicationException
+from thrift.protocol.TBase import TBase, TExceptionBase
+
+
+
+class ClientId(TBase):
+  """
+  Attributes:
+   - name
+  """
+
+  __slots__ = [ 
+    'name',
+   ]
+
+  thrift_spec = (
+    None, # 0
+    (1, TType.STRING, 'name', None, None, ), # 1
+  )
+
+  def __init__(self, name=None,):
+    self.name = name
+
+
+class RequestContext(TBase):
+  """
+  Attributes:
+   - key
+   - value
+  """
+
+  __slots__ = [ 
+    'key',
+    'value',
+   ]
+
+  thrift_spec = (
+    None, # 0
+    (1, TType.STRING, 'key', None, None, ), # 1
+    (2, TType.STRING, 'value', None, None, ), # 2
+  )
+
+  def __init__(self, key=None, value=None,):
+    self.key = key
+    self.value = value
+
+
+class RequestHeader(TBase):
+  """
+  Attributes:
+   - trace_id
+   - span_id
+   - parent_span_id
+   - sampled
+   - client_id
+   - flags
+   - contexts
+  """
+
+  __slots__ = [ 
+    'trace_id',
+    'span_id',
+    'parent_span_id',
+    'sampled',
+    'client_id',
+    'flags',
+    'contexts',
+   ]
+
+  thrift_spec = (
+    None, # 0
+    (1, TType.I64, 'trace_id', None, None, ), # 1
+    (2, TType.I64, 'span_id', None, None, ), # 2
+    (3, TType.I64, 'parent_span_id', None, None, ), # 3
+    None, # 4
+    (5, TType.BOOL, 'sampled', None, None, ), # 5
+    (6, TType.STRUCT, 'client_id', (ClientId, ClientId.thrift_spec), None, ), # 6
+    (7, TType.I64, 'flags', None, None, ), # 7
+    (8, TType.LIST, 'contexts', (TType.STRUCT,(RequestContext, RequestContext.thrift_spec)), None, ), # 8
+  )
+
+  def __init__(self, trace_id=None, span_id=None, parent_span_id=None, sampled=None, client_id=None, flags=None, contexts=None,):
+    self.trace_id = trace_id
+    self.span_id = span_id
+    self.parent_span_id = parent_span_id
+    self.sampled = sampled
+    self.client_id = client_id
+    self.flags = flags
+    self.contexts = contexts
+
+
+class ResponseHeader(TBase):
+  """
+  Attributes:
+   - contexts
+  """
+
+  __slots__ = [ 
+    'contexts',
+   ]
+
+  thrift_spec = (
+    None, # 0
+    (1, TType.LIST, 'contexts', (TType.STRUCT,(RequestContext, RequestContext.thrift_spec)), None, ), # 1
+  )
+
+  def __init__(self, contexts=None,):
+    self.contexts = contexts
+
+
+class ConnectionOptions(TBase):
+
+  __slots__ = [ 
+   ]
+
+  thrift_spec = (
+  )
+
+
+class UpgradeReply(TBase):
+
+  __slots__ = [ 
+   ]
+
+  thrift_spec = (
+  )
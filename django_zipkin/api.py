@@ -1,49 +1,174 @@
+import os
 import struct
 import socket
 import time
 import base64
 import logging
+import threading
 
 from thrift.protocol import TBinaryProtocol
 from thrift.transport import TTransport
 
+from django.utils.functional import SimpleLazyObject
+
 import constants
 import defaults as settings
-from data_store import default as default_store
+from utils import monotonic, truncate, memoize
+from data_store import get_default as get_default_store, CORE_ANNOTATIONS
+from sampler import get_default as get_default_sampler
 from _thrift.zipkinCore.ttypes import Annotation, BinaryAnnotation, Endpoint, AnnotationType, Span
 
 
+class DeferredBinaryAnnotation(BinaryAnnotation):
+    """
+    A binary annotation whose value is only computed when the span is encoded, by calling func(*args)
+
+    Use this for values that are expensive to render; if the span is not sampled, func is never called.
+    """
+    def __init__(self, key, func, args, host):
+        BinaryAnnotation.__init__(self, key, None, AnnotationType.STRING, host)
+        self.func = func
+        self.args = args
+
+
 class ZipkinApi(object):
-    def __init__(self, store=None, service_name=None):
-        self.store = store or default_store
+    def __init__(self, store=None, service_name=None, sampler=None, ipv4=None):
+        self.store = store or get_default_store()
+        self.sampler = sampler or get_default_sampler()
+        ipv4 = ipv4 or settings.ZIPKIN_ENDPOINT_IPV4
         self.endpoint = Endpoint(
-            ipv4=self._get_my_ip(),
+            ipv4=self._ipv4_to_long(ipv4) if ipv4 else None,
             port=None,
             service_name=service_name or settings.ZIPKIN_SERVICE_NAME
         )
+        # Endpoints of the ports and addresses requests were served on, so each request doesn't build its own
+        self.endpoints = {}
+        if not ipv4:
+            # The endpoint is shared by all annotations, so they all get the address once it's known
+            host_ip_resolver.resolve(self._set_ipv4)
+
+    def _set_ipv4(self, ipv4):
+        self.endpoint.ipv4 = ipv4
+
+    def set_endpoint(self, port=None, ipv4=None):
+        """
+        Set the port and address of the current span's endpoint, for processes serving on several of them
+
+        ipv4 is a dotted string overriding the address of this host, port is an integer.
+        """
+        key = (ipv4, port, self.endpoint.ipv4)
+        endpoint = self.endpoints.get(key)
+        if endpoint is None:
+            if len(self.endpoints) >= constants.ENDPOINT_CACHE_SIZE:
+                self.endpoints.clear()
+            endpoint = self.endpoints[key] = Endpoint(
+                ipv4=self._ipv4_to_long(ipv4) if ipv4 else self.endpoint.ipv4,
+                port=self._port_to_i16(port),
+                service_name=self.endpoint.service_name
+            )
+        self.store.set_endpoint(endpoint)
 
-    def record_event(self, message, duration=None):
-        self.store.record(self._build_annotation(message, duration))
+    def get_endpoint(self):
+        if self.endpoint.ipv4 is None:
+            host_ip_resolver.restart_if_forked()
+        return self.store.get_endpoint() or self.endpoint
+
+    def record_event(self, message, duration=None, timestamp=None):
+        self.store.record(self._build_annotation(message, duration, timestamp))
 
     def record_key_value(self, key, value):
         self.store.record(self._build_binary_annotation(key, value))
 
+    def encode_key_value(self, key, value):
+        """
+        Pre-encode a key-value pair for record_encoded_key_value, for values that are recorded repeatedly
+        """
+        annotation_type = self._binary_annotation_type(value)
+        return key, self._format_binary_annotation_value(value, annotation_type), annotation_type
+
+    def record_encoded_key_value(self, encoded):
+        key, formatted_value, annotation_type = encoded
+        self.store.record(BinaryAnnotation(key, formatted_value, annotation_type, self.get_endpoint()))
+
+    def record_key_value_deferred(self, key, func, *args):
+        self.store.record(DeferredBinaryAnnotation(key, func, args, self.get_endpoint()))
+
+    def record_aggregate(self, key, duration=None, count=1):
+        """
+        Add count events taking duration microseconds in total to the aggregate called key, returns how many events
+        were added to it so far
+
+        Aggregates are recorded as the binary annotations <key>.count and <key>.duration (the sum of durations), for
+        events too frequent to record one by one. Aggregates only ever given no duration are just counters, without
+        <key>.duration.
+        """
+        if not self.store.get().is_tracing():
+            return 0
+        aggregates = self.store.get_aggregates()
+        total_count, total_duration = aggregates.get(key, (0, None))
+        if duration is not None:
+            total_duration = (total_duration or 0) + duration
+        aggregates[key] = (total_count + count, total_duration)
+        return total_count + count
+
     def set_rpc_name(self, name):
         self.store.set_rpc_name(name)
 
+    def get_start_timestamp(self):
+        """
+        Timestamp of the first annotation of the current span in microseconds, or None if nothing was recorded yet
+        """
+        start_time = self.store.get_start_time()
+        if start_time is None:
+            return None
+        return start_time[0]
+
+    def get_elapsed_time(self):
+        """
+        Microseconds elapsed since the first annotation of the current span, or None if nothing was recorded yet
+        """
+        start_time = self.store.get_start_time()
+        if start_time is None:
+            return None
+        return min(int((monotonic() - start_time[1]) * 1000 * 1000), constants.MAX_ANNOTATION_DURATION)
+
     def build_log_message(self):
-        trans = TTransport.TMemoryBuffer()
-        protocol = TBinaryProtocol.TBinaryProtocolAccelerated(trans=trans)
-        self._build_span().write(protocol)
-        return base64.b64encode(trans.getvalue())
+        return self._build_log_message(self._build_span())
+
+    def build_child_span_log_message(self, span_id, name, events, key_values=()):
+        """
+        Build the log message of a span with the current span as its parent, like the client side of an RPC
+
+        events is a list of (value, timestamp, duration) tuples, with duration possibly None, key_values a list of
+        (key, value) pairs.
+        """
+        zipkin_data = self.store.get()
+        return self._build_log_message(Span(
+            id=span_id.get_binary(),
+            trace_id=zipkin_data.trace_id.get_binary(),
+            parent_id=zipkin_data.span_id.get_binary() if zipkin_data.span_id is not None else None,
+            name=name,
+            annotations=[self._build_annotation(value, duration, timestamp) for value, timestamp, duration in events],
+            binary_annotations=[self._build_binary_annotation(key, value) for key, value in key_values]
+        ))
+
+    def _build_log_message(self, span):
+        message = self._encode(span)
+        max_size = settings.ZIPKIN_MAX_SPAN_SIZE
+        if max_size is not None and len(message) > max_size:
+            message = self._encode(self._shrink_span(span, max_size))
+        return base64.b64encode(message)
 
     def get_headers_for_downstream_request(self):
         try:
             data = self.store.get()
+            sampled = data.sampled
+            if sampled is None and data.trace_id is not None:
+                sampled = self.sampler.is_sampled(data.trace_id)
             headers = {
                 constants.TRACE_ID_HDR_NAME: data.trace_id.get_hex() if data.trace_id is not None else None,
                 constants.SPAN_ID_HDR_NAME: data.span_id.get_hex() if data.span_id is not None else None,
-                constants.SAMPLED_HDR_NAME: self._bool_to_str_true_false(data.sampled),
+                constants.SAMPLED_HDR_NAME: self._bool_to_str_true_false(sampled),
                 constants.FLAGS_HDR_NAME: self._bool_to_str_1_0(data.flags)
             }
             if data.parent_span_id is not None:
@@ -66,9 +191,10 @@ class ZipkinApi(object):
             return '1'
         return '0'
 
-    def _get_my_ip(self):
+    @classmethod
+    def _get_my_ip(cls):
         try:
-            return self._ipv4_to_long(socket.gethostbyname(socket.gethostname()))
+            return cls._ipv4_to_long(socket.gethostbyname(socket.gethostname()))
         except Exception:
             return None
 
@@ -80,18 +206,100 @@ class ZipkinApi(object):
             parent_id=zipkin_data.parent_span_id.get_binary() if zipkin_data.parent_span_id is not None else None,
             name=self.store.get_rpc_name(),
             annotations=self.store.get_annotations(),
-            binary_annotations=self.store.get_binary_annotations()
+            binary_annotations=self._materialize_binary_annotations(self.store.get_binary_annotations()) +
+            self._build_aggregate_annotations(self.store.get_aggregates())
+        )
+
+    def _materialize_binary_annotations(self, annotations):
+        materialized = []
+        for annotation in annotations:
+            if isinstance(annotation, DeferredBinaryAnnotation):
+                try:
+                    value = annotation.func(*annotation.args)
+                except Exception:
+                    logging.root.exception("failed_to_materialize_binary_annotation %s" % annotation.key)
+                    continue
+                annotation = self._build_binary_annotation(annotation.key, value, annotation.host)
+                if annotation.annotation_type == AnnotationType.STRING:
+                    annotation.value = truncate(annotation.value, settings.ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH,
+                                                constants.TRUNCATED_VALUE_SUFFIX)
+            materialized.append(annotation)
+        return materialized
+
+    def _build_aggregate_annotations(self, aggregates):
+        annotations = []
+        for key, (count, total) in sorted(aggregates.items()):
+            annotations.append(self._build_binary_annotation(key + '.count', count))
+            if total is not None:
+                annotations.append(self._build_binary_annotation(key + '.duration', total))
+        return annotations
+
+    @staticmethod
+    def _encode(thrift_object):
+        trans = TTransport.TMemoryBuffer()
+        protocol = TBinaryProtocol.TBinaryProtocolAccelerated(trans=trans)
+        thrift_object.write(protocol)
+        return trans.getvalue()
+
+    def _shrink_span(self, span, max_size):
+        """
+        Drop annotations from span until it fits in max_size bytes, and mark it as truncated
+
+        The core annotations (sr, ss, cs, cr) and binary annotations (status code, error and sampling reason) are
+        always kept, like when recording them. Of the rest, binary annotations are kept before annotations, in the
+        order they were recorded, as long as they fit.
+        """
+        marker = BinaryAnnotation(constants.ANNOTATION_SPAN_TRUNCATED, '1', AnnotationType.BOOL, self.get_endpoint())
+        kept = set(id(annotation) for annotation in span.annotations if annotation.value in CORE_ANNOTATIONS)
+        kept.update(id(annotation) for annotation in span.binary_annotations
+                    if annotation.key in constants.CORE_BINARY_ANNOTATIONS)
+        shrunk = Span(
+            id=span.id,
+            trace_id=span.trace_id,
+            parent_id=span.parent_id,
+            name=span.name,
+            annotations=[annotation for annotation in span.annotations if id(annotation) in kept],
+            binary_annotations=[annotation for annotation in span.binary_annotations if id(annotation) in kept],
+            debug=span.debug
         )
+        shrunk.binary_annotations.append(marker)
+        budget = max_size - len(self._encode(shrunk))
+        for annotation in span.binary_annotations + span.annotations:
+            if id(annotation) in kept:
+                continue
+            size = len(self._encode(annotation))
+            if size <= budget:
+                kept.add(id(annotation))
+                budget -= size
+        shrunk.annotations = [annotation for annotation in span.annotations if id(annotation) in kept]
+        shrunk.binary_annotations = [annotation for annotation in span.binary_annotations if id(annotation) in kept]
+        shrunk.binary_annotations.append(marker)
+        return shrunk
 
-    def _build_annotation(self, value, duration=None):
+    def _build_annotation(self, value, duration=None, timestamp=None):
         if isinstance(value, unicode):
             value = value.encode('utf-8')
-        return Annotation(time.time() * 1000 * 1000, str(value), self.endpoint, duration)
+        if timestamp is None:
+            timestamp = self.get_timestamp()
+        return Annotation(timestamp, str(value), self.get_endpoint(), duration)
+
+    def get_timestamp(self):
+        """
+        The current time in microseconds, consistent with the timestamps of the current span
+        """
+        # The wall clock is read once per span, all later timestamps are offsets measured with a monotonic clock.
+        # This keeps the annotations of a span consistent with each other even if the wall clock is adjusted.
+        now = monotonic()
+        start_time = self.store.get_start_time()
+        if start_time is None:
+            start_time = (int(time.time() * 1000 * 1000), now)
+            self.store.set_start_time(start_time)
+        return start_time[0] + int((now - start_time[1]) * 1000 * 1000)
 
-    def _build_binary_annotation(self, key, value):
+    def _build_binary_annotation(self, key, value, host=None):
         annotation_type = self._binary_annotation_type(value)
         formatted_value = self._format_binary_annotation_value(value, annotation_type)
-        return BinaryAnnotation(key, formatted_value, annotation_type, self.endpoint)
+        return BinaryAnnotation(key, formatted_value, annotation_type, host or self.get_endpoint())
 
     @classmethod
     def _binary_annotation_type(cls, value):
@@ -131,5 +339,71 @@ class ZipkinApi(object):
         packed_ip = socket.inet_aton(ip)
         return struct.unpack("!i", packed_ip)[0]
 
+    @staticmethod
+    def _port_to_i16(port):
+        # Endpoint.port is a signed 16 bit integer, ports above 32767 wrap around like in the other Zipkin clients
+        if port is None:
+            return None
+        return struct.unpack("!h", struct.pack("!H", port))[0]
+
+
+class HostIpResolver(object):
+    """
+    Looks up the IP address of this host once, in a background thread, because DNS lookups may block for long
+    """
+    def __init__(self):
+        self.ipv4 = None
+        self.resolved = False
+        self.callbacks = []
+        self.thread = None
+        # The process the thread runs in, it doesn't survive forking, like in servers preloading the application
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def resolve(self, callback):
+        """
+        Calls callback with the address as an integer (None if it can't be found) as soon as it's known
+        """
+        with self.lock:
+            if not self.resolved:
+                self.callbacks.append(callback)
+                self._start()
+                return
+        callback(self.ipv4)
+
+    def restart_if_forked(self):
+        """
+        Restart the lookup in a process forked while it was running, for the callbacks still waiting for it
+        """
+        if self.resolved or self.pid == os.getpid():
+            return
+        with self.lock:
+            if not self.resolved:
+                self._start()
+
+    def _start(self):
+        pid = os.getpid()
+        if self.thread is None or self.pid != pid:
+            self.pid = pid
+            self.thread = threading.Thread(target=self._run, name='django_zipkin.HostIpResolver')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        ipv4 = ZipkinApi._get_my_ip()
+        with self.lock:
+            self.ipv4, self.resolved = ipv4, True
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(ipv4)
+
+
+host_ip_resolver = HostIpResolver()
+
+
+@memoize
+def get_default():
+    return ZipkinApi()
+
 
-api = ZipkinApi(default_store)
+api = SimpleLazyObject(get_default)
@@ -0,0 +1,25 @@
+from django.apps import AppConfig
+
+import defaults as settings
+
+
+class DjangoZipkinConfig(AppConfig):
+    name = 'django_zipkin'
+    verbose_name = 'Zipkin'
+
+    def ready(self):
+        if settings.ZIPKIN_MIDDLEWARE_TIMING:
+            import middleware_timing
+            middleware_timing.install()
+        if settings.ZIPKIN_TEMPLATE_TIMING:
+            import template_timing
+            template_timing.install()
+        if settings.ZIPKIN_CACHE_TIMING:
+            import cache_timing
+            cache_timing.install()
+        if settings.ZIPKIN_CELERY_TRACING:
+            import celery_tracing
+            celery_tracing.install()
+        if settings.ZIPKIN_REDIS_TIMING:
+            import redis_timing
+            redis_timing.install()
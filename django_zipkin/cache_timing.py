@@ -0,0 +1,113 @@
+import functools
+import logging
+import threading
+
+from django.conf import settings as django_settings
+
+from api import get_default as get_default_api
+from utils import import_class
+import constants
+import defaults as settings
+
+
+CACHE_METHODS = ('get', 'set', 'get_many', 'set_many', 'delete')
+
+
+class CacheCallTimer(object):
+    """
+    Calls a cache backend method, recording it in the aggregates of the current span if it's traced
+
+    Each method has an aggregate "django.cache.<method>" with the number of calls and their total duration, and the
+    counters "django.cache.keys", "django.cache.hits" and "django.cache.misses" count the keys passed and the keys
+    found and not found by get and get_many. Calls slower than slow_call_threshold milliseconds are also recorded
+    one by one, as annotations with their duration.
+    """
+    def __init__(self, api=None, slow_call_threshold=None):
+        self.api = api or get_default_api()
+        if slow_call_threshold is None:
+            slow_call_threshold = settings.ZIPKIN_CACHE_SLOW_CALL_THRESHOLD
+        self.slow_call_threshold = slow_call_threshold * 1000 if slow_call_threshold is not None else None
+        # Backends implement some methods by calling others, like get_many by calling get, those inner calls are
+        # part of the outer call
+        self.local = threading.local()
+
+    def __call__(self, method_name, method, cache, args, kwargs):
+        if getattr(self.local, 'active', False) or not self.api.store.get().is_tracing():
+            return method(cache, *args, **kwargs)
+        if method_name == 'get_many':
+            args, kwargs = self._list_keys(args, kwargs)
+        self.local.active = True
+        start = self.api.get_timestamp()
+        result = None
+        try:
+            result = method(cache, *args, **kwargs)
+            return result
+        finally:
+            self.local.active = False
+            try:
+                self._record_call(method_name, start, args, kwargs, result)
+            except Exception:
+                logging.root.exception('CacheCallTimer failed to record a call to %s' % method_name)
+
+    @staticmethod
+    def _list_keys(args, kwargs):
+        # The keys may be any iterable, like a generator, which can only be counted by consuming it
+        if args and not hasattr(args[0], '__len__'):
+            args = (list(args[0]),) + args[1:]
+        elif 'keys' in kwargs and not hasattr(kwargs['keys'], '__len__'):
+            kwargs = dict(kwargs, keys=list(kwargs['keys']))
+        return args, kwargs
+
+    def _record_call(self, method_name, start, args, kwargs, result):
+        duration = self.api.get_timestamp() - start
+        name = constants.ANNOTATION_CACHE_PREFIX + method_name
+        self.api.record_aggregate(name, duration)
+        self._record_keys(method_name, args, kwargs, result)
+        if self.slow_call_threshold is not None and duration >= self.slow_call_threshold:
+            self.api.record_event(name, duration, start)
+
+    def _record_keys(self, method_name, args, kwargs, result):
+        if method_name in ('get_many', 'set_many'):
+            keys = len(args[0]) if args else len(kwargs.get('keys', kwargs.get('data', ())))
+        else:
+            keys = 1
+        self.api.record_aggregate(constants.ANNOTATION_CACHE_KEYS, count=keys)
+        if method_name == 'get':
+            default = args[1] if len(args) > 1 else kwargs.get('default')
+            hits = 0 if result is default else 1
+        elif method_name == 'get_many':
+            hits = len(result or ())
+        else:
+            return
+        if hits:
+            self.api.record_aggregate(constants.ANNOTATION_CACHE_HITS, count=hits)
+        if keys - hits:
+            self.api.record_aggregate(constants.ANNOTATION_CACHE_MISSES, count=keys - hits)
+
+
+def instrument_cache_class(cache_class, timer):
+    """
+    Replace the CACHE_METHODS of cache_class with ones timed by timer
+    """
+    for method_name in CACHE_METHODS:
+        method = getattr(cache_class, method_name).im_func
+        if getattr(method, 'zipkin_timed', False):
+            continue
+        setattr(cache_class, method_name, _timed_method(method_name, method, timer))
+
+
+def _timed_method(method_name, method, timer):
+    @functools.wraps(method)
+    def timed_method(self, *args, **kwargs):
+        return timer(method_name, method, self, args, kwargs)
+    timed_method.zipkin_timed = True
+    return timed_method
+
+
+def install(timer=None):
+    """
+    Time the calls to the cache backends in the CACHES setting from now on
+    """
+    timer = timer or CacheCallTimer()
+    for cache in getattr(django_settings, 'CACHES', {}).values():
+        instrument_cache_class(import_class(cache['BACKEND']), timer)
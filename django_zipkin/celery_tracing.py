@@ -0,0 +1,121 @@
+import logging
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+
+from django_zipkin._thrift.zipkinCore.constants import SERVER_RECV, SERVER_SEND
+from zipkin_data import ZipkinData, ZipkinId
+from data_store import get_default as get_default_data_store
+from id_generator import get_default as get_default_id_generator
+from api import get_default as get_default_api
+from sampler import get_default as get_default_sampler
+import constants
+import defaults as settings
+
+try:
+    from celery import signals
+    has_celery = True
+except ImportError:
+    has_celery = False
+
+
+class CeleryTracer(object):
+    """
+    Passes the trace context to Celery tasks in their message headers, and traces their execution in the worker
+
+    Tasks published while a request (or another task) is traced get the X-B3-* headers of a downstream request.
+    Workers record a server span for every task execution, named after the task, which becomes a child of the
+    publisher's span. Eager tasks run in a thread already having a trace, like the thread of a request, are part of
+    its span instead.
+    """
+    def __init__(self, store=None, api=None, id_generator=None, sampler=None):
+        self.store = store or get_default_data_store()
+        self.api = api or get_default_api()
+        self.id_generator = id_generator or get_default_id_generator()
+        self.sampler = sampler or get_default_sampler()
+        self.logger = logging.getLogger(settings.ZIPKIN_LOGGER_NAME)
+        # The id of the task whose span is in the store, for each thread
+        self.local = threading.local()
+
+    def before_task_publish(self, headers=None, **kwargs):
+        try:
+            if headers is None or self.store.get().trace_id is None:
+                return
+            headers.update(self.api.get_headers_for_downstream_request())
+        except Exception:
+            logging.root.exception('CeleryTracer.before_task_publish failed')
+
+    def task_prerun(self, task_id=None, task=None, **kwargs):
+        try:
+            # Tasks run eagerly, like in the thread of a request, are part of its span. Other tasks always get one of
+            # their own, whatever an earlier task may have left in the store.
+            if self._is_eager(task.request) and self.store.get().trace_id is not None:
+                return
+            self.store.clear()
+            self.local.task_id = task_id
+            data = self._get_zipkin_data(task.request)
+            if data.trace_id is None:
+                data.trace_id = self.id_generator.generate_trace_id()
+            if data.sampled is None:
+                data.sampled = self.sampler.is_sampled(data.trace_id)
+            data.parent_span_id = data.span_id
+            data.span_id = self.id_generator.generate_span_id()
+            self.store.set(data)
+            self.api.set_rpc_name(task.name)
+            self.api.record_event(SERVER_RECV)
+            self.api.record_key_value(constants.ANNOTATION_CELERY_TASK_ID, task_id)
+        except Exception:
+            logging.root.exception('CeleryTracer.task_prerun failed')
+
+    def task_postrun(self, task_id=None, state=None, **kwargs):
+        if task_id is None or getattr(self.local, 'task_id', None) != task_id:
+            return
+        try:
+            data = self.store.get()
+            self.api.record_event(SERVER_SEND, self.api.get_elapsed_time())
+            if state is not None:
+                self.api.record_key_value(constants.ANNOTATION_CELERY_STATE, state)
+            if data.is_tracing():
+                self.logger.info(self.api.build_log_message())
+        except Exception:
+            logging.root.exception('CeleryTracer.task_postrun failed')
+        finally:
+            # The worker runs unrelated tasks next, they must not find the trace in the store
+            self.local.task_id = None
+            self.store.clear()
+
+    @staticmethod
+    def _is_eager(task_request):
+        return bool(getattr(task_request, 'is_eager', False) or getattr(task_request, 'called_directly', False))
+
+    @classmethod
+    def _get_zipkin_data(cls, task_request):
+        sampled = cls._get_header(task_request, constants.SAMPLED_HDR_NAME)
+        return ZipkinData(
+            trace_id=ZipkinId.from_hex(cls._get_header(task_request, constants.TRACE_ID_HDR_NAME)),
+            span_id=ZipkinId.from_hex(cls._get_header(task_request, constants.SPAN_ID_HDR_NAME)),
+            parent_span_id=ZipkinId.from_hex(cls._get_header(task_request, constants.PARENT_SPAN_ID_HDR_NAME)),
+            sampled=None if sampled is None else sampled == 'true',
+            flags=cls._get_header(task_request, constants.FLAGS_HDR_NAME) == '1'
+        )
+
+    @staticmethod
+    def _get_header(task_request, name):
+        # Celery 3 keeps the message headers in request.headers, Celery 4 makes them attributes of the request
+        headers = getattr(task_request, 'headers', None) or {}
+        if name in headers:
+            return headers[name]
+        return getattr(task_request, name, None)
+
+
+def install(tracer=None):
+    """
+    Trace Celery tasks published and executed by this process from now on
+    """
+    if not has_celery:
+        raise ImproperlyConfigured("ZIPKIN_CELERY_TRACING requires celery")
+    tracer = tracer or CeleryTracer()
+    signals.before_task_publish.connect(tracer.before_task_publish, weak=False)
+    signals.task_prerun.connect(tracer.task_prerun, weak=False)
+    signals.task_postrun.connect(tracer.task_postrun, weak=False)
+    return tracer
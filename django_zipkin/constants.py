@@ -1,7 +1,42 @@
 DEFAULT_ZIPKIN_SERVICE_NAME = None
 DEFAULT_ZIPKIN_LOGGER_NAME = 'zipkin'
+DEFAULT_ZIPKIN_ENDPOINT_IPV4 = None
+DEFAULT_ZIPKIN_ENDPOINT_PORT_FROM_REQUEST = True
+DEFAULT_ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST = False
 DEFAULT_ZIPKIN_DATA_STORE_CLASS = 'django_zipkin.data_store.ThreadLocalDataStore'
 DEFAULT_ZIPKIN_ID_GENERATOR_CLASS = 'django_zipkin.id_generator.SimpleIdGenerator'
+DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH = 4096
+DEFAULT_ZIPKIN_URL_POLICIES = ()
+DEFAULT_ZIPKIN_MAX_ANNOTATIONS = 500
+DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATIONS = 500
+DEFAULT_ZIPKIN_MAX_SPAN_SIZE = 256 * 1024
+DEFAULT_ZIPKIN_SAMPLER_CLASS = 'django_zipkin.sampler.TraceIdRatioSampler'
+DEFAULT_ZIPKIN_SAMPLE_RATE = 0.0
+DEFAULT_ZIPKIN_RUNTIME_CONFIG_FILE = None
+DEFAULT_ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL = 1.0
+DEFAULT_ZIPKIN_TAIL_SAMPLING = False
+DEFAULT_ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD = 1000
+DEFAULT_ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS = {}
+DEFAULT_ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE = 500
+DEFAULT_ZIPKIN_QUEUE_TIME_HEADERS = ()
+DEFAULT_ZIPKIN_MIDDLEWARE_TIMING = False
+DEFAULT_ZIPKIN_TEMPLATE_TIMING = False
+DEFAULT_ZIPKIN_TEMPLATE_MAX_RENDERS = 50
+DEFAULT_ZIPKIN_CACHE_TIMING = False
+DEFAULT_ZIPKIN_CACHE_SLOW_CALL_THRESHOLD = None
+DEFAULT_ZIPKIN_CELERY_TRACING = False
+DEFAULT_ZIPKIN_REDIS_TIMING = False
+DEFAULT_ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS = True
+DEFAULT_ZIPKIN_ERROR_MESSAGE_MAX_LENGTH = 256
+DEFAULT_ZIPKIN_ERROR_FINGERPRINT = False
+DEFAULT_ZIPKIN_STACK_SAMPLING = False
+DEFAULT_ZIPKIN_STACK_SAMPLING_INTERVAL = 10
+DEFAULT_ZIPKIN_STACK_SAMPLING_THRESHOLD = 1000
+DEFAULT_ZIPKIN_STACK_SAMPLING_MAX_STACKS = 5
+DEFAULT_ZIPKIN_PROFILE_DEBUG_REQUESTS = False
+DEFAULT_ZIPKIN_PROFILE_DIR = None
+DEFAULT_ZIPKIN_ALLOCATION_TRACKING = False
+DEFAULT_ZIPKIN_ALLOCATION_TOP_SITES = 5
 
 TRACE_ID_HDR_NAME = "X-B3-TraceId"
 SPAN_ID_HDR_NAME = "X-B3-SpanId"
@@ -11,12 +46,89 @@ FLAGS_HDR_NAME = "X-B3-Flags"
 
 ANNOTATION_HTTP_URI = 'http.uri'
 ANNOTATION_HTTP_STATUSCODE = 'http.statuscode'
+ANNOTATION_HTTP_RESPONSE_SIZE = 'http.response.size'
+ANNOTATION_QUEUE_WAIT = 'queue.wait'
+ANNOTATION_MIDDLEWARE_PREFIX = 'django.middleware:'
+ANNOTATION_TEMPLATE = 'django.template'
+ANNOTATION_TEMPLATE_PREFIX = 'django.template:'
+UNKNOWN_TEMPLATE_NAME = '<unknown>'
+ANNOTATION_CACHE_PREFIX = 'django.cache.'
+ANNOTATION_CACHE_KEYS = 'django.cache.keys'
+ANNOTATION_CACHE_HITS = 'django.cache.hits'
+ANNOTATION_CACHE_MISSES = 'django.cache.misses'
+ANNOTATION_CELERY_TASK_ID = 'celery.task_id'
+ANNOTATION_CELERY_STATE = 'celery.state'
+ANNOTATION_THRIFT_ERROR = 'thrift.error'
+ANNOTATION_ERROR = 'error'
+ANNOTATION_ERROR_CLASS = 'error.class'
+ANNOTATION_ERROR_FINGERPRINT = 'error.fingerprint'
+ANNOTATION_REDIS_PREFIX = 'redis.'
+ANNOTATION_REDIS_PIPELINE = 'redis.pipeline'
+ANNOTATION_REDIS_PIPELINE_COMMANDS = 'redis.pipeline.commands'
+UNKNOWN_REDIS_COMMAND = 'UNKNOWN'
+ANNOTATION_THREAD_START = 'thread.start'
+ANNOTATION_THREAD_FINISH = 'thread.finish'
+ANNOTATION_THREAD_QUEUE_WAIT = 'thread.queue.wait'
+ANNOTATION_THREAD_ERROR = 'thread.error'
+UNKNOWN_THREAD_TASK_NAME = '<unknown>'
+ANNOTATION_PROFILE_SAMPLES = 'profile.samples'
+ANNOTATION_PROFILE_STACKS = 'profile.stacks'
+ANNOTATION_PROFILE_FILE = 'profile.file'
+ANNOTATION_MEMORY_ALLOCATED = 'memory.allocated'
+ANNOTATION_MEMORY_PEAK = 'memory.peak'
+ANNOTATION_MEMORY_TOP_SITES = 'memory.top_sites'
+ANNOTATION_MEMORY_OBJECTS = 'memory.objects'
+ANNOTATION_MEMORY_TOP_TYPES = 'memory.top_types'
 ANNOTATION_DJANGO_VIEW_FUNC_NAME = 'django.view.func_name'
 ANNOTATION_DJANGO_VIEW_CLASS = 'django.view.class'
 ANNOTATION_DJANGO_VIEW_ARGS = 'django.view.args'
 ANNOTATION_DJANGO_VIEW_KWARGS = 'django.view.kwargs'
 ANNOTATION_DJANGO_URL_NAME = 'django.url_name'
 ANNOTATION_DJANGO_TASTYPIE_RESOURCE_NAME = 'django.tastypie.resource_name'
+ANNOTATION_SPAN_TRUNCATED = 'zipkin.truncated'
+ANNOTATION_SAMPLING_REASON = 'zipkin.sampling_reason'
+# Binary annotations recorded regardless of ZIPKIN_MAX_BINARY_ANNOTATIONS
+CORE_BINARY_ANNOTATIONS = (ANNOTATION_HTTP_STATUSCODE, ANNOTATION_ERROR, ANNOTATION_ERROR_CLASS,
+                           ANNOTATION_ERROR_FINGERPRINT, ANNOTATION_SAMPLING_REASON)
+
+SAMPLING_REASON_LATENCY = 'latency'
+SAMPLING_REASON_STATUS_CODE = 'status_code'
+SAMPLING_REASON_ERROR = 'error'
+
+TRACE_ALWAYS = 'always'
+TRACE_NEVER = 'never'
+
+# Python 2's re module supports at most 100 groups per pattern, so path policies are combined in batches
+MAX_REGEX_GROUPS = 99
+
+# RequestHeader.flags of the Finagle TTwitter protocol for debug traces
+FINAGLE_DEBUG_FLAG = 1
+
+# Keys ZipkinWsgiMiddleware adds to the WSGI environ for the Django middleware
+WSGI_URL_POLICY_KEY = 'django_zipkin.url_policy'
+WSGI_REQUEST_KEY = 'django_zipkin.request'
+# Key of the profilers running for a request in its META, which is the WSGI environ shared with the wrapper
+PROFILERS_KEY = 'django_zipkin.profilers'
+
+# Number of resolved URLs to remember on Django < 1.5
+RESOLVE_CACHE_SIZE = 1000
+ENDPOINT_CACHE_SIZE = 100
+
+# Number of innermost frames of the stacks sampled by StackSampler
+STACK_SAMPLE_DEPTH = 3
+
+# Number of hex digits in error fingerprints
+ERROR_FINGERPRINT_LENGTH = 16
+
+TRUNCATED_VALUE_SUFFIX = '...'
+
+# Request start headers are in seconds, milliseconds or microseconds since the epoch, told apart by their magnitude.
+# Values below these are taken as seconds and milliseconds respectively, the rest as microseconds.
+REQUEST_START_MAX_SECONDS = 10 ** 11
+REQUEST_START_MAX_MILLISECONDS = 10 ** 14
+
+# Annotation.duration is a Thrift i32 holding microseconds
+MAX_ANNOTATION_DURATION = 2 ** 31 - 1
 
 ANNOTATION_NO_DATA_IN_LOCAL_STORE = 'No ZipkinData in thread local store. This can happen if process_request ' + \
                                     'didn\'t run due to a previous middleware returning a response. Timing ' + \
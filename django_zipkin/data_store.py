@@ -1,10 +1,18 @@
 import threading
 import functools
 
-from utils import import_class
+from django.utils.functional import SimpleLazyObject
+
+from utils import import_class, memoize, truncate
+import constants
 import defaults as settings
 from zipkin_data import ZipkinData
-from _thrift.zipkinCore.ttypes import Annotation, BinaryAnnotation
+from _thrift.zipkinCore.ttypes import Annotation, BinaryAnnotation, AnnotationType
+from _thrift.zipkinCore.constants import CLIENT_SEND, CLIENT_RECV, SERVER_SEND, SERVER_RECV
+
+
+# The annotations giving the start and end time of spans, they are recorded regardless of the limits
+CORE_ANNOTATIONS = (SERVER_RECV, SERVER_SEND, CLIENT_SEND, CLIENT_RECV)
 
 
 class BaseDataStore(object):
@@ -24,18 +32,75 @@ class BaseDataStore(object):
         if not self.get().is_tracing():
             return
         if isinstance(annotation, Annotation):
-            self._record_annotation(annotation)
+            annotation = self._limit_annotation(annotation)
+            if annotation is not None:
+                self._record_annotation(annotation)
         elif isinstance(annotation, BinaryAnnotation):
-            self._record_binary_annotation(annotation)
+            annotation = self._limit_binary_annotation(annotation)
+            if annotation is not None:
+                self._record_binary_annotation(annotation)
         else:
             raise ValueError("Argument to %s.record must be an instance of Annotation or BinaryAnnotation" % self.__class__.__name__)
 
+    def _limit_annotation(self, annotation):
+        annotations, max_count = self.get_annotations(), settings.ZIPKIN_MAX_ANNOTATIONS
+        if max_count is None or len(annotations) < max_count or annotation.value in CORE_ANNOTATIONS:
+            return annotation
+        # The first annotation over the limit is replaced by a marker, the ones after it are dropped
+        if self._is_truncated((a.value for a in reversed(annotations)), CORE_ANNOTATIONS):
+            return None
+        return Annotation(annotation.timestamp, constants.ANNOTATION_SPAN_TRUNCATED, annotation.host)
+
+    def _limit_binary_annotation(self, annotation):
+        annotations, max_count = self.get_binary_annotations(), settings.ZIPKIN_MAX_BINARY_ANNOTATIONS
+        if max_count is not None and len(annotations) >= max_count and \
+                annotation.key not in constants.CORE_BINARY_ANNOTATIONS:
+            if self._is_truncated((a.key for a in reversed(annotations)), constants.CORE_BINARY_ANNOTATIONS):
+                return None
+            return BinaryAnnotation(constants.ANNOTATION_SPAN_TRUNCATED, '1', AnnotationType.BOOL, annotation.host)
+        # Deferred annotations don't have a value yet, they are truncated when it's computed
+        if annotation.annotation_type == AnnotationType.STRING and annotation.value is not None:
+            value = truncate(annotation.value, settings.ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH,
+                             constants.TRUNCATED_VALUE_SUFFIX)
+            if value is not annotation.value:
+                return BinaryAnnotation(annotation.key, value, annotation.annotation_type, annotation.host)
+        return annotation
+
+    @staticmethod
+    def _is_truncated(names, exempt_names):
+        # Past the limit only the exempt annotations are recorded, so going back from the last one, the marker is
+        # found before any other annotation
+        for name in names:
+            if name == constants.ANNOTATION_SPAN_TRUNCATED:
+                return True
+            if name not in exempt_names:
+                return False
+        return False
+
     def set_rpc_name(self, name):
         raise NotImplementedError
 
     def get_rpc_name(self):
         raise NotImplementedError
 
+    def set_start_time(self, start_time):
+        raise NotImplementedError
+
+    def get_start_time(self):
+        raise NotImplementedError
+
+    def set_endpoint(self, endpoint):
+        raise NotImplementedError
+
+    def get_endpoint(self):
+        raise NotImplementedError
+
+    def get_aggregates(self):
+        """
+        The dict of aggregated durations of the current span, which is updated in place
+        """
+        raise NotImplementedError
+
     def get_annotations(self):
         raise NotImplementedError
 
@@ -92,13 +157,49 @@ class ThreadLocalDataStore(BaseDataStore):
     def get_rpc_name(self):
         return self.thread_local_data.rpc_name
 
+    @_clear_and_retry_on_attribute_error
+    def set_start_time(self, start_time):
+        self.thread_local_data.start_time = start_time
+
+    @_clear_and_retry_on_attribute_error
+    def get_start_time(self):
+        return self.thread_local_data.start_time
+
+    @_clear_and_retry_on_attribute_error
+    def set_endpoint(self, endpoint):
+        self.thread_local_data.endpoint = endpoint
+
+    @_clear_and_retry_on_attribute_error
+    def get_endpoint(self):
+        return self.thread_local_data.endpoint
+
+    @_clear_and_retry_on_attribute_error
+    def get_aggregates(self):
+        return self.thread_local_data.aggregates
+
     @classmethod
     def clear(cls):
-        cls.thread_local_data = threading.local()
-        cls.thread_local_data.zipkin_data = ZipkinData()
-        cls.thread_local_data.annotations = []
-        cls.thread_local_data.binary_annotations = []
-        cls.thread_local_data.rpc_name = None
+        # Only the data of the current thread is reset, the other threads may be in the middle of their own spans
+        try:
+            cls._reset(cls.thread_local_data)
+        except AttributeError:
+            cls.thread_local_data = threading.local()
+            cls._reset(cls.thread_local_data)
+
+    @staticmethod
+    def _reset(thread_local_data):
+        thread_local_data.zipkin_data = ZipkinData()
+        thread_local_data.annotations = []
+        thread_local_data.binary_annotations = []
+        thread_local_data.rpc_name = None
+        thread_local_data.start_time = None
+        thread_local_data.endpoint = None
+        thread_local_data.aggregates = {}
+
+
+@memoize
+def get_default():
+    return import_class(settings.ZIPKIN_DATA_STORE_CLASS)()
 
 
-default = import_class(settings.ZIPKIN_DATA_STORE_CLASS)()
+default = SimpleLazyObject(get_default)
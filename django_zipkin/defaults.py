@@ -1,8 +1,62 @@
 from django.conf import settings
 from constants import DEFAULT_ZIPKIN_DATA_STORE_CLASS, DEFAULT_ZIPKIN_LOGGER_NAME, \
-    DEFAULT_ZIPKIN_SERVICE_NAME, DEFAULT_ZIPKIN_ID_GENERATOR_CLASS
+    DEFAULT_ZIPKIN_SERVICE_NAME, DEFAULT_ZIPKIN_ID_GENERATOR_CLASS, DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH, \
+    DEFAULT_ZIPKIN_URL_POLICIES, DEFAULT_ZIPKIN_MAX_ANNOTATIONS, DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATIONS, \
+    DEFAULT_ZIPKIN_MAX_SPAN_SIZE, DEFAULT_ZIPKIN_TAIL_SAMPLING, DEFAULT_ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD, \
+    DEFAULT_ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS, DEFAULT_ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE, \
+    DEFAULT_ZIPKIN_SAMPLER_CLASS, DEFAULT_ZIPKIN_SAMPLE_RATE, DEFAULT_ZIPKIN_RUNTIME_CONFIG_FILE, \
+    DEFAULT_ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL, DEFAULT_ZIPKIN_ENDPOINT_IPV4, \
+    DEFAULT_ZIPKIN_ENDPOINT_PORT_FROM_REQUEST, DEFAULT_ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST, \
+    DEFAULT_ZIPKIN_QUEUE_TIME_HEADERS, DEFAULT_ZIPKIN_MIDDLEWARE_TIMING, \
+    DEFAULT_ZIPKIN_TEMPLATE_TIMING, DEFAULT_ZIPKIN_TEMPLATE_MAX_RENDERS, \
+    DEFAULT_ZIPKIN_CACHE_TIMING, DEFAULT_ZIPKIN_CACHE_SLOW_CALL_THRESHOLD, \
+    DEFAULT_ZIPKIN_CELERY_TRACING, DEFAULT_ZIPKIN_REDIS_TIMING, DEFAULT_ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS, \
+    DEFAULT_ZIPKIN_ERROR_MESSAGE_MAX_LENGTH, DEFAULT_ZIPKIN_ERROR_FINGERPRINT, DEFAULT_ZIPKIN_STACK_SAMPLING, \
+    DEFAULT_ZIPKIN_STACK_SAMPLING_INTERVAL, DEFAULT_ZIPKIN_STACK_SAMPLING_THRESHOLD, \
+    DEFAULT_ZIPKIN_STACK_SAMPLING_MAX_STACKS, DEFAULT_ZIPKIN_PROFILE_DEBUG_REQUESTS, \
+    DEFAULT_ZIPKIN_PROFILE_DIR, DEFAULT_ZIPKIN_ALLOCATION_TRACKING, DEFAULT_ZIPKIN_ALLOCATION_TOP_SITES
 
 ZIPKIN_SERVICE_NAME = getattr(settings, 'ZIPKIN_SERVICE_NAME', DEFAULT_ZIPKIN_SERVICE_NAME)
 ZIPKIN_LOGGER_NAME = getattr(settings, 'ZIPKIN_LOGGER_NAME', DEFAULT_ZIPKIN_LOGGER_NAME)
 ZIPKIN_DATA_STORE_CLASS = getattr(settings, 'ZIPKIN_DATA_STORE_CLASS', DEFAULT_ZIPKIN_DATA_STORE_CLASS)
 ZIPKIN_ID_GENERATOR_CLASS = getattr(settings, 'ZIPKIN_ID_GENERATOR_CLASS', DEFAULT_ZIPKIN_ID_GENERATOR_CLASS)
+ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH = getattr(settings, 'ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH',
+                                                    DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH)
+ZIPKIN_URL_POLICIES = getattr(settings, 'ZIPKIN_URL_POLICIES', DEFAULT_ZIPKIN_URL_POLICIES)
+ZIPKIN_MAX_ANNOTATIONS = getattr(settings, 'ZIPKIN_MAX_ANNOTATIONS', DEFAULT_ZIPKIN_MAX_ANNOTATIONS)
+ZIPKIN_MAX_BINARY_ANNOTATIONS = getattr(settings, 'ZIPKIN_MAX_BINARY_ANNOTATIONS', DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATIONS)
+ZIPKIN_MAX_SPAN_SIZE = getattr(settings, 'ZIPKIN_MAX_SPAN_SIZE', DEFAULT_ZIPKIN_MAX_SPAN_SIZE)
+ZIPKIN_TAIL_SAMPLING = getattr(settings, 'ZIPKIN_TAIL_SAMPLING', DEFAULT_ZIPKIN_TAIL_SAMPLING)
+ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD = getattr(settings, 'ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD',
+                                                 DEFAULT_ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD)
+ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS = getattr(settings, 'ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS',
+                                                           DEFAULT_ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS)
+ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE = getattr(settings, 'ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE',
+                                               DEFAULT_ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE)
+ZIPKIN_SAMPLER_CLASS = getattr(settings, 'ZIPKIN_SAMPLER_CLASS', DEFAULT_ZIPKIN_SAMPLER_CLASS)
+ZIPKIN_SAMPLE_RATE = getattr(settings, 'ZIPKIN_SAMPLE_RATE', DEFAULT_ZIPKIN_SAMPLE_RATE)
+ZIPKIN_RUNTIME_CONFIG_FILE = getattr(settings, 'ZIPKIN_RUNTIME_CONFIG_FILE', DEFAULT_ZIPKIN_RUNTIME_CONFIG_FILE)
+ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL = getattr(settings, 'ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL',
+                                              DEFAULT_ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL)
+ZIPKIN_ENDPOINT_IPV4 = getattr(settings, 'ZIPKIN_ENDPOINT_IPV4', DEFAULT_ZIPKIN_ENDPOINT_IPV4)
+ZIPKIN_ENDPOINT_PORT_FROM_REQUEST = getattr(settings, 'ZIPKIN_ENDPOINT_PORT_FROM_REQUEST', DEFAULT_ZIPKIN_ENDPOINT_PORT_FROM_REQUEST)
+ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST = getattr(settings, 'ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST', DEFAULT_ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST)
+ZIPKIN_QUEUE_TIME_HEADERS = getattr(settings, 'ZIPKIN_QUEUE_TIME_HEADERS', DEFAULT_ZIPKIN_QUEUE_TIME_HEADERS)
+ZIPKIN_MIDDLEWARE_TIMING = getattr(settings, 'ZIPKIN_MIDDLEWARE_TIMING', DEFAULT_ZIPKIN_MIDDLEWARE_TIMING)
+ZIPKIN_TEMPLATE_TIMING = getattr(settings, 'ZIPKIN_TEMPLATE_TIMING', DEFAULT_ZIPKIN_TEMPLATE_TIMING)
+ZIPKIN_TEMPLATE_MAX_RENDERS = getattr(settings, 'ZIPKIN_TEMPLATE_MAX_RENDERS', DEFAULT_ZIPKIN_TEMPLATE_MAX_RENDERS)
+ZIPKIN_CACHE_TIMING = getattr(settings, 'ZIPKIN_CACHE_TIMING', DEFAULT_ZIPKIN_CACHE_TIMING)
+ZIPKIN_CACHE_SLOW_CALL_THRESHOLD = getattr(settings, 'ZIPKIN_CACHE_SLOW_CALL_THRESHOLD', DEFAULT_ZIPKIN_CACHE_SLOW_CALL_THRESHOLD)
+ZIPKIN_CELERY_TRACING = getattr(settings, 'ZIPKIN_CELERY_TRACING', DEFAULT_ZIPKIN_CELERY_TRACING)
+ZIPKIN_REDIS_TIMING = getattr(settings, 'ZIPKIN_REDIS_TIMING', DEFAULT_ZIPKIN_REDIS_TIMING)
+ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS = getattr(settings, 'ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS', DEFAULT_ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS)
+ZIPKIN_ERROR_MESSAGE_MAX_LENGTH = getattr(settings, 'ZIPKIN_ERROR_MESSAGE_MAX_LENGTH', DEFAULT_ZIPKIN_ERROR_MESSAGE_MAX_LENGTH)
+ZIPKIN_ERROR_FINGERPRINT = getattr(settings, 'ZIPKIN_ERROR_FINGERPRINT', DEFAULT_ZIPKIN_ERROR_FINGERPRINT)
+ZIPKIN_STACK_SAMPLING = getattr(settings, 'ZIPKIN_STACK_SAMPLING', DEFAULT_ZIPKIN_STACK_SAMPLING)
+ZIPKIN_STACK_SAMPLING_INTERVAL = getattr(settings, 'ZIPKIN_STACK_SAMPLING_INTERVAL', DEFAULT_ZIPKIN_STACK_SAMPLING_INTERVAL)
+ZIPKIN_STACK_SAMPLING_THRESHOLD = getattr(settings, 'ZIPKIN_STACK_SAMPLING_THRESHOLD', DEFAULT_ZIPKIN_STACK_SAMPLING_THRESHOLD)
+ZIPKIN_STACK_SAMPLING_MAX_STACKS = getattr(settings, 'ZIPKIN_STACK_SAMPLING_MAX_STACKS', DEFAULT_ZIPKIN_STACK_SAMPLING_MAX_STACKS)
+ZIPKIN_PROFILE_DEBUG_REQUESTS = getattr(settings, 'ZIPKIN_PROFILE_DEBUG_REQUESTS', DEFAULT_ZIPKIN_PROFILE_DEBUG_REQUESTS)
+ZIPKIN_PROFILE_DIR = getattr(settings, 'ZIPKIN_PROFILE_DIR', DEFAULT_ZIPKIN_PROFILE_DIR)
+ZIPKIN_ALLOCATION_TRACKING = getattr(settings, 'ZIPKIN_ALLOCATION_TRACKING', DEFAULT_ZIPKIN_ALLOCATION_TRACKING)
+ZIPKIN_ALLOCATION_TOP_SITES = getattr(settings, 'ZIPKIN_ALLOCATION_TOP_SITES', DEFAULT_ZIPKIN_ALLOCATION_TOP_SITES)
@@ -1,7 +1,9 @@
 import random
 
+from django.utils.functional import SimpleLazyObject
+
 from zipkin_data import ZipkinId
-from utils import import_class
+from utils import import_class, memoize
 import defaults as settings
 
 
@@ -25,4 +27,9 @@ class SimpleIdGenerator(BaseIdGenerator):
         return self.generate_id()
 
 
-default = import_class(settings.ZIPKIN_ID_GENERATOR_CLASS)()
+@memoize
+def get_default():
+    return import_class(settings.ZIPKIN_ID_GENERATOR_CLASS)()
+
+
+default = SimpleLazyObject(get_default)
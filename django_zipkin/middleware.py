@@ -1,11 +1,22 @@
+import re
+import os
+import sys
 import logging
+import hashlib
+import traceback
 import django
 import json
+import weakref
+from django.utils.encoding import force_text
 from django_zipkin._thrift.zipkinCore.constants import SERVER_RECV, SERVER_SEND
 from zipkin_data import ZipkinData, ZipkinId
-from data_store import default as default_data_store
-from id_generator import default as default_id_generator
-from api import api as default_api
+from data_store import get_default as get_default_data_store
+from id_generator import get_default as get_default_id_generator
+from api import get_default as get_default_api
+from runtime_config import default_url_policies
+from sampler import get_default as get_default_sampler, default_tail_sampler
+from profiling import get_default_profilers
+from utils import truncate
 import constants
 import defaults as settings
 
@@ -13,9 +24,19 @@ import defaults as settings
 if django.VERSION[0] == 1 and django.VERSION[1] < 5:
     from django.core.urlresolvers import resolve
 
-    # TODO: caching the resolutions may be a good idea
+    _resolve_cache = {}
+
     def resolve_request(request):
-        return resolve(request.path_info)
+        path = request.path_info
+        try:
+            return _resolve_cache[path]
+        except KeyError:
+            pass
+        match = resolve(path)
+        if len(_resolve_cache) >= constants.RESOLVE_CACHE_SIZE:
+            _resolve_cache.clear()
+        _resolve_cache[path] = match
+        return match
 elif django.VERSION[0] == 1 and django.VERSION[1] >= 5:
     def resolve_request(request):  # pyflakes:ignore
         return request.resolver_match
@@ -24,6 +45,9 @@ else:
         return None
 
 
+_ipv4_re = re.compile(r'^\d{1,3}(\.\d{1,3}){3}$')
+
+
 def _hdr_to_meta_key(h):
     return 'HTTP_' + h.upper().replace('-', '_')
 
@@ -34,84 +58,485 @@ class ZipkinDjangoRequestParser(object):
     parent_span_id_hdr_name = _hdr_to_meta_key(constants.PARENT_SPAN_ID_HDR_NAME)
     sampled_hdr_name = _hdr_to_meta_key(constants.SAMPLED_HDR_NAME)
     flags_hdr_name = _hdr_to_meta_key(constants.FLAGS_HDR_NAME)
+    request_start_hdr_names = [_hdr_to_meta_key(h) for h in settings.ZIPKIN_QUEUE_TIME_HEADERS]
 
     def get_zipkin_data(self, request):
         return ZipkinData(
             trace_id=ZipkinId.from_hex(request.META.get(self.trace_id_hdr_name, None)),
             span_id=ZipkinId.from_hex(request.META.get(self.span_id_hdr_name, None)),
             parent_span_id=ZipkinId.from_hex(request.META.get(self.parent_span_id_hdr_name, None)),
-            sampled=request.META.get(self.sampled_hdr_name, 'false') == 'true',
+            sampled=self._parse_sampled(request.META.get(self.sampled_hdr_name, None)),
             flags=request.META.get(self.flags_hdr_name, '0') == '1'
         )
 
+    @staticmethod
+    def _parse_sampled(value):
+        # None means the upstream service didn't make a sampling decision
+        if value is None:
+            return None
+        return value == 'true'
+
+    def get_request_start(self, request):
+        """
+        When a proxy in front of us received the request in microseconds since the epoch, or None if it's not known
+        """
+        for name in self.request_start_hdr_names:
+            value = request.META.get(name)
+            if value:
+                request_start = self._parse_request_start(value)
+                if request_start is not None:
+                    return request_start
+        return None
+
+    @staticmethod
+    def _parse_request_start(value):
+        # Formats in use are "t=<timestamp>" and the bare timestamp, in seconds (possibly with a fraction),
+        # milliseconds or microseconds
+        if value.startswith('t='):
+            value = value[2:]
+        try:
+            request_start = float(value)
+        except ValueError:
+            return None
+        if request_start <= 0:
+            return None
+        if request_start < constants.REQUEST_START_MAX_SECONDS:
+            return int(request_start * 1000 * 1000)
+        if request_start < constants.REQUEST_START_MAX_MILLISECONDS:
+            return int(request_start * 1000)
+        return int(request_start)
+
+
+class StreamingContentIterator(object):
+    """
+    Passes through the content of a streaming response, calling on_close with the number of bytes sent once the
+    content is exhausted or closed
+    """
+    def __init__(self, content, on_close):
+        self.iterator = iter(content)
+        self.on_close = on_close
+        self.size = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        try:
+            chunk = next(self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+        self.size += len(chunk)
+        return chunk
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if hasattr(self.iterator, 'close'):
+                self.iterator.close()
+        finally:
+            self.on_close(self.size)
+
+
+class CloseCallback(object):
+    """
+    Calls on_close the first time it's closed
+    """
+    def __init__(self, on_close):
+        self.on_close = on_close
+        self.closed = False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.on_close()
+
+
+class FileToStream(object):
+    """
+    Stands in for the file of a FileResponse, also closing close_callback when the file is closed
+
+    Django 1.8 doesn't close responses sent with wsgi.file_wrapper, only their file. Everything else goes to the file,
+    so servers can still send it with sendfile.
+    """
+    def __init__(self, filelike, close_callback):
+        self.filelike = filelike
+        self.close_callback = close_callback
+
+    def __getattr__(self, name):
+        return getattr(self.filelike, name)
+
+    def close(self):
+        try:
+            self.filelike.close()
+        finally:
+            self.close_callback.close()
+
 
 class ZipkinMiddleware(object):
-    def __init__(self, store=None, request_parser=None, id_generator=None, api=None):
-        self.store = store or default_data_store
+    def __init__(self, store=None, request_parser=None, id_generator=None, api=None, url_policies=None,
+                 tail_sampler=None, sampler=None, profilers=None):
+        self.store = store or get_default_data_store()
         self.request_parser = request_parser or ZipkinDjangoRequestParser()
-        self.id_generator = id_generator or default_id_generator
-        self.api = api or default_api
+        self.id_generator = id_generator or get_default_id_generator()
+        self.api = api or get_default_api()
+        self.url_policies = url_policies or default_url_policies
+        self.tail_sampler = tail_sampler or default_tail_sampler
+        self.sampler = sampler or get_default_sampler()
+        self.profilers = get_default_profilers() if profilers is None else profilers
         self.logger = logging.getLogger(settings.ZIPKIN_LOGGER_NAME)
+        # Pre-encoded annotations describing view functions and URL names, so they are only introspected once
+        self.view_annotations = weakref.WeakKeyDictionary()
+        self.url_name_annotations = {}
 
     def process_request(self, request):
         try:
-            self.store.clear()
-            data = self.request_parser.get_zipkin_data(request)
-            if data.trace_id is None:
-                data.trace_id = self.id_generator.generate_trace_id()
-            data.parent_span_id = data.span_id
-            data.span_id = self.id_generator.generate_span_id()
-            self.store.set(data)
-            self.api.set_rpc_name(request.method)
-            self.api.record_event(SERVER_RECV)
-            self.api.record_key_value(constants.ANNOTATION_HTTP_URI, request.get_full_path())
+            if self._join_wsgi_span(request):
+                return
+            self.start_span(request)
         except Exception:
             logging.root.exception('ZipkinMiddleware.process_request failed')
 
+    @staticmethod
+    def _join_wsgi_span(request):
+        """
+        Returns True if ZipkinWsgiMiddleware opened the span of the request, it's then left to it to close the span
+        """
+        if constants.WSGI_URL_POLICY_KEY not in request.META:
+            return False
+        request._zipkin_url_policy = request.META[constants.WSGI_URL_POLICY_KEY]
+        # The WSGI middleware needs the resolved request for tail sampling
+        request.META[constants.WSGI_REQUEST_KEY] = request
+        return True
+
+    def start_span(self, request):
+        """
+        Set up the span of the request in the store, returns its ZipkinData or None if the request isn't traced
+        """
+        request._zipkin_url_policy = policy = self.url_policies.match_path(request.path_info)
+        self.store.clear()
+        if policy is not None and policy.trace == constants.TRACE_NEVER:
+            return None
+        data = self.request_parser.get_zipkin_data(request)
+        if policy is not None and policy.trace == constants.TRACE_ALWAYS:
+            data.sampled = True
+        if data.trace_id is None:
+            data.trace_id = self.id_generator.generate_trace_id()
+        if data.sampled is None:
+            data.sampled = self.sampler.is_sampled(data.trace_id)
+            # Only a local decision can be revisited, the parent of an upstream unsampled span isn't recorded
+            if self.tail_sampler is not None and not data.is_tracing():
+                data.provisional = True
+        data.parent_span_id = data.span_id
+        data.span_id = self.id_generator.generate_span_id()
+        self.store.set(data)
+        self._set_endpoint(request)
+        self.api.set_rpc_name(request.method)
+        self.api.record_event(SERVER_RECV)
+        self.api.record_key_value_deferred(constants.ANNOTATION_HTTP_URI, request.get_full_path)
+        if data.is_tracing():
+            self._record_queue_wait(request)
+            if self.profilers:
+                self._start_profilers(request, data)
+        return data
+
+    def _record_queue_wait(self, request):
+        request_start = self.request_parser.get_request_start(request)
+        if request_start is None:
+            return
+        # Negative waits come from clock differences between the hosts, they carry no information
+        wait = self.api.get_start_timestamp() - request_start
+        if 0 <= wait <= constants.MAX_ANNOTATION_DURATION:
+            self.api.record_event(constants.ANNOTATION_QUEUE_WAIT, duration=wait, timestamp=request_start)
+
+    def _start_profilers(self, request, data):
+        running = []
+        for profiler in self.profilers:
+            try:
+                state = profiler.start(request, data)
+            except Exception:
+                logging.root.exception('%s.start failed' % profiler.__class__.__name__)
+                continue
+            if state is not None:
+                running.append((profiler, state))
+        request.META[constants.PROFILERS_KEY] = running
+
+    def detach_profilers(self, request, data):
+        """
+        Let the profilers of the request know its span will be finished later, maybe from another thread
+
+        Call it in the thread serving the request, when finish_span is deferred until the response is closed.
+        """
+        for profiler, state in request.META.get(constants.PROFILERS_KEY, ()):
+            try:
+                profiler.detach(request, data, state)
+            except Exception:
+                logging.root.exception('%s.detach failed' % profiler.__class__.__name__)
+
+    def _stop_profilers(self, request, data, duration):
+        for profiler, state in request.META.pop(constants.PROFILERS_KEY, ()):
+            try:
+                profiler.stop(request, data, state, duration)
+            except Exception:
+                logging.root.exception('%s.stop failed' % profiler.__class__.__name__)
+
+    def _set_endpoint(self, request):
+        port = ipv4 = None
+        if settings.ZIPKIN_ENDPOINT_PORT_FROM_REQUEST:
+            try:
+                port = int(request.META['SERVER_PORT'])
+            except (KeyError, TypeError, ValueError):
+                pass
+            if port is not None and not 0 < port < 65536:
+                port = None
+        if settings.ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST:
+            # SERVER_NAME is usually a host name, only literal addresses are used
+            server_name = request.META.get('SERVER_NAME')
+            if isinstance(server_name, basestring) and _ipv4_re.match(server_name):
+                ipv4 = server_name
+        if port is not None or ipv4 is not None:
+            self.api.set_endpoint(port, ipv4)
+
     def process_view(self, request, view_func, view_args, view_kwargs):
         try:
+            if self._is_untraced(request):
+                return
             if self.store.get().trace_id is None:
                 self.process_request(request)
+            policy = getattr(request, '_zipkin_url_policy', None)
             # Get the URL name if we can
-            try:
-                self.api.record_key_value(constants.ANNOTATION_DJANGO_URL_NAME, resolve_request(request).url_name)
-            except:
-                pass
-            # Simple view function
-            if hasattr(view_func, 'func_name'):
-                self.api.record_key_value(constants.ANNOTATION_DJANGO_VIEW_FUNC_NAME, view_func.func_name)
-            # View method on a class-based view
-            if hasattr(view_func, 'im_class'):
-                self.api.record_key_value(constants.ANNOTATION_DJANGO_VIEW_CLASS, view_func.im_class.__name__)
-            if hasattr(view_func, 'im_func'):
-                self.api.record_key_value(constants.ANNOTATION_DJANGO_VIEW_FUNC_NAME, view_func.im_func.func_name)
+            url_name = self._get_url_name(request)
+            if url_name is not None:
+                policy = self.url_policies.match_url_name(url_name) or policy
+            if policy is not None and policy.trace is not None:
+                self._apply_trace_policy(request, policy.trace)
+            if url_name is not None:
+                self.api.record_encoded_key_value(self._get_url_name_annotation(url_name))
+            for annotation in self._get_view_annotations(view_func):
+                self.api.record_encoded_key_value(annotation)
             # Wrappers not using functools.wraps, and especially wrappers on view methods on class-based views
             # mess up the above logic. Next up is special casing for django-tastypie, to make the span a bit more useful
             if 'resource_name' in view_kwargs:
                 self.api.record_key_value(constants.ANNOTATION_DJANGO_TASTYPIE_RESOURCE_NAME, view_kwargs['resource_name'])
                 del view_kwargs['resource_name']
-            self.api.record_key_value(constants.ANNOTATION_DJANGO_VIEW_ARGS, json.dumps(view_args))
-            self.api.record_key_value(constants.ANNOTATION_DJANGO_VIEW_KWARGS, json.dumps(view_kwargs))
+            # Serializing the arguments is deferred until the span is encoded, and skipped if it's not sampled
+            if policy is None or policy.record_view_args:
+                self.api.record_key_value_deferred(constants.ANNOTATION_DJANGO_VIEW_ARGS, json.dumps, view_args)
+            if policy is None or policy.record_view_kwargs:
+                self.api.record_key_value_deferred(constants.ANNOTATION_DJANGO_VIEW_KWARGS, json.dumps, dict(view_kwargs))
         except Exception:
             logging.root.exception('ZipkinMiddleware.process_view failed')
 
+    @staticmethod
+    def _is_untraced(request):
+        policy = getattr(request, '_zipkin_url_policy', None)
+        return policy is not None and policy.trace == constants.TRACE_NEVER
+
+    @staticmethod
+    def _get_url_name(request):
+        try:
+            return resolve_request(request).url_name
+        except Exception:
+            return None
+
+    def _apply_trace_policy(self, request, trace):
+        data = self.store.get()
+        if trace == constants.TRACE_NEVER:
+            data.sampled = data.flags = data.provisional = False
+        elif data.is_provisional():
+            data.sampled = True
+        elif not data.is_tracing():
+            # The URL name is only known after process_request, so the annotations recorded there were dropped
+            data.sampled = True
+            self.api.record_event(SERVER_RECV, timestamp=self.api.get_start_timestamp())
+            self.api.record_key_value_deferred(constants.ANNOTATION_HTTP_URI, request.get_full_path)
+            self._record_queue_wait(request)
+
+    def _get_url_name_annotation(self, url_name):
+        annotation = self.url_name_annotations.get(url_name)
+        if annotation is None:
+            annotation = self.url_name_annotations[url_name] = \
+                self.api.encode_key_value(constants.ANNOTATION_DJANGO_URL_NAME, url_name)
+        return annotation
+
+    def _get_view_annotations(self, view_func):
+        try:
+            return self.view_annotations[view_func]
+        except (KeyError, TypeError):
+            pass
+        annotations = [self.api.encode_key_value(key, value) for key, value in self._describe_view(view_func)]
+        try:
+            self.view_annotations[view_func] = annotations
+        except TypeError:
+            pass  # The view can't be weakly referenced, so it can't be cached either
+        return annotations
+
+    @staticmethod
+    def _describe_view(view_func):
+        description = []
+        # Simple view function
+        if hasattr(view_func, 'func_name'):
+            description.append((constants.ANNOTATION_DJANGO_VIEW_FUNC_NAME, view_func.func_name))
+        # View method on a class-based view
+        if hasattr(view_func, 'im_class'):
+            description.append((constants.ANNOTATION_DJANGO_VIEW_CLASS, view_func.im_class.__name__))
+        if hasattr(view_func, 'im_func'):
+            description.append((constants.ANNOTATION_DJANGO_VIEW_FUNC_NAME, view_func.im_func.func_name))
+        return description
+
+    def process_exception(self, request, exception):
+        try:
+            if self._is_untraced(request):
+                return
+            # Tail sampling keeps the span by this, even if a later middleware turns the exception into a response
+            request._zipkin_error = True
+            if self.store.get().is_tracing():
+                self._record_exception(exception, sys.exc_info()[2])
+        except Exception:
+            logging.root.exception('ZipkinMiddleware.process_exception failed')
+
+    def _record_exception(self, exception, tb):
+        message = truncate(force_text(exception, errors='replace'), settings.ZIPKIN_ERROR_MESSAGE_MAX_LENGTH,
+                           constants.TRUNCATED_VALUE_SUFFIX)
+        self.api.record_key_value(constants.ANNOTATION_ERROR, message or exception.__class__.__name__)
+        self.api.record_key_value(constants.ANNOTATION_ERROR_CLASS, self._get_class_name(exception.__class__))
+        if settings.ZIPKIN_ERROR_FINGERPRINT:
+            self.api.record_key_value(constants.ANNOTATION_ERROR_FINGERPRINT,
+                                      self._get_exception_fingerprint(exception, tb))
+
+    @staticmethod
+    def _get_class_name(cls):
+        if cls.__module__ in ('exceptions', 'builtins'):
+            return cls.__name__
+        return '%s.%s' % (cls.__module__, cls.__name__)
+
+    @classmethod
+    def _get_exception_fingerprint(cls, exception, tb):
+        """
+        A short hash of the exception class and the functions it was raised through
+
+        Line numbers and directories are left out, so the fingerprint of an error stays the same across deployments
+        and unrelated changes of the code.
+        """
+        frames = ['%s:%s' % (os.path.basename(filename), name) for filename, _, name, _ in traceback.extract_tb(tb)]
+        fingerprint = '|'.join([cls._get_class_name(exception.__class__)] + frames)
+        return hashlib.md5(fingerprint).hexdigest()[:constants.ERROR_FINGERPRINT_LENGTH]
+
     def process_response(self, request, response):
         try:
+            if self._is_untraced(request) or constants.WSGI_URL_POLICY_KEY in request.META:
+                return response
             data = self.store.get()
             if data.trace_id is None:
                 self.process_request(request)
                 self.api.record_event(constants.ANNOTATION_NO_DATA_IN_LOCAL_STORE)
                 data = self.store.get()
-            self.api.record_event(SERVER_SEND)
-            self.api.record_key_value(constants.ANNOTATION_HTTP_STATUSCODE, response.status_code)
-            if data.is_tracing():
-                self.logger.info(self.api.build_log_message())
+            self._finish_response_span(request, response, data)
         except Exception:
             logging.root.exception('ZipkinMiddleware.process_response failed')
         return response
 
+    def _finish_response_span(self, request, response, data):
+        if not getattr(response, 'streaming', False):
+            self.finish_span(request, response.status_code, data)
+            return
+
+        def on_close(size):
+            try:
+                if size is not None:
+                    self.api.record_key_value(constants.ANNOTATION_HTTP_RESPONSE_SIZE, size)
+                self.finish_span(request, response.status_code, data)
+            except Exception:
+                logging.root.exception('ZipkinMiddleware failed to finish span of streaming response')
+        # The body is sent after the middleware returns, the span is finished when it's done
+        if self.profilers:
+            self.detach_profilers(request, data)
+        if getattr(response, 'file_to_stream', None) is not None:
+            # Replacing the content would keep servers from sending the file with wsgi.file_wrapper (like sendfile),
+            # the file is left alone and its size is taken instead of counting the bytes sent
+            size = self._get_file_size(response)
+            close_callback = CloseCallback(lambda: on_close(size))
+            response._closable_objects.append(close_callback)
+            response.file_to_stream = FileToStream(response.file_to_stream, close_callback)
+            return
+        # Django closes the new content when the response is closed, even if it wasn't iterated to the end
+        response.streaming_content = StreamingContentIterator(response.streaming_content, on_close)
+
+    @staticmethod
+    def _get_file_size(response):
+        if response.has_header('Content-Length'):
+            try:
+                return int(response['Content-Length'])
+            except ValueError:
+                return None
+        filelike = response.file_to_stream
+        try:
+            return os.fstat(filelike.fileno()).st_size - filelike.tell()
+        except (AttributeError, EnvironmentError, ValueError):
+            return None
+
+    def finish_span(self, request, status_code, data):
+        """
+        Record the end of the span of the request started by start_span, and send it if it's kept
+        """
+        duration = self.api.get_elapsed_time()
+        if self.profilers:
+            self._stop_profilers(request, data, duration)
+        self.api.record_event(SERVER_SEND, duration)
+        self.api.record_key_value(constants.ANNOTATION_HTTP_STATUSCODE, status_code)
+        if data.is_provisional() and not self._keep_provisional_span(request, status_code, duration):
+            return
+        if data.is_tracing():
+            self.logger.info(self.api.build_log_message())
+
+    def _keep_provisional_span(self, request, status_code, duration):
+        reason = self.tail_sampler.get_reason_to_keep(self._get_url_name(request), status_code, duration,
+                                                      error=getattr(request, '_zipkin_error', False))
+        if reason is None:
+            return False
+        self.api.record_key_value(constants.ANNOTATION_SAMPLING_REASON, reason)
+        return True
+
     def _build_trace(self):
         pass
 
     def _build_annotation(self, value):
         pass
+
+
+class ZipkinCallableMiddleware(ZipkinMiddleware):
+    """
+    ZipkinMiddleware for the MIDDLEWARE setting of Django 1.10 and later
+
+    The span is opened before the rest of the middleware chain is called and closed after it returns, in one call,
+    so it covers everything the chain does. View annotations are still recorded by process_view.
+    """
+    def __init__(self, get_response=None, **kwargs):
+        super(ZipkinCallableMiddleware, self).__init__(**kwargs)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            data = None if self._join_wsgi_span(request) else self.start_span(request)
+        except Exception:
+            logging.root.exception('ZipkinCallableMiddleware failed to start span')
+            data = None
+        if data is None:
+            return self.get_response(request)
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            try:
+                if response is None:
+                    # Django turns exceptions into responses further down the chain, anything reaching here is a 500
+                    self.finish_span(request, 500, data)
+                else:
+                    self._finish_response_span(request, response, data)
+            except Exception:
+                logging.root.exception('ZipkinCallableMiddleware failed to finish span')
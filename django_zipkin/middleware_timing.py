@@ -0,0 +1,70 @@
+import functools
+import logging
+
+from django.core.handlers.base import BaseHandler
+
+from api import get_default as get_default_api
+from middleware import ZipkinMiddleware
+import constants
+
+
+# The lists of middleware hooks Django's handlers call, not all of them exist in every Django version
+HOOK_LISTS = ('_request_middleware', '_view_middleware', '_template_response_middleware', '_response_middleware',
+              '_exception_middleware')
+
+
+class MiddlewareHookTimer(object):
+    """
+    Calls a middleware hook, recording how long it took in the current span if it's traced
+
+    The time is recorded as an annotation like "django.middleware:SessionMiddleware.process_request" at the start of
+    the call, with its duration.
+    """
+    def __init__(self, hook, api=None):
+        self.hook = hook
+        self.api = api or get_default_api()
+        self.name = '%s%s.%s' % (constants.ANNOTATION_MIDDLEWARE_PREFIX, hook.im_self.__class__.__name__,
+                                 hook.__name__)
+
+    def __call__(self, *args, **kwargs):
+        if not self.api.store.get().is_tracing():
+            return self.hook(*args, **kwargs)
+        start = self.api.get_timestamp()
+        try:
+            return self.hook(*args, **kwargs)
+        finally:
+            try:
+                self.api.record_event(self.name, self.api.get_timestamp() - start, start)
+            except Exception:
+                logging.root.exception('MiddlewareHookTimer failed to record %s' % self.name)
+
+
+def wrap_middleware_hooks(handler, api=None):
+    """
+    Replace the middleware hooks loaded by handler with MiddlewareHookTimers, except those of django-zipkin
+    """
+    for name in HOOK_LISTS:
+        hooks = getattr(handler, name, None)
+        if hooks is None:
+            continue
+        setattr(handler, name, [
+            hook if isinstance(getattr(hook, 'im_self', None), (ZipkinMiddleware, type(None)))
+            else MiddlewareHookTimer(hook, api)
+            for hook in hooks
+        ])
+
+
+def install():
+    """
+    Time the middleware hooks of every Django handler loading its middleware from now on
+    """
+    if getattr(BaseHandler.load_middleware, 'zipkin_timed', False):
+        return
+    load_middleware = BaseHandler.load_middleware
+
+    @functools.wraps(load_middleware)
+    def load_timed_middleware(self):
+        load_middleware(self)
+        wrap_middleware_hooks(self)
+    load_timed_middleware.zipkin_timed = True
+    BaseHandler.load_middleware = load_timed_middleware
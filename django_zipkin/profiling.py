@@ -0,0 +1,254 @@
+import os
+import gc
+import sys
+import time
+import errno
+import cProfile
+import logging
+import tempfile
+import threading
+
+from api import get_default as get_default_api
+from utils import memoize
+import constants
+import defaults as settings
+
+try:
+    import tracemalloc
+    has_tracemalloc = True
+except ImportError:
+    has_tracemalloc = False
+
+
+class BaseRequestProfiler(object):
+    """
+    Profiles traced requests, recording the results in their span
+
+    The middleware calls start once the span of the request is set up, and stop before the span is finished, with its
+    duration in microseconds. Both are called in the thread serving the request, except that stop may be called from
+    the thread closing the response for streaming responses; detach is then called in the serving thread beforehand.
+    """
+    def start(self, request, data):
+        """
+        Start profiling the request, returns the state stop needs, or None if the request isn't profiled
+        """
+        raise NotImplementedError
+
+    def detach(self, request, data, state):
+        """
+        Called in the thread serving the request when the span is finished later, maybe from another thread
+        """
+        pass
+
+    def stop(self, request, data, state, duration):
+        raise NotImplementedError
+
+
+class StackSampler(BaseRequestProfiler):
+    """
+    Samples the stacks of the threads serving traced requests, and records where the slow ones spent their time
+
+    A background thread takes the current frame of each thread serving a traced request every interval milliseconds.
+    When a request took at least threshold milliseconds, the max_stacks stacks sampled most often are recorded in the
+    "profile.stacks" binary annotation, one per line with the number of samples and the innermost frames, and
+    "profile.samples" is the number of samples taken. The thread sleeps while no traced request is being served.
+    """
+    def __init__(self, api=None, interval=None, threshold=None, max_stacks=None):
+        self.api = api or get_default_api()
+        self.interval = (settings.ZIPKIN_STACK_SAMPLING_INTERVAL if interval is None else interval) / 1000.0
+        threshold = settings.ZIPKIN_STACK_SAMPLING_THRESHOLD if threshold is None else threshold
+        self.threshold = threshold * 1000
+        self.max_stacks = settings.ZIPKIN_STACK_SAMPLING_MAX_STACKS if max_stacks is None else max_stacks
+        # Sample counts by stack, for each thread being profiled
+        self.samples = {}
+        self.lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.thread = None
+
+    def start(self, request, data):
+        ident = threading.current_thread().ident
+        with self.lock:
+            self.samples[ident] = {}
+            # The thread doesn't survive forking, like in servers preloading the application
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='django_zipkin.StackSampler')
+                self.thread.daemon = True
+                self.thread.start()
+            self.wake_up.set()
+        return ident
+
+    def stop(self, request, data, ident, duration):
+        with self.lock:
+            samples = self.samples.pop(ident, None)
+        if not samples or duration is None or duration < self.threshold:
+            return
+        self.api.record_key_value(constants.ANNOTATION_PROFILE_SAMPLES, sum(samples.itervalues()))
+        self.api.record_key_value(constants.ANNOTATION_PROFILE_STACKS, self._format_samples(samples))
+
+    def _run(self):
+        while True:
+            self.wake_up.wait()
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception:
+                logging.root.exception('StackSampler failed to sample stacks')
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self.lock:
+            if not self.samples:
+                self.wake_up.clear()
+            for ident, samples in self.samples.iteritems():
+                frame = frames.get(ident)
+                if frame is not None:
+                    stack = self._get_stack(frame)
+                    samples[stack] = samples.get(stack, 0) + 1
+
+    @staticmethod
+    def _get_stack(frame):
+        stack = []
+        while frame is not None and len(stack) < constants.STACK_SAMPLE_DEPTH:
+            code = frame.f_code
+            stack.append((os.path.basename(code.co_filename), frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        return tuple(stack)
+
+    def _format_samples(self, samples):
+        top = sorted(samples.iteritems(), key=lambda item: item[1], reverse=True)[:self.max_stacks]
+        return '\n'.join(
+            '%d %s' % (count, ' < '.join('%s (%s:%d)' % (name, filename, lineno) for filename, lineno, name in stack))
+            for stack, count in top
+        )
+
+
+class CProfileProfiler(BaseRequestProfiler):
+    """
+    Runs requests with the debug flag (X-B3-Flags: 1) under cProfile
+
+    The stats are saved in directory, in a file named after the trace and span ids, which can be loaded with pstats.
+    Its path is recorded in the "profile.file" binary annotation. Only the thread serving the request is profiled, and
+    for streaming responses only until the response is returned, as profiling can only be stopped in that thread.
+    """
+    def __init__(self, api=None, directory=None):
+        self.api = api or get_default_api()
+        self.directory = directory or settings.ZIPKIN_PROFILE_DIR or tempfile.gettempdir()
+
+    def start(self, request, data):
+        if not data.flags:
+            return None
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def detach(self, request, data, profile):
+        profile.disable()
+
+    def stop(self, request, data, profile, duration):
+        profile.disable()
+        path = os.path.join(self.directory, '%s-%s.prof' % (data.trace_id.get_hex(), data.span_id.get_hex()))
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        profile.dump_stats(path)
+        self.api.record_key_value(constants.ANNOTATION_PROFILE_FILE, path)
+
+
+class AllocationProfiler(BaseRequestProfiler):
+    """
+    Records how much memory sampled and debug requests allocate
+
+    With tracemalloc (Python 3.4 and later), "memory.allocated" is the net change of the memory traced while the
+    request was served in bytes, "memory.peak" the peak above the memory traced at its start (Python 3.9 and later),
+    and "memory.top_sites" lists the max_sites source lines whose allocations grew the most. tracemalloc is started
+    by the first profiled request, and stays on. Without it, the objects tracked by the garbage collector are
+    counted: "memory.objects" is their net change, and "memory.top_types" lists the max_sites types whose number of
+    objects grew the most. Either way the accounting is process-wide, so it includes what other threads allocate
+    meanwhile.
+    """
+    def __init__(self, api=None, max_sites=None, use_tracemalloc=None):
+        self.api = api or get_default_api()
+        self.max_sites = settings.ZIPKIN_ALLOCATION_TOP_SITES if max_sites is None else max_sites
+        self.use_tracemalloc = has_tracemalloc if use_tracemalloc is None else use_tracemalloc
+
+    def start(self, request, data):
+        # Provisional spans are recorded for every request with tail sampling, they aren't worth the cost
+        if not (data.sampled or data.flags):
+            return None
+        if self.use_tracemalloc:
+            return self._start_tracemalloc()
+        return self._count_objects()
+
+    def stop(self, request, data, state, duration):
+        if self.use_tracemalloc:
+            self._stop_tracemalloc(state)
+        else:
+            self._stop_counting_objects(state)
+
+    def _start_tracemalloc(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        return current, self._take_snapshot() if self.max_sites else None
+
+    def _stop_tracemalloc(self, state):
+        start_size, start_snapshot = state
+        size, peak = tracemalloc.get_traced_memory()
+        self.api.record_key_value(constants.ANNOTATION_MEMORY_ALLOCATED, size - start_size)
+        if hasattr(tracemalloc, 'reset_peak'):
+            self.api.record_key_value(constants.ANNOTATION_MEMORY_PEAK, max(peak - start_size, 0))
+        if start_snapshot is None:
+            return
+        stats = [stat for stat in self._take_snapshot().compare_to(start_snapshot, 'lineno') if stat.size_diff > 0]
+        stats.sort(key=lambda stat: stat.size_diff, reverse=True)
+        if stats:
+            self.api.record_key_value(constants.ANNOTATION_MEMORY_TOP_SITES, '\n'.join(
+                '%d %s:%d' % (stat.size_diff, os.path.basename(stat.traceback[0].filename), stat.traceback[0].lineno)
+                for stat in stats[:self.max_sites]
+            ))
+
+    @staticmethod
+    def _take_snapshot():
+        # The snapshots themselves are allocated by tracemalloc, they are left out
+        return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+
+    def _count_objects(self):
+        objects = gc.get_objects()
+        if not self.max_sites:
+            return len(objects), None
+        counts = {}
+        for obj in objects:
+            name = type(obj).__name__
+            counts[name] = counts.get(name, 0) + 1
+        return len(objects), counts
+
+    def _stop_counting_objects(self, state):
+        start_total, start_counts = state
+        total, counts = self._count_objects()
+        self.api.record_key_value(constants.ANNOTATION_MEMORY_OBJECTS, total - start_total)
+        if start_counts is None:
+            return
+        growth = [(count - start_counts.get(name, 0), name) for name, count in counts.iteritems()]
+        growth = sorted((diff, name) for diff, name in growth if diff > 0)[::-1][:self.max_sites]
+        if growth:
+            self.api.record_key_value(constants.ANNOTATION_MEMORY_TOP_TYPES,
+                                      '\n'.join('%d %s' % (diff, name) for diff, name in growth))
+
+
+@memoize
+def get_default_profilers():
+    """
+    The profilers enabled in the settings
+    """
+    profilers = []
+    if settings.ZIPKIN_STACK_SAMPLING:
+        profilers.append(StackSampler())
+    if settings.ZIPKIN_PROFILE_DEBUG_REQUESTS:
+        profilers.append(CProfileProfiler())
+    if settings.ZIPKIN_ALLOCATION_TRACKING:
+        profilers.append(AllocationProfiler())
+    return profilers
@@ -0,0 +1,102 @@
+import functools
+import logging
+
+from django.core.exceptions import ImproperlyConfigured
+
+from api import get_default as get_default_api
+import constants
+
+try:
+    import redis.client
+    has_redis = True
+except ImportError:
+    has_redis = False
+
+
+class RedisCallTimer(object):
+    """
+    Records the Redis commands and pipelines executed in the current span if it's traced
+
+    Commands are too many and too fast to be worth recording one by one, each command name has an aggregate
+    "redis.<command>" with the number of calls and their total duration instead. Pipelines are recorded one by one, as
+    "redis.pipeline" annotations carrying the duration, and "redis.pipeline.commands" counts the commands sent in them.
+    """
+    def __init__(self, api=None):
+        self.api = api or get_default_api()
+
+    def time_command(self, method, client, args, options):
+        if not self.api.store.get().is_tracing():
+            return method(client, *args, **options)
+        start = self.api.get_timestamp()
+        try:
+            return method(client, *args, **options)
+        finally:
+            try:
+                self.api.record_aggregate(constants.ANNOTATION_REDIS_PREFIX + self._get_command_name(args),
+                                          self.api.get_timestamp() - start)
+            except Exception:
+                logging.root.exception('RedisCallTimer failed to record a command')
+
+    def time_pipeline(self, method, pipeline, args, kwargs):
+        if not self.api.store.get().is_tracing():
+            return method(pipeline, *args, **kwargs)
+        commands = len(pipeline.command_stack)
+        start = self.api.get_timestamp()
+        try:
+            return method(pipeline, *args, **kwargs)
+        finally:
+            try:
+                self.api.record_event(constants.ANNOTATION_REDIS_PIPELINE, self.api.get_timestamp() - start, start)
+                self.api.record_aggregate(constants.ANNOTATION_REDIS_PIPELINE_COMMANDS, count=commands)
+            except Exception:
+                logging.root.exception('RedisCallTimer failed to record a pipeline')
+
+    @staticmethod
+    def _get_command_name(args):
+        if not args:
+            return constants.UNKNOWN_REDIS_COMMAND
+        # Commands with subcommands, like "CLIENT LIST", may be sent as a single argument
+        return str(args[0]).split(' ', 1)[0].upper()
+
+
+def instrument_client_class(client_class, timer):
+    """
+    Replace execute_command of client_class with one timed by timer
+    """
+    method = client_class.execute_command.im_func
+    if getattr(method, 'zipkin_timed', False):
+        return
+
+    @functools.wraps(method)
+    def execute_command(self, *args, **options):
+        return timer.time_command(method, self, args, options)
+    execute_command.zipkin_timed = True
+    client_class.execute_command = execute_command
+
+
+def instrument_pipeline_class(pipeline_class, timer):
+    """
+    Replace execute of pipeline_class with one timed by timer
+    """
+    method = pipeline_class.execute.im_func
+    if getattr(method, 'zipkin_timed', False):
+        return
+
+    @functools.wraps(method)
+    def execute(self, *args, **kwargs):
+        return timer.time_pipeline(method, self, args, kwargs)
+    execute.zipkin_timed = True
+    pipeline_class.execute = execute
+
+
+def install(timer=None):
+    """
+    Time the commands and pipelines of redis-py clients from now on
+    """
+    if not has_redis:
+        raise ImproperlyConfigured("ZIPKIN_REDIS_TIMING requires redis")
+    timer = timer or RedisCallTimer()
+    # Redis subclasses StrictRedis in redis-py 2, and the pipelines execute commands on their own
+    instrument_client_class(redis.client.StrictRedis, timer)
+    instrument_pipeline_class(getattr(redis.client, 'BasePipeline', redis.client.Pipeline), timer)
+    return timer
@@ -0,0 +1,118 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+
+import defaults as settings
+from url_policies import UrlPolicyTable
+from utils import monotonic
+
+
+class RuntimeConfigSnapshot(object):
+    """
+    The values of the runtime-adjustable settings at one point in time; it's never modified once built
+    """
+    KEYS = ('sample_rate', 'url_policies')
+
+    def __init__(self, overrides=None):
+        self.overrides = dict(overrides or {})
+        unknown_keys = set(self.overrides) - set(self.KEYS)
+        if unknown_keys:
+            raise ValueError("Unknown runtime config keys: %s" % ', '.join(sorted(unknown_keys)))
+        self.sample_rate = float(self.overrides.get('sample_rate', settings.ZIPKIN_SAMPLE_RATE))
+        url_policies = self.overrides.get('url_policies', settings.ZIPKIN_URL_POLICIES)
+        if not isinstance(url_policies, (list, tuple)):
+            raise ValueError("url_policies must be a list")
+        self.url_policies = UrlPolicyTable(url_policies)
+
+
+class RuntimeConfig(object):
+    """
+    Settings that can be changed without restarting, by writing a JSON file shared by all processes on the host
+
+    The file holds a dict with the keys 'sample_rate' and 'url_policies', overriding ZIPKIN_SAMPLE_RATE and
+    ZIPKIN_URL_POLICIES; missing keys fall back to the settings. The file is checked for changes at most once per
+    poll_interval seconds, and get() returns the current snapshot, which is replaced as a whole on change.
+    """
+    def __init__(self, path=None, poll_interval=None):
+        self.path = path
+        self.poll_interval = settings.ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.snapshot = RuntimeConfigSnapshot()
+        self.file_version = None
+        self.next_poll = 0
+        self.poll_lock = threading.Lock()
+
+    def get(self):
+        if self.path is not None and monotonic() >= self.next_poll:
+            self._poll()
+        return self.snapshot
+
+    def update(self, **overrides):
+        """
+        Change the given settings for all processes using the same file
+        """
+        if self.path is None:
+            raise ValueError("ZIPKIN_RUNTIME_CONFIG_FILE is not set")
+        merged = self._read()
+        merged.update(overrides)
+        snapshot = RuntimeConfigSnapshot(merged)  # Validate before anything is written
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(merged, f)
+            os.rename(tmp_path, self.path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+        self.snapshot = snapshot
+        self.next_poll = 0
+
+    def _poll(self):
+        # Only one thread polls, the others carry on with the current snapshot
+        if not self.poll_lock.acquire(False):
+            return
+        try:
+            self.next_poll = monotonic() + self.poll_interval
+            file_version = self._get_file_version()
+            if file_version == self.file_version:
+                return
+            self.file_version = file_version
+            self.snapshot = RuntimeConfigSnapshot(self._read())
+        except Exception:
+            logging.root.exception('failed_to_load_runtime_config %s' % self.path)
+        finally:
+            self.poll_lock.release()
+
+    def _get_file_version(self):
+        # The file is replaced by renaming, so the inode changes even if the mtime doesn't have enough resolution
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime, stat.st_size
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except IOError:
+            return {}
+
+
+class RuntimeUrlPolicyTable(object):
+    """
+    A UrlPolicyTable following the URL policies of a RuntimeConfig
+    """
+    def __init__(self, runtime_config):
+        self.runtime_config = runtime_config
+
+    def match_path(self, path):
+        return self.runtime_config.get().url_policies.match_path(path)
+
+    def match_url_name(self, url_name):
+        return self.runtime_config.get().url_policies.match_url_name(url_name)
+
+
+default = RuntimeConfig(settings.ZIPKIN_RUNTIME_CONFIG_FILE)
+default_url_policies = RuntimeUrlPolicyTable(default)
@@ -0,0 +1,104 @@
+from django.utils.functional import SimpleLazyObject
+
+import constants
+import defaults as settings
+from utils import import_class, memoize
+from zipkin_data import ZipkinId
+from runtime_config import default as default_runtime_config
+
+
+class BaseSampler(object):
+    """
+    Makes the sampling decision for traces that don't have one yet
+    """
+    def is_sampled(self, trace_id):
+        raise NotImplementedError
+
+
+class TraceIdRatioSampler(BaseSampler):
+    """
+    Samples the given ratio of traces, deciding by the bits of the trace id
+
+    Every service using the same rate makes the same decision for the same trace, without coordination. Without
+    an explicit rate, the rate of the runtime config is used, so it can be changed without a restart.
+    """
+    def __init__(self, rate=None, runtime_config=None):
+        self.runtime_config = runtime_config or default_runtime_config
+        self.rate = rate
+        if rate is not None:
+            self.boundary = self._get_boundary(rate)
+        # The boundary for the last runtime config snapshot seen, in a single attribute so it's replaced atomically
+        self.runtime_boundary = (None, None)
+
+    def is_sampled(self, trace_id):
+        if self.rate is not None:
+            boundary = self.boundary
+        else:
+            snapshot, boundary = self.runtime_boundary
+            current_snapshot = self.runtime_config.get()
+            if snapshot is not current_snapshot:
+                boundary = self._get_boundary(current_snapshot.sample_rate)
+                self.runtime_boundary = (current_snapshot, boundary)
+        return abs(trace_id.get_binary()) < boundary
+
+    @staticmethod
+    def _get_boundary(rate):
+        # Trace ids are uniformly distributed over [-MAX_VAL, MAX_VAL], so abs(trace_id) < boundary for the
+        # given ratio of them
+        return int(max(0.0, min(1.0, rate)) * (ZipkinId.MAX_VAL + 1))
+
+
+class TailSampler(object):
+    """
+    Decides whether a provisionally recorded span is sent to Zipkin, once the request is finished
+
+    Thresholds are in milliseconds; url_name_latency_thresholds overrides latency_threshold for the given URL names.
+    With keep_errors, requests whose view raised an exception are kept whatever their response.
+    """
+    def __init__(self, latency_threshold=None, url_name_latency_thresholds=None, min_status_code=None,
+                 keep_errors=False):
+        self.latency_threshold = self._ms_to_us(latency_threshold)
+        self.url_name_latency_thresholds = dict(
+            (url_name, self._ms_to_us(threshold)) for url_name, threshold in (url_name_latency_thresholds or {}).items()
+        )
+        self.min_status_code = min_status_code
+        self.keep_errors = keep_errors
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            latency_threshold=settings.ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD,
+            url_name_latency_thresholds=settings.ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS,
+            min_status_code=settings.ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE,
+            keep_errors=settings.ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS
+        )
+
+    def get_reason_to_keep(self, url_name, status_code, duration, error=False):
+        """
+        Returns why the span should be kept, or None if it should be dropped
+
+        duration is in microseconds, and may be None if it's not known. error tells whether the view raised.
+        """
+        if self.keep_errors and error:
+            return constants.SAMPLING_REASON_ERROR
+        if self.min_status_code is not None and status_code >= self.min_status_code:
+            return constants.SAMPLING_REASON_STATUS_CODE
+        threshold = self.url_name_latency_thresholds.get(url_name, self.latency_threshold)
+        if threshold is not None and duration is not None and duration >= threshold:
+            return constants.SAMPLING_REASON_LATENCY
+        return None
+
+    @staticmethod
+    def _ms_to_us(ms):
+        if ms is None:
+            return None
+        return ms * 1000
+
+
+@memoize
+def get_default():
+    return import_class(settings.ZIPKIN_SAMPLER_CLASS)()
+
+
+default = SimpleLazyObject(get_default)
+default_tail_sampler = TailSampler.from_settings() if settings.ZIPKIN_TAIL_SAMPLING else None
@@ -1,7 +1,21 @@
 from constants import DEFAULT_ZIPKIN_SERVICE_NAME, DEFAULT_ZIPKIN_DATA_STORE_CLASS,\
-    DEFAULT_ZIPKIN_LOGGER_NAME, DEFAULT_ZIPKIN_ID_GENERATOR_CLASS
+    DEFAULT_ZIPKIN_LOGGER_NAME, DEFAULT_ZIPKIN_ID_GENERATOR_CLASS, DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH, \
+    DEFAULT_ZIPKIN_URL_POLICIES, DEFAULT_ZIPKIN_MAX_ANNOTATIONS, DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATIONS, \
+    DEFAULT_ZIPKIN_MAX_SPAN_SIZE, DEFAULT_ZIPKIN_TAIL_SAMPLING, DEFAULT_ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD, \
+    DEFAULT_ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS, DEFAULT_ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE, \
+    DEFAULT_ZIPKIN_SAMPLER_CLASS, DEFAULT_ZIPKIN_SAMPLE_RATE, DEFAULT_ZIPKIN_RUNTIME_CONFIG_FILE, \
+    DEFAULT_ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL, DEFAULT_ZIPKIN_ENDPOINT_IPV4, \
+    DEFAULT_ZIPKIN_ENDPOINT_PORT_FROM_REQUEST, DEFAULT_ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST, \
+    DEFAULT_ZIPKIN_QUEUE_TIME_HEADERS, DEFAULT_ZIPKIN_MIDDLEWARE_TIMING, \
+    DEFAULT_ZIPKIN_TEMPLATE_TIMING, DEFAULT_ZIPKIN_TEMPLATE_MAX_RENDERS, \
+    DEFAULT_ZIPKIN_CACHE_TIMING, DEFAULT_ZIPKIN_CACHE_SLOW_CALL_THRESHOLD, \
+    DEFAULT_ZIPKIN_CELERY_TRACING, DEFAULT_ZIPKIN_REDIS_TIMING, DEFAULT_ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS, \
+    DEFAULT_ZIPKIN_ERROR_MESSAGE_MAX_LENGTH, DEFAULT_ZIPKIN_ERROR_FINGERPRINT, DEFAULT_ZIPKIN_STACK_SAMPLING, \
+    DEFAULT_ZIPKIN_STACK_SAMPLING_INTERVAL, DEFAULT_ZIPKIN_STACK_SAMPLING_THRESHOLD, \
+    DEFAULT_ZIPKIN_STACK_SAMPLING_MAX_STACKS, DEFAULT_ZIPKIN_PROFILE_DEBUG_REQUESTS, \
+    DEFAULT_ZIPKIN_PROFILE_DIR, DEFAULT_ZIPKIN_ALLOCATION_TRACKING, DEFAULT_ZIPKIN_ALLOCATION_TOP_SITES
 try:
-    from configglue.schema import Section, StringOption
+    from configglue.schema import Section, StringOption, IntOption, FloatOption, BoolOption, DictOption, ListOption
     has_configglue = True
 except ImportError:
     has_configglue = False
@@ -12,3 +26,47 @@ if has_configglue:
         zipkin_data_store_class = StringOption(default=DEFAULT_ZIPKIN_DATA_STORE_CLASS)
         zipkin_logger_name = StringOption(default=DEFAULT_ZIPKIN_LOGGER_NAME)
         zipkin_id_generator_class = StringOption(default=DEFAULT_ZIPKIN_ID_GENERATOR_CLASS)
+        zipkin_max_binary_annotation_value_length = IntOption(default=DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH)
+        zipkin_url_policies = ListOption(
+            item=DictOption(spec={
+                'path': StringOption(),
+                'url_name': StringOption(),
+                'trace': StringOption(),
+                'view_args': BoolOption(default=True),
+                'view_kwargs': BoolOption(default=True),
+            }),
+            default=list(DEFAULT_ZIPKIN_URL_POLICIES))
+        zipkin_max_annotations = IntOption(default=DEFAULT_ZIPKIN_MAX_ANNOTATIONS)
+        zipkin_max_binary_annotations = IntOption(default=DEFAULT_ZIPKIN_MAX_BINARY_ANNOTATIONS)
+        zipkin_max_span_size = IntOption(default=DEFAULT_ZIPKIN_MAX_SPAN_SIZE)
+        zipkin_tail_sampling = BoolOption(default=DEFAULT_ZIPKIN_TAIL_SAMPLING)
+        zipkin_tail_sampling_latency_threshold = IntOption(default=DEFAULT_ZIPKIN_TAIL_SAMPLING_LATENCY_THRESHOLD)
+        zipkin_tail_sampling_url_name_latency_thresholds = DictOption(
+            item=IntOption(), default=DEFAULT_ZIPKIN_TAIL_SAMPLING_URL_NAME_LATENCY_THRESHOLDS)
+        zipkin_tail_sampling_min_status_code = IntOption(default=DEFAULT_ZIPKIN_TAIL_SAMPLING_MIN_STATUS_CODE)
+        zipkin_sampler_class = StringOption(default=DEFAULT_ZIPKIN_SAMPLER_CLASS)
+        zipkin_sample_rate = FloatOption(default=DEFAULT_ZIPKIN_SAMPLE_RATE)
+        zipkin_runtime_config_file = StringOption(default=DEFAULT_ZIPKIN_RUNTIME_CONFIG_FILE)
+        zipkin_runtime_config_poll_interval = FloatOption(default=DEFAULT_ZIPKIN_RUNTIME_CONFIG_POLL_INTERVAL)
+        zipkin_endpoint_ipv4 = StringOption(default=DEFAULT_ZIPKIN_ENDPOINT_IPV4)
+        zipkin_endpoint_port_from_request = BoolOption(default=DEFAULT_ZIPKIN_ENDPOINT_PORT_FROM_REQUEST)
+        zipkin_endpoint_ipv4_from_request = BoolOption(default=DEFAULT_ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST)
+        zipkin_queue_time_headers = ListOption(item=StringOption(), default=list(DEFAULT_ZIPKIN_QUEUE_TIME_HEADERS))
+        zipkin_middleware_timing = BoolOption(default=DEFAULT_ZIPKIN_MIDDLEWARE_TIMING)
+        zipkin_template_timing = BoolOption(default=DEFAULT_ZIPKIN_TEMPLATE_TIMING)
+        zipkin_template_max_renders = IntOption(default=DEFAULT_ZIPKIN_TEMPLATE_MAX_RENDERS)
+        zipkin_cache_timing = BoolOption(default=DEFAULT_ZIPKIN_CACHE_TIMING)
+        zipkin_cache_slow_call_threshold = IntOption(default=DEFAULT_ZIPKIN_CACHE_SLOW_CALL_THRESHOLD)
+        zipkin_celery_tracing = BoolOption(default=DEFAULT_ZIPKIN_CELERY_TRACING)
+        zipkin_redis_timing = BoolOption(default=DEFAULT_ZIPKIN_REDIS_TIMING)
+        zipkin_tail_sampling_keep_errors = BoolOption(default=DEFAULT_ZIPKIN_TAIL_SAMPLING_KEEP_ERRORS)
+        zipkin_error_message_max_length = IntOption(default=DEFAULT_ZIPKIN_ERROR_MESSAGE_MAX_LENGTH)
+        zipkin_error_fingerprint = BoolOption(default=DEFAULT_ZIPKIN_ERROR_FINGERPRINT)
+        zipkin_stack_sampling = BoolOption(default=DEFAULT_ZIPKIN_STACK_SAMPLING)
+        zipkin_stack_sampling_interval = IntOption(default=DEFAULT_ZIPKIN_STACK_SAMPLING_INTERVAL)
+        zipkin_stack_sampling_threshold = IntOption(default=DEFAULT_ZIPKIN_STACK_SAMPLING_THRESHOLD)
+        zipkin_stack_sampling_max_stacks = IntOption(default=DEFAULT_ZIPKIN_STACK_SAMPLING_MAX_STACKS)
+        zipkin_profile_debug_requests = BoolOption(default=DEFAULT_ZIPKIN_PROFILE_DEBUG_REQUESTS)
+        zipkin_profile_dir = StringOption(default=DEFAULT_ZIPKIN_PROFILE_DIR)
+        zipkin_allocation_tracking = BoolOption(default=DEFAULT_ZIPKIN_ALLOCATION_TRACKING)
+        zipkin_allocation_top_sites = IntOption(default=DEFAULT_ZIPKIN_ALLOCATION_TOP_SITES)
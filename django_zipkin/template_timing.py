@@ -0,0 +1,57 @@
+import functools
+import logging
+
+from django.template.base import Template
+
+from api import get_default as get_default_api
+import constants
+import defaults as settings
+
+
+class TemplateRenderTimer(object):
+    """
+    Renders a template, recording how long it took in the current span if it's traced
+
+    Every render is added to the aggregates "django.template" and "django.template:<template name>". The first
+    max_renders renders of a request are also recorded one by one, as annotations with their duration. Times of
+    templates include the templates they include.
+    """
+    def __init__(self, api=None, max_renders=None):
+        self.api = api or get_default_api()
+        self.max_renders = settings.ZIPKIN_TEMPLATE_MAX_RENDERS if max_renders is None else max_renders
+
+    def __call__(self, render, template, context):
+        if not self.api.store.get().is_tracing():
+            return render(template, context)
+        start = self.api.get_timestamp()
+        try:
+            return render(template, context)
+        finally:
+            try:
+                self._record_render(template, start)
+            except Exception:
+                logging.root.exception('TemplateRenderTimer failed to record a render')
+
+    def _record_render(self, template, start):
+        duration = self.api.get_timestamp() - start
+        name = constants.ANNOTATION_TEMPLATE_PREFIX + (template.name or constants.UNKNOWN_TEMPLATE_NAME)
+        count = self.api.record_aggregate(constants.ANNOTATION_TEMPLATE, duration)
+        self.api.record_aggregate(name, duration)
+        if count <= self.max_renders:
+            self.api.record_event(name, duration, start)
+
+
+def install(timer=None):
+    """
+    Time the rendering of Django templates from now on
+    """
+    if getattr(Template.render, 'zipkin_timed', False):
+        return
+    timer = timer or TemplateRenderTimer()
+    render = Template.render.im_func
+
+    @functools.wraps(render)
+    def timed_render(self, context):
+        return timer(render, self, context)
+    timed_render.zipkin_timed = True
+    Template.render = timed_render
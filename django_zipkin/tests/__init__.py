@@ -1,5 +1,18 @@
 from test_api import *
+from test_cache_timing import *
+from test_celery_tracing import *
 from test_data_store import *
 from test_id_generator import *
 from test_middleware import *
+from test_middleware_timing import *
+from test_profiling import *
+from test_redis_timing import *
+from test_runtime_config import *
+from test_sampler import *
+from test_template_timing import *
+from test_thrift_client import *
+from test_threads import *
+from test_url_policies import *
+from test_views import *
+from test_wsgi import *
 from test_zipkin_data import *
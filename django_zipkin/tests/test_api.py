@@ -1,42 +1,156 @@
+import os
+import base64
+import threading
+
 from unittest2 import TestCase
 from mock import patch, Mock, sentinel
 
-from django_zipkin._thrift.zipkinCore.ttypes import AnnotationType
-from django_zipkin.api import ZipkinApi
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.transport.TTransport import TMemoryBuffer
+
+from django_zipkin._thrift.zipkinCore.ttypes import AnnotationType, Span
+from django_zipkin.api import ZipkinApi, DeferredBinaryAnnotation, HostIpResolver
 from django_zipkin.data_store import BaseDataStore
 from django_zipkin.id_generator import SimpleIdGenerator
 from django_zipkin.zipkin_data import ZipkinData, ZipkinId
 
 
-__all__ = ['ZipkinApiTestCase']
+__all__ = ['ZipkinApiTestCase', 'HostIpResolverTestCase']
 
 
 class ZipkinApiTestCase(TestCase):
     def setUp(self):
         self.time_patcher = patch('django_zipkin.api.time')
         self.mock_time = self.time_patcher.start()
+        self.mock_time.time.return_value = 1400000000.5
+        self.monotonic_patcher = patch('django_zipkin.api.monotonic')
+        self.mock_monotonic = self.monotonic_patcher.start()
+        self.mock_monotonic.return_value = 10.0
+        self.resolver_patcher = patch('django_zipkin.api.host_ip_resolver')
+        self.mock_resolver = self.resolver_patcher.start()
         self.store = Mock(spec=BaseDataStore)
+        self.store.get_start_time.return_value = None
+        self.store.get_endpoint.return_value = None
+        self.store.get_aggregates.return_value = {}
         self.api = ZipkinApi(self.store)
 
     def tearDown(self):
+        self.resolver_patcher.stop()
+        self.monotonic_patcher.stop()
         self.time_patcher.stop()
 
     def test_ipv4_to_long(self):
         self.assertEqual(self.api._ipv4_to_long('127.0.0.1'), 2130706433)
 
+    def test_ip_is_resolved_in_the_background(self):
+        self.assertIsNone(self.api.endpoint.ipv4)
+        self.mock_resolver.resolve.assert_called_once_with(self.api._set_ipv4)
+        self.api._set_ipv4(2130706433)
+        self.assertEqual(self.api.endpoint.ipv4, 2130706433)
+
+    def test_explicit_ip(self):
+        self.mock_resolver.reset_mock()
+        api = ZipkinApi(self.store, ipv4='127.0.0.1')
+        self.assertEqual(api.endpoint.ipv4, 2130706433)
+        self.assertFalse(self.mock_resolver.resolve.called)
+
+    def test_set_endpoint(self):
+        self.api.set_endpoint(8001)
+        endpoint = self.store.set_endpoint.call_args[0][0]
+        self.assertEqual(endpoint.port, 8001)
+        self.assertEqual(endpoint.ipv4, self.api.endpoint.ipv4)
+        self.assertEqual(endpoint.service_name, self.api.endpoint.service_name)
+        self.store.get_endpoint.return_value = endpoint
+        self.assertIs(self.api._build_annotation('sr').host, endpoint)
+
+    def test_set_endpoint_reuses_endpoints(self):
+        self.api.set_endpoint(8001, '10.0.0.1')
+        self.api.set_endpoint(8001, '10.0.0.1')
+        first, second = [args[0][0] for args in self.store.set_endpoint.call_args_list]
+        self.assertIs(first, second)
+        self.assertEqual(first.ipv4, self.api._ipv4_to_long('10.0.0.1'))
+
+    def test_set_endpoint_follows_resolved_ip(self):
+        self.api.set_endpoint(8001)
+        self.api._set_ipv4(2130706433)
+        self.api.set_endpoint(8001)
+        self.assertEqual(self.store.set_endpoint.call_args[0][0].ipv4, 2130706433)
+
+    def test_port_to_i16(self):
+        self.assertEqual(self.api._port_to_i16(8080), 8080)
+        self.assertEqual(self.api._port_to_i16(65535), -1)
+        self.assertIsNone(self.api._port_to_i16(None))
+
+    def test_record_aggregate(self):
+        self.store.get.return_value = ZipkinData(sampled=True)
+        self.assertEqual(self.api.record_aggregate('render', 100), 1)
+        self.assertEqual(self.api.record_aggregate('render', 50), 2)
+        self.assertDictEqual(self.store.get_aggregates.return_value, {'render': (2, 150)})
+
+    def test_record_counter(self):
+        self.store.get.return_value = ZipkinData(sampled=True)
+        self.api.record_aggregate('hits', count=3)
+        self.assertEqual(self.api.record_aggregate('hits'), 4)
+        self.assertDictEqual(self.store.get_aggregates.return_value, {'hits': (4, None)})
+
+    def test_record_aggregate_when_not_tracing(self):
+        self.store.get.return_value = ZipkinData(sampled=False)
+        self.assertEqual(self.api.record_aggregate('render', 100), 0)
+        self.assertDictEqual(self.store.get_aggregates.return_value, {})
+
+    def test_aggregates_are_recorded_as_binary_annotations(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(1), span_id=ZipkinId(2))
+        self.store.get_annotations.return_value = []
+        self.store.get_binary_annotations.return_value = []
+        self.store.get_aggregates.return_value = {'render': (2, 150), 'renders': (3, None)}
+        span = self.api._build_span()
+        self.assertListEqual([(a.key, a.value) for a in span.binary_annotations],
+                             [('render.count', self.api._format_binary_annotation_value(2, AnnotationType.I64)),
+                              ('render.duration', self.api._format_binary_annotation_value(150, AnnotationType.I64)),
+                              ('renders.count', self.api._format_binary_annotation_value(3, AnnotationType.I64))])
+
     def test_build_annotation(self):
         value, duration = Mock(), Mock()
         annotation = self.api._build_annotation(value, duration)
-        self.assertEqual(annotation.timestamp, self.mock_time.time.return_value * 1000 * 1000)
+        self.assertEqual(annotation.timestamp, 1400000000500000)
+        self.assertIsInstance(annotation.timestamp, (int, long))
         self.assertEqual(annotation.value, str(value))
         self.assertEqual(annotation.duration, duration)
         self.assertEqual(annotation.host, self.api.endpoint)
 
+    def test_timestamp_sets_start_time_on_first_annotation(self):
+        self.api._build_annotation('sr')
+        self.store.set_start_time.assert_called_once_with((1400000000500000, 10.0))
+
+    def test_timestamps_are_offsets_from_start_time(self):
+        self.store.get_start_time.return_value = (1400000000500000, 10.0)
+        self.mock_time.time.return_value = 1300000000  # Wall clock jumps are ignored
+        self.mock_monotonic.return_value = 10.25
+        annotation = self.api._build_annotation('ss')
+        self.assertEqual(annotation.timestamp, 1400000000750000)
+        self.assertFalse(self.store.set_start_time.called)
+
+    def test_build_annotation_with_explicit_timestamp(self):
+        self.assertEqual(self.api._build_annotation('sr', timestamp=42).timestamp, 42)
+
+    def test_start_timestamp(self):
+        self.assertIsNone(self.api.get_start_timestamp())
+        self.store.get_start_time.return_value = (1400000000500000, 10.0)
+        self.assertEqual(self.api.get_start_timestamp(), 1400000000500000)
+
+    def test_elapsed_time(self):
+        self.assertIsNone(self.api.get_elapsed_time())
+        self.store.get_start_time.return_value = (1400000000500000, 10.0)
+        self.mock_monotonic.return_value = 10.0015
+        self.assertEqual(self.api.get_elapsed_time(), 1500)
+        self.mock_monotonic.return_value = 10.0 + 2 ** 32
+        self.assertEqual(self.api.get_elapsed_time(), 2 ** 31 - 1)
+
     def test_record_event(self):
         with patch.object(self.api, '_build_annotation') as mock_build_annotation:
             value, duration = Mock(), Mock()
             self.api.record_event(value, duration)
-            mock_build_annotation.assert_called_once_with(value, duration)
+            mock_build_annotation.assert_called_once_with(value, duration, None)
             self.store.record.assert_called_once_with(mock_build_annotation.return_value)
 
     def test_binary_annotation_type(self):
@@ -79,6 +193,57 @@ class ZipkinApiTestCase(TestCase):
             mock_build_binary_annotation.assert_called_once_with(key, value)
             self.store.record.assert_called_once_with(mock_build_binary_annotation.return_value)
 
+    def test_record_encoded_key_value(self):
+        encoded = self.api.encode_key_value('awesome', True)
+        self.assertEqual(encoded, ('awesome', '1', AnnotationType.BOOL))
+        self.api.record_encoded_key_value(encoded)
+        annotation = self.store.record.call_args[0][0]
+        self.assertEqual(annotation, self.api._build_binary_annotation('awesome', True))
+
+    def test_record_key_value_deferred(self):
+        func = Mock()
+        self.api.record_key_value_deferred('key', func, 1, 2)
+        annotation = self.store.record.call_args[0][0]
+        self.assertIsInstance(annotation, DeferredBinaryAnnotation)
+        self.assertEqual(annotation.key, 'key')
+        self.assertEqual(annotation.host, self.api.endpoint)
+        self.assertFalse(func.called)
+
+    def test_deferred_binary_annotations_are_materialized_when_building_span(self):
+        self.store.get_annotations.return_value = []
+        self.store.get_binary_annotations.return_value = [
+            self.api._build_binary_annotation('plain', 'value'),
+            DeferredBinaryAnnotation('deferred', lambda a, b: a + b, ('foo', 'bar'), self.api.endpoint),
+            DeferredBinaryAnnotation('number', lambda: 42, (), self.api.endpoint),
+        ]
+        annotations = self.api._build_span().binary_annotations
+        self.assertEqual([(a.key, a.value, a.annotation_type) for a in annotations], [
+            ('plain', 'value', AnnotationType.STRING),
+            ('deferred', 'foobar', AnnotationType.STRING),
+            ('number', '\x00\x00\x00\x00\x00\x00\x00*', AnnotationType.I64),
+        ])
+        self.assertNotIsInstance(annotations[1], DeferredBinaryAnnotation)
+
+    def test_failing_deferred_binary_annotation_is_skipped(self):
+        self.store.get_annotations.return_value = []
+        self.store.get_binary_annotations.return_value = [
+            DeferredBinaryAnnotation('broken', Mock(side_effect=ValueError), (), self.api.endpoint),
+            DeferredBinaryAnnotation('working', lambda: 'ok', (), self.api.endpoint),
+        ]
+        with patch('django_zipkin.api.logging'):
+            annotations = self.api._build_span().binary_annotations
+        self.assertEqual([a.key for a in annotations], ['working'])
+
+    def test_deferred_values_are_truncated(self):
+        self.store.get_annotations.return_value = []
+        self.store.get_binary_annotations.return_value = [
+            DeferredBinaryAnnotation('long', lambda: 'x' * 20, (), self.api.endpoint),
+            DeferredBinaryAnnotation('short', lambda: 'x' * 10, (), self.api.endpoint),
+        ]
+        with patch('django_zipkin.api.settings.ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH', 10):
+            annotations = self.api._build_span().binary_annotations
+        self.assertEqual([a.value for a in annotations], ['x' * 7 + '...', 'x' * 10])
+
     def test_set_rpc_name(self):
         self.api.set_rpc_name(sentinel.rpc_name)
         self.store.set_rpc_name.assert_called_once_with(sentinel.rpc_name)
@@ -99,6 +264,18 @@ class ZipkinApiTestCase(TestCase):
         self.assertEqual(span.annotations, annotations)
         self.assertEqual(span.binary_annotations, binary_annotations)
 
+    def test_build_child_span_log_message(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(7))
+        message = self.api.build_child_span_log_message(
+            ZipkinId(9), 'Log', [('cs', 1000, None), ('cr', 1250, 250)], [('thrift.error', 'ValueError')]
+        )
+        span = Span()
+        span.read(TBinaryProtocol(TMemoryBuffer(base64.b64decode(message))))
+        self.assertEqual((span.trace_id, span.id, span.parent_id, span.name), (42, 9, 7, 'Log'))
+        self.assertEqual([(a.value, a.timestamp, a.duration) for a in span.annotations],
+                         [('cs', 1000, None), ('cr', 1250, 250)])
+        self.assertEqual([(a.key, a.value) for a in span.binary_annotations], [('thrift.error', 'ValueError')])
+
     def test_downstream_request_headers_with_parent_span_id(self):
         generator = SimpleIdGenerator()
         self.store.get.return_value = data = ZipkinData(
@@ -131,6 +308,14 @@ class ZipkinApiTestCase(TestCase):
             'X-B3-Flags': '0'
         })
 
+    def test_downstream_request_headers_without_sampling_decision(self):
+        self.api.sampler = Mock()
+        for sampled, expected in [(True, 'true'), (False, 'false')]:
+            self.api.sampler.is_sampled.return_value = sampled
+            self.store.get.return_value = data = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(43), sampled=None)
+            self.assertEqual(self.api.get_headers_for_downstream_request()['X-B3-Sampled'], expected)
+            self.api.sampler.is_sampled.assert_called_with(data.trace_id)
+
     def test_downstream_request_headers_with_empty_data(self):
         self.store.get.return_value = ZipkinData()
         self.assertDictEqual(self.api.get_headers_for_downstream_request(), {
@@ -154,8 +339,54 @@ class ZipkinApiTestCase(TestCase):
         self.assertEqual(self.api._build_span().annotations[0].value, uri_out)
         self.assertEqual(self.api._build_span().binary_annotations[0].value, uri_out)
 
+    def test_oversized_span_is_shrunk(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(4242), sampled=True)
+        self.store.get_rpc_name.return_value = 'GET'
+        self.store.get_annotations.return_value = [
+            self.api._build_annotation('sr'),
+            self.api._build_annotation('x' * 1000),
+            self.api._build_annotation('small'),
+            self.api._build_annotation('ss'),
+        ]
+        self.store.get_binary_annotations.return_value = [
+            self.api._build_binary_annotation('http.uri', '/'),
+            self.api._build_binary_annotation('huge', 'x' * 1000),
+            self.api._build_binary_annotation('http.statuscode', 500),
+            self.api._build_binary_annotation('error', 'y' * 100),
+        ]
+        with patch('django_zipkin.api.settings.ZIPKIN_MAX_SPAN_SIZE', 400):
+            message = self.api.build_log_message()
+            span = self.api._shrink_span(self.api._build_span(), 400)
+        self.assertLessEqual(len(base64.b64decode(message)), 400)
+        self.assertEqual(base64.b64decode(message), self.api._encode(span))
+        self.assertListEqual([a.value for a in span.annotations], ['sr', 'small', 'ss'])
+        self.assertListEqual([a.key for a in span.binary_annotations],
+                             ['http.uri', 'http.statuscode', 'error', 'zipkin.truncated'])
+
+    def test_core_annotations_are_kept_when_nothing_else_fits(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(4242), sampled=True)
+        self.store.get_rpc_name.return_value = 'GET'
+        self.store.get_annotations.return_value = [self.api._build_annotation('sr'), self.api._build_annotation('ss')]
+        self.store.get_binary_annotations.return_value = [
+            self.api._build_binary_annotation('http.uri', '/' * 500),
+            self.api._build_binary_annotation('http.statuscode', 500),
+            self.api._build_binary_annotation('error', 'y' * 500),
+        ]
+        span = self.api._shrink_span(self.api._build_span(), 100)
+        self.assertListEqual([a.value for a in span.annotations], ['sr', 'ss'])
+        self.assertListEqual([a.key for a in span.binary_annotations], ['http.statuscode', 'error', 'zipkin.truncated'])
+
+    def test_span_within_size_limit_is_not_shrunk(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(4242), sampled=True)
+        self.store.get_rpc_name.return_value = 'GET'
+        self.store.get_annotations.return_value = [self.api._build_annotation('x' * 1000)]
+        self.store.get_binary_annotations.return_value = []
+        with patch('django_zipkin.api.settings.ZIPKIN_MAX_SPAN_SIZE', None):
+            self.assertEqual(base64.b64decode(self.api.build_log_message()), self.api._encode(self.api._build_span()))
+
     def test_integration(self):
         self.api.endpoint.ipv4 = 2130706433
+        self.store.get_start_time.return_value = (1, 10.0)
         binary_annotations = [self.api._build_binary_annotation('awesome', True)]
         annotations = [
             self.api._build_annotation('sr'),
@@ -173,3 +404,57 @@ class ZipkinApiTestCase(TestCase):
         self.mock_time.time.return_value = 1024
         self.assertEqual(self.api.build_log_message(), self.api.build_log_message())
         self.assertEqual(self.api.build_log_message(), 'CgABAAAAAAAAACoLAAMAAAAJdGVzdC1uYW1lCgAEAAAAAAAAEJIKAAUAAAAAAAAG7Q8ABgwAAAACCgABAAAAAAAAAAELAAIAAAACc3IMAAMIAAF/AAABAAAKAAEAAAAAAAAAAQsAAgAAAAJzcwwAAwgAAX8AAAEAAA8ACAwAAAABCwABAAAAB2F3ZXNvbWULAAIAAAABMQgAAwAAAAAMAAQIAAF/AAABAAACAAkAAA==')
+
+
+class HostIpResolverTestCase(TestCase):
+    def setUp(self):
+        self.resolver = HostIpResolver()
+
+    @patch('django_zipkin.api.socket.gethostbyname')
+    def test_resolves_once_for_all_callbacks(self, mock_gethostbyname):
+        mock_gethostbyname.return_value = '127.0.0.1'
+        first, second = Mock(), Mock()
+        self.resolver.resolve(first)
+        self.resolver.thread.join()
+        self.resolver.resolve(second)
+        first.assert_called_once_with(2130706433)
+        second.assert_called_once_with(2130706433)
+        self.assertEqual(mock_gethostbyname.call_count, 1)
+
+    @patch('django_zipkin.api.socket.gethostbyname')
+    def test_failed_lookup(self, mock_gethostbyname):
+        mock_gethostbyname.side_effect = Exception
+        callback = Mock()
+        self.resolver.resolve(callback)
+        self.resolver.thread.join()
+        callback.assert_called_once_with(None)
+
+    @patch('django_zipkin.api.socket.gethostbyname')
+    def test_lookup_is_restarted_after_fork(self, mock_gethostbyname):
+        mock_gethostbyname.return_value = '127.0.0.1'
+        callback = Mock()
+        # The lookup of the parent process, still running when it forked
+        self.resolver.callbacks.append(callback)
+        self.resolver.thread = Mock(spec=threading.Thread)
+        self.resolver.pid = -1
+        self.resolver.restart_if_forked()
+        self.resolver.thread.join()
+        callback.assert_called_once_with(2130706433)
+        self.assertEqual(self.resolver.pid, os.getpid())
+
+    def test_api_without_address_checks_for_fork(self):
+        with patch('django_zipkin.api.host_ip_resolver') as mock_resolver:
+            api = ZipkinApi(Mock(spec=BaseDataStore), 'service')
+            api.get_endpoint()
+            api.endpoint.ipv4 = 2130706433
+            api.get_endpoint()
+        mock_resolver.restart_if_forked.assert_called_once_with()
+
+    @patch('django_zipkin.api.socket.gethostbyname')
+    def test_lookup_is_not_restarted_in_same_process(self, mock_gethostbyname):
+        self.resolver.callbacks.append(Mock())
+        thread = self.resolver.thread = Mock(spec=threading.Thread)
+        self.resolver.pid = os.getpid()
+        self.resolver.restart_if_forked()
+        self.assertIs(self.resolver.thread, thread)
+        self.assertFalse(mock_gethostbyname.called)
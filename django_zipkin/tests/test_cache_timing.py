@@ -0,0 +1,82 @@
+from unittest2 import TestCase
+from mock import Mock, call, patch
+
+from django.core.cache.backends.locmem import LocMemCache
+
+from django_zipkin.api import ZipkinApi
+from django_zipkin.cache_timing import CacheCallTimer, instrument_cache_class
+from django_zipkin.data_store import BaseDataStore
+from django_zipkin.zipkin_data import ZipkinData
+
+
+__all__ = ['CacheCallTimerTestCase']
+
+
+class CacheCallTimerTestCase(TestCase):
+    def setUp(self):
+        self.api = Mock(spec=ZipkinApi)
+        self.api.store = Mock(spec=BaseDataStore)
+        self.api.store.get.return_value = ZipkinData(sampled=True)
+        self.timestamps = iter(range(1000, 100000, 100))
+        self.api.get_timestamp.side_effect = lambda: next(self.timestamps)
+        self.timer = CacheCallTimer(self.api, slow_call_threshold=1)
+        cache_class = type('TimedLocMemCache', (LocMemCache,), {})
+        instrument_cache_class(cache_class, self.timer)
+        self.cache = cache_class('test_cache_timing', {})
+        self.cache.clear()
+
+    def test_get_hit_and_miss(self):
+        self.cache.set('foo', 'bar')
+        self.api.reset_mock()
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.assertIsNone(self.cache.get('baz'))
+        self.api.record_aggregate.assert_has_calls([
+            call('django.cache.get', 100), call('django.cache.keys', count=1), call('django.cache.hits', count=1),
+            call('django.cache.get', 100), call('django.cache.keys', count=1), call('django.cache.misses', count=1),
+        ])
+
+    def test_get_with_default(self):
+        self.assertEqual(self.cache.get('foo', 42), 42)
+        self.api.record_aggregate.assert_has_calls([call('django.cache.misses', count=1)])
+
+    def test_get_many_is_timed_once(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.api.reset_mock()
+        self.assertEqual(self.cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.assertListEqual(self.api.record_aggregate.mock_calls, [
+            call('django.cache.get_many', 100), call('django.cache.keys', count=3), call('django.cache.hits', count=2),
+            call('django.cache.misses', count=1),
+        ])
+
+    def test_get_many_with_generator(self):
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.api.reset_mock()
+        self.assertEqual(self.cache.get_many(key for key in ['a', 'c']), {'a': 1})
+        self.assertEqual(self.cache.get_many(keys=(key for key in ['b'])), {'b': 2})
+        self.assertListEqual([c for c in self.api.record_aggregate.mock_calls if c[1] == ('django.cache.keys',)],
+                             [call('django.cache.keys', count=2), call('django.cache.keys', count=1)])
+
+    def test_recording_errors_dont_reach_the_caller(self):
+        self.api.record_aggregate.side_effect = ValueError
+        with patch('django_zipkin.cache_timing.logging') as mock_logging:
+            self.cache.set('foo', 'bar')
+            self.assertEqual(self.cache.get('foo'), 'bar')
+        self.assertEqual(mock_logging.root.exception.call_count, 2)
+
+    def test_set_and_delete(self):
+        self.cache.set('foo', 'bar')
+        self.cache.delete('foo')
+        self.assertIn(call('django.cache.set', 100), self.api.record_aggregate.mock_calls)
+        self.assertIn(call('django.cache.delete', 100), self.api.record_aggregate.mock_calls)
+        self.assertIsNone(self.cache.get('foo'))
+
+    def test_slow_calls_are_recorded(self):
+        self.timer.slow_call_threshold = 100
+        self.cache.set('foo', 'bar')
+        self.api.record_event.assert_called_once_with('django.cache.set', 100, 1000)
+
+    def test_untraced_requests(self):
+        self.api.store.get.return_value = ZipkinData(sampled=False)
+        self.cache.set('foo', 'bar')
+        self.assertEqual(self.cache.get('foo'), 'bar')
+        self.assertFalse(self.api.record_aggregate.called)
@@ -0,0 +1,127 @@
+import logging
+import threading
+
+from unittest2 import TestCase, skipUnless
+from mock import Mock, patch, call
+
+from django_zipkin.api import ZipkinApi
+from django_zipkin.celery_tracing import CeleryTracer, has_celery, install
+from django_zipkin.data_store import BaseDataStore, ThreadLocalDataStore
+from django_zipkin.id_generator import BaseIdGenerator
+from django_zipkin.sampler import BaseSampler
+from django_zipkin.zipkin_data import ZipkinData, ZipkinId
+
+
+__all__ = ['CeleryTracerTestCase']
+
+
+class CeleryTracerTestCase(TestCase):
+    def setUp(self):
+        self.store = Mock(spec=BaseDataStore)
+        self.store.get.return_value = ZipkinData()
+        self.api = Mock(spec=ZipkinApi)
+        self.generator = Mock(spec=BaseIdGenerator)
+        self.sampler = Mock(spec=BaseSampler)
+        self.sampler.is_sampled.return_value = False
+        self.tracer = CeleryTracer(self.store, self.api, self.generator, self.sampler)
+        self.tracer.logger = Mock(spec=logging.Logger)
+        self.task = Mock()
+        self.task.name = 'app.tasks.resize'
+        self.task.request = Mock(spec=['headers'], headers={})
+
+    def test_publish_adds_trace_headers(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42))
+        self.api.get_headers_for_downstream_request.return_value = {'X-B3-TraceId': '000000000000002a'}
+        headers = {'foo': 'bar'}
+        self.tracer.before_task_publish(headers=headers, body={})
+        self.assertDictEqual(headers, {'foo': 'bar', 'X-B3-TraceId': '000000000000002a'})
+
+    def test_publish_outside_of_trace(self):
+        headers = {}
+        self.tracer.before_task_publish(headers=headers, body={})
+        self.assertDictEqual(headers, {})
+
+    def test_task_continues_trace_from_headers(self):
+        self.task.request.headers = {'X-B3-TraceId': '000000000000002a', 'X-B3-SpanId': '0000000000000007',
+                                     'X-B3-Sampled': 'true'}
+        self.tracer.task_prerun(task_id='id', task=self.task, args=(), kwargs={})
+        data = self.store.set.call_args[0][0]
+        self.assertEqual(data.trace_id.get_binary(), 42)
+        self.assertEqual(data.parent_span_id.get_binary(), 7)
+        self.assertEqual(data.span_id, self.generator.generate_span_id.return_value)
+        self.assertTrue(data.sampled)
+        self.assertFalse(self.sampler.is_sampled.called)
+        self.api.set_rpc_name.assert_called_once_with('app.tasks.resize')
+        self.api.record_event.assert_called_once_with('sr')
+        self.api.record_key_value.assert_called_once_with('celery.task_id', 'id')
+
+    def test_task_reads_headers_from_request_attributes(self):
+        self.task.request = Mock(spec=['X-B3-TraceId'], **{'X-B3-TraceId': '000000000000002a'})
+        self.tracer.task_prerun(task_id='id', task=self.task)
+        self.assertEqual(self.store.set.call_args[0][0].trace_id.get_binary(), 42)
+
+    def test_task_without_trace_starts_one(self):
+        self.tracer.task_prerun(task_id='id', task=self.task)
+        data = self.store.set.call_args[0][0]
+        self.assertEqual(data.trace_id, self.generator.generate_trace_id.return_value)
+        self.sampler.is_sampled.assert_called_once_with(data.trace_id)
+
+    def test_task_postrun_logs_span(self):
+        self.tracer.task_prerun(task_id='id', task=self.task)
+        self.api.reset_mock()
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        self.tracer.task_postrun(task_id='id', task=self.task, state='SUCCESS')
+        self.api.record_event.assert_called_once_with('ss', self.api.get_elapsed_time.return_value)
+        self.api.record_key_value.assert_called_once_with('celery.state', 'SUCCESS')
+        self.tracer.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
+        self.assertTrue(self.store.clear.called)
+
+    def test_task_postrun_unsampled(self):
+        self.tracer.task_prerun(task_id='id', task=self.task)
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=False)
+        self.tracer.task_postrun(task_id='id', task=self.task, state='SUCCESS')
+        self.assertFalse(self.tracer.logger.info.called)
+
+    def test_inline_task_runs_in_current_span(self):
+        with patch.object(ThreadLocalDataStore, 'thread_local_data', threading.local()):
+            store = ThreadLocalDataStore()
+            store.clear()
+            data = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(7), sampled=True)
+            store.set(data)
+            store.set_rpc_name('request')
+            tracer = CeleryTracer(store, self.api, self.generator, self.sampler)
+            tracer.logger = Mock(spec=logging.Logger)
+            self.task.request.is_eager = True
+            tracer.task_prerun(task_id='id', task=self.task)
+            tracer.task_postrun(task_id='id', task=self.task, state='SUCCESS')
+            self.assertIs(store.get(), data)
+            self.assertEqual(store.get_rpc_name(), 'request')
+        self.assertFalse(self.api.record_event.called)
+        self.assertFalse(tracer.logger.info.called)
+
+    def test_trace_left_in_worker_thread_is_replaced(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(7), sampled=True)
+        self.tracer.task_prerun(task_id='id', task=self.task)
+        self.assertTrue(self.store.clear.called)
+        data = self.store.set.call_args[0][0]
+        self.assertEqual(data.trace_id, self.generator.generate_trace_id.return_value)
+        self.api.record_event.assert_called_once_with('sr')
+
+    def test_tasks_run_inline_in_task_are_part_of_its_span(self):
+        self.tracer.task_prerun(task_id='outer', task=self.task)
+        self.store.get.return_value = self.store.set.call_args[0][0]
+        inner_task = Mock()
+        inner_task.request = Mock(spec=['headers', 'is_eager'], headers={}, is_eager=True)
+        self.tracer.task_prerun(task_id='inner', task=inner_task)
+        self.tracer.task_postrun(task_id='inner', task=inner_task, state='SUCCESS')
+        self.assertEqual(self.store.set.call_count, 1)
+        self.assertEqual(self.store.clear.call_count, 1)
+        self.tracer.task_postrun(task_id='outer', task=self.task, state='SUCCESS')
+        self.api.record_key_value.assert_has_calls([call('celery.task_id', 'outer'), call('celery.state', 'SUCCESS')])
+        self.assertEqual(self.store.clear.call_count, 2)
+
+    @skipUnless(has_celery, 'celery is not installed')
+    def test_install(self):
+        with patch('django_zipkin.celery_tracing.signals') as mock_signals:
+            install(self.tracer)
+        mock_signals.task_prerun.connect.assert_called_once_with(self.tracer.task_prerun, weak=False)
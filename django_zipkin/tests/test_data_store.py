@@ -1,9 +1,11 @@
+import threading
+
 from unittest2.case import TestCase
 from mock import patch, Mock, sentinel
 
 from django_zipkin.data_store import BaseDataStore, ThreadLocalDataStore
 from django_zipkin.zipkin_data import ZipkinData
-from django_zipkin._thrift.zipkinCore.ttypes import Annotation, BinaryAnnotation
+from django_zipkin._thrift.zipkinCore.ttypes import Annotation, BinaryAnnotation, AnnotationType
 
 from helpers import DjangoZipkinTestHelpers
 
@@ -16,6 +18,8 @@ class BaseDataStoreTestCase(TestCase):
         self.store = BaseDataStore()
         self.store._record_annotation = Mock()
         self.store._record_binary_annotation = Mock()
+        self.store.get_annotations = Mock(return_value=[])
+        self.store.get_binary_annotations = Mock(return_value=[])
 
     def test_record_noop_if_not_sampled(self):
         self.store.get = lambda: ZipkinData(sampled=False)
@@ -28,12 +32,87 @@ class BaseDataStoreTestCase(TestCase):
     def test_record_delegates_if_sampled(self):
         self.store.get = lambda: ZipkinData(sampled=True)
         annotation = Mock(spec=Annotation)
-        binary_annotation = Mock(spec=BinaryAnnotation)
+        binary_annotation = Mock(spec=BinaryAnnotation, annotation_type=AnnotationType.BOOL)
         self.store.record(annotation)
         self.store.record(binary_annotation)
         self.store._record_annotation.assert_called_once_with(annotation)
         self.store._record_binary_annotation.assert_called_once_with(binary_annotation)
 
+    def test_annotation_count_limit(self):
+        self.store.get = lambda: ZipkinData(sampled=True)
+        annotation = Annotation(42, 'foo', sentinel.host)
+        with patch('django_zipkin.data_store.settings.ZIPKIN_MAX_ANNOTATIONS', 2):
+            self.store.get_annotations.return_value = [Mock()]
+            self.store.record(annotation)
+            self.store._record_annotation.assert_called_once_with(annotation)
+            self.store.get_annotations.return_value = [Mock(), Mock()]
+            self.store.record(annotation)
+            marker = self.store._record_annotation.call_args[0][0]
+            self.assertEqual((marker.timestamp, marker.value, marker.host), (42, 'zipkin.truncated', sentinel.host))
+            self.store.get_annotations.return_value = [Mock(), Mock(), marker]
+            self.store.record(annotation)
+            self.assertEqual(self.store._record_annotation.call_count, 2)
+
+    def test_core_annotations_bypass_count_limit(self):
+        self.store.get = lambda: ZipkinData(sampled=True)
+        marker = Annotation(42, 'zipkin.truncated', sentinel.host)
+        with patch('django_zipkin.data_store.settings.ZIPKIN_MAX_ANNOTATIONS', 2):
+            self.store.get_annotations.return_value = [Annotation(1, 'sr', sentinel.host), Mock(), marker]
+            for value in ['foo', 'cs', 'cr', 'ss']:
+                self.store.record(Annotation(42, value, sentinel.host))
+            self.store.get_annotations.return_value.append(Annotation(43, 'ss', sentinel.host))
+            self.store.record(Annotation(44, 'bar', sentinel.host))
+        self.assertListEqual([c[0][0].value for c in self.store._record_annotation.call_args_list], ['cs', 'cr', 'ss'])
+
+    def test_binary_annotation_count_limit(self):
+        self.store.get = lambda: ZipkinData(sampled=True)
+        annotation = BinaryAnnotation('foo', 'bar', AnnotationType.STRING, sentinel.host)
+        with patch('django_zipkin.data_store.settings.ZIPKIN_MAX_BINARY_ANNOTATIONS', 1):
+            self.store.record(annotation)
+            self.store._record_binary_annotation.assert_called_once_with(annotation)
+            self.store.get_binary_annotations.return_value = [Mock()]
+            self.store.record(annotation)
+            self.assertEqual(self.store._record_binary_annotation.call_args[0][0],
+                             BinaryAnnotation('zipkin.truncated', '1', AnnotationType.BOOL, sentinel.host))
+            marker = self.store._record_binary_annotation.call_args[0][0]
+            self.store.get_binary_annotations.return_value = [Mock(), marker]
+            self.store.record(annotation)
+            self.assertEqual(self.store._record_binary_annotation.call_count, 2)
+
+    def test_core_binary_annotations_bypass_count_limit(self):
+        self.store.get = lambda: ZipkinData(sampled=True)
+        with patch('django_zipkin.data_store.settings.ZIPKIN_MAX_BINARY_ANNOTATIONS', 1):
+            self.store.get_binary_annotations.return_value = [
+                Mock(), BinaryAnnotation('zipkin.truncated', '1', AnnotationType.BOOL, sentinel.host),
+                BinaryAnnotation('http.statuscode', '500', AnnotationType.I32, sentinel.host)
+            ]
+            for key in ['http.statuscode', 'error', 'error.class', 'zipkin.sampling_reason', 'foo']:
+                self.store.record(BinaryAnnotation(key, 'x', AnnotationType.STRING, sentinel.host))
+        self.assertListEqual([c[0][0].key for c in self.store._record_binary_annotation.call_args_list],
+                             ['http.statuscode', 'error', 'error.class', 'zipkin.sampling_reason'])
+
+    def test_binary_annotation_value_length_limit(self):
+        self.store.get = lambda: ZipkinData(sampled=True)
+        with patch('django_zipkin.data_store.settings.ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH', 5):
+            self.store.record(BinaryAnnotation('foo', 'x' * 6, AnnotationType.STRING, sentinel.host))
+            self.store.record(BinaryAnnotation('foo', 'x' * 5, AnnotationType.STRING, sentinel.host))
+            self.store.record(BinaryAnnotation('foo', 'x' * 8, AnnotationType.I64, sentinel.host))
+        self.assertListEqual([c[0][0].value for c in self.store._record_binary_annotation.call_args_list],
+                             ['xx...', 'xxxxx', 'x' * 8])
+
+    def test_no_limits(self):
+        self.store.get = lambda: ZipkinData(sampled=True)
+        self.store.get_annotations.return_value = [Mock()] * 1000
+        self.store.get_binary_annotations.return_value = [Mock()] * 1000
+        with patch.multiple('django_zipkin.data_store.settings', ZIPKIN_MAX_ANNOTATIONS=None,
+                            ZIPKIN_MAX_BINARY_ANNOTATIONS=None, ZIPKIN_MAX_BINARY_ANNOTATION_VALUE_LENGTH=None):
+            annotation = Annotation(42, 'foo', sentinel.host)
+            binary_annotation = BinaryAnnotation('foo', 'x' * 10000, AnnotationType.STRING, sentinel.host)
+            self.store.record(annotation)
+            self.store.record(binary_annotation)
+        self.store._record_annotation.assert_called_once_with(annotation)
+        self.store._record_binary_annotation.assert_called_once_with(binary_annotation)
+
 
 class ThreadLocalDataStoreTestCase(DjangoZipkinTestHelpers, TestCase):
     def setUp(self):
@@ -61,7 +140,7 @@ class ThreadLocalDataStoreTestCase(DjangoZipkinTestHelpers, TestCase):
 
     def test_annotations(self):
         annotations = [Mock(spec=Annotation), Mock(spec=Annotation)]
-        binary_annotations = [Mock(spec=BinaryAnnotation), Mock(spec=BinaryAnnotation)]
+        binary_annotations = [Mock(spec=BinaryAnnotation, annotation_type=AnnotationType.BOOL), Mock(spec=BinaryAnnotation, annotation_type=AnnotationType.BOOL)]
         store = ThreadLocalDataStore()
         store.clear()
         store.set(ZipkinData(sampled=True))
@@ -77,12 +156,29 @@ class ThreadLocalDataStoreTestCase(DjangoZipkinTestHelpers, TestCase):
         store.set_rpc_name(sentinel.rpc_name)
         self.assertEqual(store.get_rpc_name(), sentinel.rpc_name)
 
+    def test_start_time(self):
+        store = ThreadLocalDataStore()
+        store.clear()
+        self.assertIsNone(store.get_start_time())
+        store.set_start_time(sentinel.start_time)
+        self.assertEqual(store.get_start_time(), sentinel.start_time)
+
+    def test_endpoint(self):
+        store = ThreadLocalDataStore()
+        store.clear()
+        self.assertIsNone(store.get_endpoint())
+        store.set_endpoint(sentinel.endpoint)
+        self.assertEqual(store.get_endpoint(), sentinel.endpoint)
+
     def test_clear(self):
         annotations = [Mock(spec=Annotation), Mock(spec=Annotation)]
-        binary_annotations = [Mock(spec=BinaryAnnotation), Mock(spec=BinaryAnnotation)]
+        binary_annotations = [Mock(spec=BinaryAnnotation, annotation_type=AnnotationType.BOOL), Mock(spec=BinaryAnnotation, annotation_type=AnnotationType.BOOL)]
         store = ThreadLocalDataStore()
         store.set(ZipkinData(sampled=True, trace_id=Mock()))
         store.set_rpc_name(Mock())
+        store.set_start_time(Mock())
+        store.set_endpoint(Mock())
+        store.get_aggregates()['key'] = (1, 1)
         for annotation in annotations + binary_annotations:
             store.record(annotation)
         store.clear()
@@ -90,6 +186,37 @@ class ThreadLocalDataStoreTestCase(DjangoZipkinTestHelpers, TestCase):
         self.assertListEqual([], store.get_binary_annotations())
         self.assertZipkinDataEquals(ZipkinData(), store.get())
         self.assertIsNone(store.get_rpc_name())
+        self.assertIsNone(store.get_start_time())
+        self.assertIsNone(store.get_endpoint())
+        self.assertDictEqual(store.get_aggregates(), {})
+
+    def test_clear_keeps_data_of_other_threads(self):
+        ThreadLocalDataStore.thread_local_data = threading.local()
+        store = ThreadLocalDataStore()
+        data = ZipkinData(sampled=True, trace_id=Mock())
+        store.set(data)
+        thread = threading.Thread(target=store.clear)
+        thread.start()
+        thread.join()
+        self.assertIs(store.get(), data)
+
+    def test_span_keeps_its_end_past_the_limits(self):
+        ThreadLocalDataStore.thread_local_data = threading.local()
+        store = ThreadLocalDataStore()
+        store.clear()
+        store.set(ZipkinData(sampled=True))
+        with patch.multiple('django_zipkin.data_store.settings', ZIPKIN_MAX_ANNOTATIONS=5,
+                            ZIPKIN_MAX_BINARY_ANNOTATIONS=3):
+            store.record(Annotation(1, 'sr', None))
+            for i in range(10):
+                store.record(Annotation(2, 'loop%d' % i, None))
+                store.record(BinaryAnnotation('loop%d' % i, 'x', AnnotationType.STRING, None))
+            store.record(Annotation(3, 'ss', None))
+            store.record(BinaryAnnotation('http.statuscode', '200', AnnotationType.I32, None))
+        self.assertListEqual([a.value for a in store.get_annotations()],
+                             ['sr', 'loop0', 'loop1', 'loop2', 'loop3', 'zipkin.truncated', 'ss'])
+        self.assertListEqual([a.key for a in store.get_binary_annotations()],
+                             ['loop0', 'loop1', 'loop2', 'zipkin.truncated', 'http.statuscode'])
 
     def test_dont_freak_out_if_thread_local_store_is_gone(self):
         store = ThreadLocalDataStore()
@@ -2,11 +2,14 @@ from unittest2.case import TestCase
 from mock import Mock, call
 from mock import patch
 
+import io
+import json
 import logging
+import tempfile
 import types
 
 from django.test import RequestFactory
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, FileResponse
 
 from helpers import DjangoZipkinTestHelpers
 
@@ -15,20 +18,31 @@ from django_zipkin.api import ZipkinApi
 from django_zipkin.zipkin_data import ZipkinData, ZipkinId
 from django_zipkin.data_store import BaseDataStore
 from django_zipkin.id_generator import BaseIdGenerator
-from django_zipkin.middleware import ZipkinMiddleware, ZipkinDjangoRequestParser
+from django_zipkin.middleware import ZipkinMiddleware, ZipkinCallableMiddleware, ZipkinDjangoRequestParser
+from django_zipkin.url_policies import UrlPolicyTable
+from django_zipkin.sampler import TailSampler, BaseSampler
+from django_zipkin.profiling import BaseRequestProfiler
 from django_zipkin import constants
 
 
-__all__ = ['ZipkinMiddlewareTestCase', 'ZipkinDjangoRequestProcessorTestCase']
+__all__ = ['ZipkinMiddlewareTestCase', 'ZipkinCallableMiddlewareTestCase', 'ZipkinDjangoRequestProcessorTestCase']
+
+
+class PaymentError(Exception):
+    pass
 
 
 class ZipkinMiddlewareTestCase(TestCase):
     def setUp(self):
         self.store = Mock(spec=BaseDataStore)
         self.request_processor = Mock(spec=ZipkinDjangoRequestParser)
+        self.request_processor.get_request_start.return_value = None
         self.generator = Mock(spec=BaseIdGenerator)
         self.api = Mock(spec=ZipkinApi)
-        self.middleware = ZipkinMiddleware(self.store, self.request_processor, self.generator, self.api)
+        self.sampler = Mock(spec=BaseSampler)
+        self.sampler.is_sampled.return_value = False
+        self.middleware = ZipkinMiddleware(self.store, self.request_processor, self.generator, self.api,
+                                           sampler=self.sampler)
         self.request_factory = RequestFactory()
 
     def test_resolve_request_on_django_lt_15(self):
@@ -39,6 +53,16 @@ class ZipkinMiddlewareTestCase(TestCase):
                                  mock_resolve.return_value)
         reload(django_zipkin.middleware)
 
+    def test_resolve_request_caches_resolutions_on_django_lt_15(self):
+        with patch('django.VERSION', new=(1, 4)):
+            reload(django_zipkin.middleware)
+            with patch('django_zipkin.middleware.resolve') as mock_resolve:
+                request = Mock(path_info='/foo/')
+                django_zipkin.middleware.resolve_request(request)
+                self.assertEqual(django_zipkin.middleware.resolve_request(request), mock_resolve.return_value)
+                mock_resolve.assert_called_once_with('/foo/')
+        reload(django_zipkin.middleware)
+
     def test_resolve_request_on_django_ge_15(self):
         with patch('django.VERSION', new=(1, 5)):
             reload(django_zipkin.middleware)
@@ -47,54 +71,193 @@ class ZipkinMiddlewareTestCase(TestCase):
         reload(django_zipkin.middleware)
 
     def test_intercepts_incoming_trace_id(self):
-        self.middleware.process_request(Mock())
+        self.middleware.process_request(self.request_factory.get('/'))
         self.store.set.assert_called_once_with(self.request_processor.get_zipkin_data.return_value)
 
     def test_generates_ids_if_no_incoming(self):
         self.request_processor.get_zipkin_data.return_value = ZipkinData()
-        self.middleware.process_request(Mock())
+        self.middleware.process_request(self.request_factory.get('/'))
         self.generator.generate_trace_id.assert_called_once_with()
         self.generator.generate_span_id.assert_called_once_with()
         data = self.store.set.call_args[0][0]
         self.assertEqual(data.span_id, self.generator.generate_span_id.return_value)
         self.assertEqual(data.trace_id, self.generator.generate_trace_id.return_value)
 
+    def test_sets_endpoint_port_from_request(self):
+        request = self.request_factory.get('/', SERVER_PORT='8001', SERVER_NAME='10.0.0.1')
+        self.middleware.process_request(request)
+        self.api.set_endpoint.assert_called_once_with(8001, None)
+
+    def test_sets_endpoint_address_from_request(self):
+        with patch('django_zipkin.defaults.ZIPKIN_ENDPOINT_IPV4_FROM_REQUEST', True):
+            self.middleware.process_request(self.request_factory.get('/', SERVER_PORT='8001', SERVER_NAME='10.0.0.1'))
+            self.api.set_endpoint.assert_called_once_with(8001, '10.0.0.1')
+            self.api.set_endpoint.reset_mock()
+            self.middleware.process_request(self.request_factory.get('/', SERVER_PORT='8001', SERVER_NAME='example.com'))
+            self.api.set_endpoint.assert_called_once_with(8001, None)
+
+    def test_ignores_invalid_server_port(self):
+        for port in ['', 'http', '0', '70000']:
+            self.middleware.process_request(self.request_factory.get('/', SERVER_PORT=port))
+        self.assertFalse(self.api.set_endpoint.called)
+
+    def test_samples_when_no_upstream_decision(self):
+        for sampled in [True, False]:
+            self.sampler.is_sampled.return_value = sampled
+            self.request_processor.get_zipkin_data.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=None)
+            self.middleware.process_request(self.request_factory.get('/'))
+            self.assertEqual(self.sampler.is_sampled.call_args[0][0].get_binary(), 42)
+            self.assertEqual(self.store.set.call_args[0][0].sampled, sampled)
+
+    def test_keeps_upstream_sampling_decision(self):
+        for sampled in [True, False]:
+            self.request_processor.get_zipkin_data.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=sampled)
+            self.middleware.process_request(self.request_factory.get('/'))
+            self.assertEqual(self.store.set.call_args[0][0].sampled, sampled)
+        self.assertFalse(self.sampler.is_sampled.called)
+
     def test_annotates_uri(self):
         uri = '/foo/bar?x=y'
         request = self.request_factory.get(uri, HTTP_X_B3_SAMPLED='true')
         self.middleware.process_request(request)
-        self.api.record_key_value.assert_has_calls(call('http.uri', uri))
+        self.api.record_key_value_deferred.assert_has_calls(call('http.uri', request.get_full_path))
+        self.assertEqual(request.get_full_path(), uri)
 
     def test_annotates_responsecode(self):
         self.store.get.return_value = ZipkinData()
         self.middleware.process_response(self.request_factory.get('/', HTTP_X_B3_SAMPLED='true'), HttpResponse(status=42))
         self.api.record_key_value.assert_has_calls(call('http.statuscode', 42))
 
+    def test_records_duration_on_server_send(self):
+        self.store.get.return_value = ZipkinData()
+        self.middleware.process_response(self.request_factory.get('/'), HttpResponse())
+        self.api.record_event.assert_has_calls([call('ss', self.api.get_elapsed_time.return_value)])
+
+    def test_records_queue_wait(self):
+        self.request_processor.get_zipkin_data.return_value = ZipkinData(sampled=True)
+        self.request_processor.get_request_start.return_value = 1400000000000000
+        self.api.get_start_timestamp.return_value = 1400000000025000
+        self.middleware.process_request(self.request_factory.get('/'))
+        self.api.record_event.assert_has_calls([call('sr'), call('queue.wait', duration=25000, timestamp=1400000000000000)])
+
+    def test_ignores_negative_queue_wait(self):
+        self.request_processor.get_zipkin_data.return_value = ZipkinData(sampled=True)
+        self.request_processor.get_request_start.return_value = 1400000000025000
+        self.api.get_start_timestamp.return_value = 1400000000000000
+        self.middleware.process_request(self.request_factory.get('/'))
+        self.api.record_event.assert_called_once_with('sr')
+
+    def test_streaming_response_span_is_finished_after_body_is_sent(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        self.middleware.logger = Mock(spec=logging.Logger)
+        response = self.middleware.process_response(self.request_factory.get('/'),
+                                                    StreamingHttpResponse(['foo', 'barbaz']))
+        self.assertFalse(self.api.record_event.called)
+        self.assertEqual(''.join(response.streaming_content), 'foobarbaz')
+        self.api.record_event.assert_called_once_with('ss', self.api.get_elapsed_time.return_value)
+        self.api.record_key_value.assert_has_calls([call('http.response.size', 9), call('http.statuscode', 200)])
+        self.middleware.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
+        response.close()
+        self.assertEqual(self.middleware.logger.info.call_count, 1)
+
+    def test_streaming_response_span_is_finished_when_closed(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        response = self.middleware.process_response(self.request_factory.get('/'), StreamingHttpResponse(['foo']))
+        response.close()
+        self.api.record_event.assert_called_once_with('ss', self.api.get_elapsed_time.return_value)
+        self.api.record_key_value.assert_has_calls([call('http.response.size', 0)])
+
+    def test_file_response_is_left_to_file_wrapper(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        self.middleware.logger = Mock(spec=logging.Logger)
+        filelike = tempfile.TemporaryFile()
+        filelike.write('x' * 10000)
+        filelike.seek(1000)
+        response = self.middleware.process_response(self.request_factory.get('/'), FileResponse(filelike))
+        self.assertEqual(response.file_to_stream.fileno(), filelike.fileno())
+        self.assertFalse(self.api.record_event.called)
+        # Django 1.8 only closes the file given to wsgi.file_wrapper
+        response.file_to_stream.close()
+        self.assertTrue(filelike.closed)
+        self.api.record_event.assert_called_once_with('ss', self.api.get_elapsed_time.return_value)
+        self.api.record_key_value.assert_has_calls([call('http.response.size', 9000), call('http.statuscode', 200)])
+        response.close()
+        self.assertEqual(self.middleware.logger.info.call_count, 1)
+
+    def test_file_response_span_is_finished_when_closed(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        response = FileResponse(io.BytesIO('foo'))
+        response['Content-Length'] = '3'
+        response = self.middleware.process_response(self.request_factory.get('/'), response)
+        self.assertEqual(''.join(response.streaming_content), 'foo')
+        self.assertFalse(self.api.record_event.called)
+        response.close()
+        self.api.record_event.assert_called_once_with('ss', self.api.get_elapsed_time.return_value)
+        self.api.record_key_value.assert_has_calls([call('http.response.size', 3)])
+
+    def test_file_response_of_unknown_size(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        response = self.middleware.process_response(self.request_factory.get('/'), FileResponse(io.BytesIO('foo')))
+        response.close()
+        self.api.record_key_value.assert_called_once_with('http.statuscode', 200)
+
     def test_annotates_view_name_and_arguments_of_view_function(self):
         request, view, args, kwargs = Mock(), Mock(spec=types.FunctionType), (1, 2), {'kw': 'arg'}
         self.middleware.process_view(request, view, args, kwargs)
-        self.api.record_key_value.assert_has_calls([
-            call('django.view.kwargs', '{"kw": "arg"}'),
+        self.api.encode_key_value.assert_has_calls([
             call('django.view.func_name', view.func_name),
-            call('django.view.args', '[1, 2]')
+        ], any_order=True)
+        self.api.record_encoded_key_value.assert_has_calls([call(self.api.encode_key_value.return_value)])
+        self.api.record_key_value_deferred.assert_has_calls([
+            call('django.view.kwargs', json.dumps, {'kw': 'arg'}),
+            call('django.view.args', json.dumps, (1, 2))
         ], any_order=True)
 
     def test_annotates_view_name_and_arguments_of_view_method(self):
         request, view, args, kwargs = Mock(), Mock(spec=types.MethodType, im_class=Mock(__name__=Mock())), (3, 4), {'more': 'kwargs'}
         self.middleware.process_view(request, view, args, kwargs)
-        self.api.record_key_value.assert_has_calls([
+        self.api.encode_key_value.assert_has_calls([
             call('django.view.class', view.im_class.__name__),
             call('django.view.func_name', view.im_func.func_name),
-            call('django.view.args', '[3, 4]'),
-            call('django.view.kwargs', '{"more": "kwargs"}')
         ], any_order=True)
+        self.api.record_key_value_deferred.assert_has_calls([
+            call('django.view.args', json.dumps, (3, 4)),
+            call('django.view.kwargs', json.dumps, {'more': 'kwargs'})
+        ], any_order=True)
+
+    def test_annotates_url_name(self):
+        request, view = Mock(), Mock(spec=types.FunctionType)
+        with patch('django_zipkin.middleware.resolve_request') as mock_resolve_request:
+            mock_resolve_request.return_value.url_name = 'my-url'
+            self.middleware.process_view(request, view, (), {})
+        self.api.encode_key_value.assert_has_calls([call('django.url_name', 'my-url')])
+
+    def test_caches_view_annotations(self):
+        request, view = Mock(), Mock(spec=types.FunctionType)
+        with patch('django_zipkin.middleware.resolve_request') as mock_resolve_request:
+            mock_resolve_request.return_value.url_name = 'my-url'
+            self.middleware.process_view(request, view, (), {})
+            self.api.encode_key_value.reset_mock()
+            self.api.record_encoded_key_value.reset_mock()
+            self.middleware.process_view(request, view, (), {})
+        self.assertListEqual(self.api.encode_key_value.mock_calls, [])
+        self.assertEqual(self.api.record_encoded_key_value.call_count, 2)
+
+    def test_does_not_cache_views_that_cannot_be_weakly_referenced(self):
+        request, view = Mock(), Mock(spec=types.FunctionType)
+        self.middleware.view_annotations = Mock(__getitem__=Mock(side_effect=TypeError),
+                                                __setitem__=Mock(side_effect=TypeError))
+        self.middleware.process_view(request, view, (), {})
+        self.api.encode_key_value.assert_has_calls([call('django.view.func_name', view.func_name)])
 
     def test_adds_tastypie_specific_annotation(self):
         request, view, args, kwargs = Mock(), Mock(spec=types.FunctionType), (1, 2), {'resource_name': 'test-resource'}
         self.middleware.process_view(request, view, args, kwargs)
         self.api.record_key_value.assert_has_calls([
             call('django.tastypie.resource_name', 'test-resource'),
-            call('django.view.kwargs', '{}')
+        ], any_order=True)
+        self.api.record_key_value_deferred.assert_has_calls([
+            call('django.view.kwargs', json.dumps, {})
         ], any_order=True)
 
     def test_with_defaults(self):
@@ -113,22 +276,258 @@ class ZipkinMiddlewareTestCase(TestCase):
             for flags in [True, False]:
                 self.middleware.logger = Mock(spec=logging.Logger)
                 self.middleware.store.get.return_value = ZipkinData(sampled=sampled, flags=flags)
-                self.middleware.process_response(Mock(), HttpResponse())
+                self.middleware.process_response(self.request_factory.get('/'), HttpResponse())
                 if sampled or flags:
                     self.middleware.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
                 else:
                     self.assertListEqual(self.middleware.logger.info.mock_calls, [])
 
+    def test_never_traced_path(self):
+        self.middleware.url_policies = UrlPolicyTable([{'path': '^/health', 'trace': 'never'}])
+        self.middleware.logger = Mock(spec=logging.Logger)
+        request = self.request_factory.get('/health', HTTP_X_B3_SAMPLED='true')
+        self.middleware.process_request(request)
+        self.middleware.process_view(request, Mock(spec=types.FunctionType), (), {})
+        self.middleware.process_response(request, HttpResponse())
+        self.store.clear.assert_called_once_with()
+        self.assertFalse(self.request_processor.get_zipkin_data.called)
+        self.assertListEqual(self.api.mock_calls, [])
+        self.assertListEqual(self.middleware.logger.info.mock_calls, [])
+
+    def test_always_traced_path(self):
+        self.middleware.url_policies = UrlPolicyTable([{'path': '^/admin/', 'trace': 'always'}])
+        self.request_processor.get_zipkin_data.return_value = ZipkinData()
+        self.middleware.process_request(self.request_factory.get('/admin/'))
+        self.assertTrue(self.store.set.call_args[0][0].sampled)
+
+    def test_url_name_policies(self):
+        self.middleware.url_policies = UrlPolicyTable([
+            {'url_name': 'admin', 'trace': 'always', 'view_kwargs': False},
+            {'url_name': 'health', 'trace': 'never'},
+        ])
+        request = self.request_factory.get('/admin/')
+        with patch('django_zipkin.middleware.resolve_request') as mock_resolve_request:
+            mock_resolve_request.return_value.url_name = 'admin'
+            self.store.get.return_value = data = ZipkinData(trace_id=ZipkinId(42))
+            self.middleware.process_view(request, Mock(spec=types.FunctionType), (1,), {'x': 'y'})
+            self.assertTrue(data.sampled)
+            self.api.record_event.assert_called_once_with('sr', timestamp=self.api.get_start_timestamp.return_value)
+            self.api.record_key_value_deferred.assert_has_calls([
+                call('http.uri', request.get_full_path),
+                call('django.view.args', json.dumps, (1,))
+            ])
+            self.assertNotIn('django.view.kwargs', [c[1][0] for c in self.api.record_key_value_deferred.mock_calls])
+
+            mock_resolve_request.return_value.url_name = 'health'
+            self.store.get.return_value = data = ZipkinData(trace_id=ZipkinId(42), sampled=True, flags=True)
+            self.middleware.process_view(request, Mock(spec=types.FunctionType), (), {})
+            self.assertFalse(data.is_tracing())
+
+    def test_tail_sampling_records_unsampled_requests_provisionally(self):
+        self.middleware.tail_sampler = Mock(spec=TailSampler)
+        # Without an X-B3-Sampled header
+        self.request_processor.get_zipkin_data.return_value = ZipkinData(sampled=None)
+        self.middleware.process_request(self.request_factory.get('/'))
+        self.assertTrue(self.store.set.call_args[0][0].provisional)
+
+    def test_tail_sampling_leaves_sampled_requests_alone(self):
+        self.middleware.tail_sampler = Mock(spec=TailSampler)
+        self.request_processor.get_zipkin_data.return_value = ZipkinData(sampled=True)
+        self.middleware.process_request(self.request_factory.get('/'))
+        self.assertFalse(self.store.set.call_args[0][0].provisional)
+
+    def test_tail_sampling_keeps_upstream_decision_not_to_sample(self):
+        self.middleware.tail_sampler = TailSampler(keep_errors=True)
+        self.middleware.logger = Mock(spec=logging.Logger)
+        self.request_processor.get_zipkin_data.return_value = data = ZipkinData(trace_id=ZipkinId(42), sampled=False)
+        request = self.request_factory.get('/', HTTP_X_B3_SAMPLED='0')
+        self.middleware.process_request(request)
+        self.assertFalse(data.is_provisional())
+        self.store.get.return_value = data
+        self.middleware.process_exception(request, ValueError())
+        self.middleware.process_response(request, HttpResponse(status=500))
+        self.assertFalse(self.middleware.logger.info.called)
+
+    def test_tail_sampling_decision(self):
+        self.middleware.tail_sampler = TailSampler(latency_threshold=1000, min_status_code=500)
+        self.middleware.logger = Mock(spec=logging.Logger)
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), provisional=True)
+        cases = [(200, 10 * 1000, None), (500, 10 * 1000, 'status_code'), (200, 2000 * 1000, 'latency')]
+        for status_code, duration, reason in cases:
+            self.api.reset_mock()
+            self.middleware.logger.reset_mock()
+            self.api.get_elapsed_time.return_value = duration
+            self.middleware.process_response(self.request_factory.get('/'), HttpResponse(status=status_code))
+            if reason is None:
+                self.assertListEqual(self.middleware.logger.info.mock_calls, [])
+                self.assertNotIn(call('zipkin.sampling_reason', reason), self.api.record_key_value.mock_calls)
+            else:
+                self.api.record_key_value.assert_has_calls([call('zipkin.sampling_reason', reason)])
+                self.middleware.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
+
+    def test_tail_sampling_overridden_by_url_policies(self):
+        self.middleware.url_policies = UrlPolicyTable([{'url_name': 'admin', 'trace': 'always'},
+                                                       {'url_name': 'health', 'trace': 'never'}])
+        with patch('django_zipkin.middleware.resolve_request') as mock_resolve_request:
+            mock_resolve_request.return_value.url_name = 'admin'
+            self.store.get.return_value = data = ZipkinData(trace_id=ZipkinId(42), provisional=True)
+            self.middleware.process_view(Mock(), Mock(spec=types.FunctionType), (), {})
+            self.assertTrue(data.sampled)
+            self.assertFalse(data.is_provisional())
+            self.assertFalse(self.api.record_event.called)  # sr was already recorded
+
+            mock_resolve_request.return_value.url_name = 'health'
+            self.store.get.return_value = data = ZipkinData(trace_id=ZipkinId(42), provisional=True)
+            self.middleware.process_view(Mock(), Mock(spec=types.FunctionType), (), {})
+            self.assertFalse(data.is_tracing())
+
+    def test_process_exception_records_error(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        request = self.request_factory.get('/')
+        self.assertIsNone(self.middleware.process_exception(request, ValueError('invalid literal')))
+        self.assertListEqual(self.api.record_key_value.mock_calls, [
+            call('error', u'invalid literal'), call('error.class', 'ValueError')
+        ])
+        self.assertTrue(request._zipkin_error)
+
+    def test_process_exception_message(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        with patch('django_zipkin.middleware.settings.ZIPKIN_ERROR_MESSAGE_MAX_LENGTH', 10):
+            self.middleware.process_exception(self.request_factory.get('/'), PaymentError('x' * 20))
+            self.middleware.process_exception(self.request_factory.get('/'), PaymentError())
+            self.middleware.process_exception(self.request_factory.get('/'), PaymentError('\xc3\xa9\xff'))
+        self.assertListEqual(self.api.record_key_value.mock_calls, [
+            call('error', u'xxxxxxx...'), call('error.class', 'django_zipkin.tests.test_middleware.PaymentError'),
+            call('error', 'PaymentError'), call('error.class', 'django_zipkin.tests.test_middleware.PaymentError'),
+            call('error', u'\xe9\ufffd'), call('error.class', 'django_zipkin.tests.test_middleware.PaymentError'),
+        ])
+
+    def test_process_exception_fingerprint(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+
+        def fail(exception_class):
+            try:
+                raise exception_class()
+            except Exception as e:
+                self.middleware.process_exception(self.request_factory.get('/'), e)
+        with patch('django_zipkin.middleware.settings.ZIPKIN_ERROR_FINGERPRINT', True):
+            fail(ValueError)
+            fail(ValueError)
+            fail(PaymentError)
+        fingerprints = [c[1][1] for c in self.api.record_key_value.mock_calls if c[1][0] == 'error.fingerprint']
+        self.assertEqual(len(fingerprints[0]), 16)
+        self.assertEqual(fingerprints[0], fingerprints[1])
+        self.assertNotEqual(fingerprints[0], fingerprints[2])
+
+    def test_process_exception_when_not_tracing(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), sampled=False)
+        request = self.request_factory.get('/')
+        self.middleware.process_exception(request, ValueError())
+        self.assertFalse(self.api.record_key_value.called)
+        self.assertTrue(request._zipkin_error)
+
+    def test_tail_sampling_keeps_errors(self):
+        self.middleware.tail_sampler = TailSampler(keep_errors=True)
+        self.middleware.logger = Mock(spec=logging.Logger)
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), provisional=True)
+        request = self.request_factory.get('/')
+        self.middleware.process_exception(request, ValueError())
+        self.middleware.process_response(request, HttpResponse(status=200))
+        self.api.record_key_value.assert_has_calls([call('zipkin.sampling_reason', 'error')])
+        self.middleware.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
+
+    def test_profilers_run_while_span_is_open(self):
+        profiler, unused_profiler, failing_profiler = [Mock(spec=BaseRequestProfiler) for _ in range(3)]
+        unused_profiler.start.return_value = None
+        failing_profiler.start.side_effect = ValueError
+        self.middleware.profilers = [profiler, unused_profiler, failing_profiler]
+        data = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        self.request_processor.get_zipkin_data.return_value = data
+        request = self.request_factory.get('/')
+        self.middleware.process_request(request)
+        profiler.start.assert_called_once_with(request, data)
+        self.assertFalse(profiler.stop.called)
+        self.store.get.return_value = data
+        self.api.get_elapsed_time.return_value = 1000
+        self.middleware.process_response(request, HttpResponse())
+        profiler.stop.assert_called_once_with(request, data, profiler.start.return_value, 1000)
+        self.assertFalse(unused_profiler.stop.called)
+        self.assertFalse(failing_profiler.stop.called)
+        self.assertNotIn(constants.PROFILERS_KEY, request.META)
+
+    def test_profilers_are_detached_for_streaming_response(self):
+        profiler = Mock(spec=BaseRequestProfiler)
+        self.middleware.profilers = [profiler]
+        data = ZipkinData(trace_id=ZipkinId(42), sampled=True)
+        self.request_processor.get_zipkin_data.return_value = data
+        request = self.request_factory.get('/')
+        self.middleware.process_request(request)
+        self.store.get.return_value = data
+        response = self.middleware.process_response(request, StreamingHttpResponse(['foo']))
+        profiler.detach.assert_called_once_with(request, data, profiler.start.return_value)
+        self.assertFalse(profiler.stop.called)
+        response.close()
+        self.assertEqual(profiler.stop.call_count, 1)
+
+    def test_profilers_skip_requests_not_traced(self):
+        profiler = Mock(spec=BaseRequestProfiler)
+        self.middleware.profilers = [profiler]
+        self.request_processor.get_zipkin_data.return_value = ZipkinData(sampled=False)
+        self.middleware.process_request(self.request_factory.get('/'))
+        self.assertFalse(profiler.start.called)
+
     def test_process_response_without_process_request(self):
         # This happens when a middleware before us returns a response in process_request
         self.store.get.return_value = ZipkinData()
-        request = Mock()
+        request = self.request_factory.get('/')
         self.middleware.process_request = Mock()
         self.middleware.process_response(request, HttpResponse())
         self.middleware.process_request.assert_called_once_with(request)
         self.middleware.api.record_event(constants.ANNOTATION_NO_DATA_IN_LOCAL_STORE)
 
 
+class ZipkinCallableMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.store = Mock(spec=BaseDataStore)
+        self.request_processor = Mock(spec=ZipkinDjangoRequestParser)
+        self.request_processor.get_request_start.return_value = None
+        self.request_processor.get_zipkin_data.return_value = ZipkinData(sampled=True)
+        self.api = Mock(spec=ZipkinApi)
+        self.get_response = Mock()
+        self.middleware = ZipkinCallableMiddleware(
+            self.get_response, store=self.store, request_parser=self.request_processor,
+            id_generator=Mock(spec=BaseIdGenerator), api=self.api, sampler=Mock(spec=BaseSampler)
+        )
+        self.middleware.logger = Mock(spec=logging.Logger)
+        self.request = RequestFactory().get('/')
+
+    def test_span_covers_the_rest_of_the_chain(self):
+        def get_response(request):
+            self.assertListEqual(self.api.record_event.mock_calls, [call('sr')])
+            return HttpResponse(status=201)
+        self.get_response.side_effect = get_response
+        self.assertEqual(self.middleware(self.request).status_code, 201)
+        self.api.record_event.assert_has_calls([call('sr'), call('ss', self.api.get_elapsed_time.return_value)])
+        self.api.record_key_value.assert_has_calls([call('http.statuscode', 201)])
+        self.middleware.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
+
+    def test_span_is_finished_on_exception(self):
+        self.get_response.side_effect = ValueError
+        self.assertRaises(ValueError, self.middleware, self.request)
+        self.api.record_key_value.assert_has_calls([call('http.statuscode', 500)])
+        self.middleware.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
+
+    def test_untraced_requests(self):
+        self.middleware.url_policies = UrlPolicyTable([{'path': '^/', 'trace': 'never'}])
+        self.assertEqual(self.middleware(self.request), self.get_response.return_value)
+        self.assertFalse(self.api.record_event.called)
+        self.assertFalse(self.middleware.logger.info.called)
+
+    def test_failing_to_start_span_doesnt_fail_request(self):
+        self.request_processor.get_zipkin_data.side_effect = Exception
+        self.assertEqual(self.middleware(self.request), self.get_response.return_value)
+
+
 class ZipkinDjangoRequestProcessorTestCase(DjangoZipkinTestHelpers, TestCase):
     def setUp(self):
         self.request_factory = RequestFactory()
@@ -167,5 +566,24 @@ class ZipkinDjangoRequestProcessorTestCase(DjangoZipkinTestHelpers, TestCase):
     def test_no_fields_filled(self):
         self.assertZipkinDataEquals(
             self.processor.get_zipkin_data(self.request_factory.get('/')),
-            ZipkinData()
+            ZipkinData(sampled=None)
         )
+
+    def test_sampled_header(self):
+        for value, expected in [('true', True), ('false', False), ('1', False)]:
+            request = self.request_factory.get('/', **{ZipkinDjangoRequestParser.sampled_hdr_name: value})
+            self.assertEqual(self.processor.get_zipkin_data(request).sampled, expected)
+
+    def test_request_start(self):
+        parser = ZipkinDjangoRequestParser()
+        parser.request_start_hdr_names = ['HTTP_X_REQUEST_START', 'HTTP_X_QUEUE_START']
+        cases = [
+            ({'HTTP_X_REQUEST_START': 't=1400000000.123'}, 1400000000123000),
+            ({'HTTP_X_REQUEST_START': '1400000000123'}, 1400000000123000),
+            ({'HTTP_X_REQUEST_START': 't=1400000000123456'}, 1400000000123456),
+            ({'HTTP_X_REQUEST_START': 'garbage', 'HTTP_X_QUEUE_START': '1400000000'}, 1400000000000000),
+            ({'HTTP_X_REQUEST_START': 't=0'}, None),
+            ({}, None),
+        ]
+        for meta, request_start in cases:
+            self.assertEqual(parser.get_request_start(Mock(META=meta)), request_start)
@@ -0,0 +1,73 @@
+from unittest2 import TestCase
+from mock import Mock, patch
+
+from django.core.handlers.base import BaseHandler
+from django.test.utils import override_settings
+
+from django_zipkin.api import ZipkinApi
+from django_zipkin.data_store import BaseDataStore
+from django_zipkin.middleware import ZipkinMiddleware
+from django_zipkin.middleware_timing import MiddlewareHookTimer, wrap_middleware_hooks, install
+from django_zipkin.zipkin_data import ZipkinData
+
+
+__all__ = ['MiddlewareHookTimerTestCase', 'InstallTestCase']
+
+
+class SlowMiddleware(object):
+    def process_request(self, request):
+        return 'response'
+
+
+class MiddlewareHookTimerTestCase(TestCase):
+    def setUp(self):
+        self.api = Mock(spec=ZipkinApi)
+        self.api.store = Mock(spec=BaseDataStore)
+        self.api.store.get.return_value = ZipkinData(sampled=True)
+        self.api.get_timestamp.side_effect = [1000, 1250]
+        self.timer = MiddlewareHookTimer(SlowMiddleware().process_request, self.api)
+
+    def test_records_duration(self):
+        self.assertEqual(self.timer('request'), 'response')
+        self.api.record_event.assert_called_once_with('django.middleware:SlowMiddleware.process_request', 250, 1000)
+
+    def test_records_duration_on_exception(self):
+        self.timer.hook = Mock(side_effect=ValueError)
+        self.assertRaises(ValueError, self.timer, 'request')
+        self.assertTrue(self.api.record_event.called)
+
+    def test_recording_errors_dont_reach_the_caller(self):
+        self.api.record_event.side_effect = ValueError
+        with patch('django_zipkin.middleware_timing.logging') as mock_logging:
+            self.assertEqual(self.timer('request'), 'response')
+        self.assertTrue(mock_logging.root.exception.called)
+
+    def test_untraced_requests(self):
+        self.api.store.get.return_value = ZipkinData(sampled=False)
+        self.assertEqual(self.timer('request'), 'response')
+        self.assertFalse(self.api.get_timestamp.called)
+        self.assertFalse(self.api.record_event.called)
+
+    def test_wrap_middleware_hooks_skips_zipkin(self):
+        handler = BaseHandler()
+        handler._request_middleware = [ZipkinMiddleware(api=self.api).process_request, SlowMiddleware().process_request]
+        handler._view_middleware = []
+        handler._response_middleware = None
+        wrap_middleware_hooks(handler, self.api)
+        zipkin_hook, timed_hook = handler._request_middleware
+        self.assertNotIsInstance(zipkin_hook, MiddlewareHookTimer)
+        self.assertIsInstance(timed_hook, MiddlewareHookTimer)
+        self.assertListEqual(handler._view_middleware, [])
+        self.assertIsNone(handler._response_middleware)
+
+
+class InstallTestCase(TestCase):
+    @patch.object(BaseHandler, 'load_middleware', BaseHandler.__dict__['load_middleware'])
+    def test_install(self):
+        install()
+        install()
+        handler = BaseHandler()
+        with override_settings(MIDDLEWARE_CLASSES=['django_zipkin.tests.test_middleware_timing.SlowMiddleware']):
+            handler.load_middleware()
+        self.assertEqual(len(handler._request_middleware), 1)
+        self.assertIsInstance(handler._request_middleware[0], MiddlewareHookTimer)
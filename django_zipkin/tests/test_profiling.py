@@ -0,0 +1,157 @@
+import gc
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from unittest2 import TestCase
+from mock import Mock, patch
+
+from django_zipkin.api import ZipkinApi
+from django_zipkin.profiling import StackSampler, CProfileProfiler, AllocationProfiler
+from django_zipkin.zipkin_data import ZipkinData, ZipkinId
+
+
+__all__ = ['StackSamplerTestCase', 'CProfileProfilerTestCase', 'AllocationProfilerTestCase']
+
+
+class StackSamplerTestCase(TestCase):
+    def setUp(self):
+        self.api = Mock(spec=ZipkinApi)
+        self.sampler = StackSampler(self.api, interval=1, threshold=100, max_stacks=2)
+        self.data = ZipkinData(sampled=True)
+
+    def get_recorded_values(self):
+        return dict(c[0] for c in self.api.record_key_value.call_args_list)
+
+    def test_slow_request_records_stacks(self):
+        self.sampler.thread = Mock(spec=threading.Thread)
+        self.sampler.thread.is_alive.return_value = True
+        ident = self.sampler.start(Mock(), self.data)
+        for _ in range(3):
+            self.sampler.sample()
+        self.sampler.stop(Mock(), self.data, ident, 100 * 1000)
+        values = self.get_recorded_values()
+        self.assertEqual(values['profile.samples'], 3)
+        self.assertRegexpMatches(values['profile.stacks'],
+                                 r'^3 sample \(profiling.py:\d+\) < test_slow_request_records_stacks \(test_profiling.py:\d+\)')
+
+    def test_only_most_sampled_stacks_are_recorded(self):
+        self.sampler.thread = Mock(spec=threading.Thread)
+        self.sampler.thread.is_alive.return_value = True
+        ident = self.sampler.start(Mock(), self.data)
+        samples = self.sampler.samples[ident]
+        samples.update({(('a.py', 1, 'a'),): 5, (('b.py', 2, 'b'), ('c.py', 3, 'c')): 7, (('d.py', 4, 'd'),): 1})
+        self.sampler.stop(Mock(), self.data, ident, 100 * 1000)
+        self.assertEqual(self.get_recorded_values()['profile.stacks'], '7 b (b.py:2) < c (c.py:3)\n5 a (a.py:1)')
+
+    def test_fast_request_records_nothing(self):
+        self.sampler.thread = Mock(spec=threading.Thread)
+        self.sampler.thread.is_alive.return_value = True
+        ident = self.sampler.start(Mock(), self.data)
+        self.sampler.sample()
+        self.sampler.stop(Mock(), self.data, ident, 99 * 1000)
+        self.assertFalse(self.api.record_key_value.called)
+        self.assertDictEqual(self.sampler.samples, {})
+
+    def test_background_thread_samples_request_thread(self):
+        ident = self.sampler.start(Mock(), self.data)
+        deadline = time.time() + 5
+        while not self.sampler.samples[ident] and time.time() < deadline:
+            time.sleep(0.001)
+        self.sampler.stop(Mock(), self.data, ident, 100 * 1000)
+        self.assertIn('test_background_thread_samples_request_thread', self.get_recorded_values()['profile.stacks'])
+        self.assertTrue(self.sampler.thread.daemon)
+
+
+def profiled_function():
+    return sum(range(100))
+
+
+class CProfileProfilerTestCase(TestCase):
+    def setUp(self):
+        self.api = Mock(spec=ZipkinApi)
+        self.directory = tempfile.mkdtemp()
+        self.profiler = CProfileProfiler(self.api, os.path.join(self.directory, 'profiles'))
+        self.data = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(7), sampled=True, flags=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_debug_request_is_profiled(self):
+        profile = self.profiler.start(Mock(), self.data)
+        profiled_function()
+        self.profiler.stop(Mock(), self.data, profile, 1000)
+        path = os.path.join(self.directory, 'profiles', '000000000000002a-0000000000000007.prof')
+        self.api.record_key_value.assert_called_once_with('profile.file', path)
+        functions = [name for _, _, name in pstats.Stats(path).stats]
+        self.assertIn('profiled_function', functions)
+
+    def test_streaming_response_is_stopped_from_another_thread(self):
+        profile = self.profiler.start(Mock(), self.data)
+        profiled_function()
+        self.profiler.detach(Mock(), self.data, profile)
+        self.assertIsNone(sys.getprofile())
+        thread = threading.Thread(target=self.profiler.stop, args=(Mock(), self.data, profile, 1000))
+        thread.start()
+        thread.join()
+        path = os.path.join(self.directory, 'profiles', '000000000000002a-0000000000000007.prof')
+        self.assertIn('profiled_function', [name for _, _, name in pstats.Stats(path).stats])
+
+    def test_other_requests_are_not_profiled(self):
+        self.data.flags = False
+        self.assertIsNone(self.profiler.start(Mock(), self.data))
+
+
+class Allocation(object):
+    pass
+
+
+class AllocationProfilerTestCase(TestCase):
+    def setUp(self):
+        self.api = Mock(spec=ZipkinApi)
+        self.data = ZipkinData(sampled=True)
+
+    def get_recorded_values(self):
+        return dict(c[0] for c in self.api.record_key_value.call_args_list)
+
+    def test_only_sampled_and_debug_requests_are_tracked(self):
+        profiler = AllocationProfiler(self.api, max_sites=0, use_tracemalloc=False)
+        self.assertIsNotNone(profiler.start(Mock(), ZipkinData(sampled=True)))
+        self.assertIsNotNone(profiler.start(Mock(), ZipkinData(flags=True)))
+        self.assertIsNone(profiler.start(Mock(), ZipkinData(provisional=True)))
+
+    def test_object_counts_without_tracemalloc(self):
+        profiler = AllocationProfiler(self.api, max_sites=3, use_tracemalloc=False)
+        # Garbage left by earlier tests would be collected meanwhile, lowering the count
+        gc.collect()
+        state = profiler.start(Mock(), self.data)
+        allocations = [Allocation() for _ in range(1000)]
+        profiler.stop(Mock(), self.data, state, 1000)
+        values = self.get_recorded_values()
+        self.assertGreaterEqual(values['memory.objects'], len(allocations))
+        top_types = values['memory.top_types'].split('\n')
+        self.assertLessEqual(len(top_types), 3)
+        self.assertIn('1000 Allocation', top_types)
+
+    def test_tracemalloc(self):
+        with patch('django_zipkin.profiling.tracemalloc', create=True) as mock_tracemalloc:
+            mock_tracemalloc.__file__ = '/usr/lib/python3/tracemalloc.py'
+            mock_tracemalloc.is_tracing.return_value = False
+            mock_tracemalloc.get_traced_memory.side_effect = [(1000, 5000), (3000, 9000)]
+            stats = [Mock(size_diff=size_diff, traceback=[Mock(filename='/app/views.py', lineno=lineno)])
+                     for size_diff, lineno in [(-500, 1), (300, 2), (1200, 3)]]
+            snapshot = mock_tracemalloc.take_snapshot.return_value.filter_traces.return_value
+            snapshot.compare_to.return_value = stats
+            profiler = AllocationProfiler(self.api, max_sites=5, use_tracemalloc=True)
+            state = profiler.start(Mock(), self.data)
+            mock_tracemalloc.start.assert_called_once_with()
+            mock_tracemalloc.reset_peak.assert_called_once_with()
+            profiler.stop(Mock(), self.data, state, 1000)
+        snapshot.compare_to.assert_called_once_with(snapshot, 'lineno')
+        self.assertDictEqual(self.get_recorded_values(), {
+            'memory.allocated': 2000, 'memory.peak': 8000, 'memory.top_sites': '1200 views.py:3\n300 views.py:2'
+        })
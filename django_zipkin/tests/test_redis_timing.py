@@ -0,0 +1,115 @@
+from unittest2 import TestCase, skipUnless
+from mock import Mock, call, patch
+
+from django_zipkin.api import ZipkinApi
+from django_zipkin.data_store import BaseDataStore
+from django_zipkin.redis_timing import RedisCallTimer, instrument_client_class, instrument_pipeline_class, has_redis, \
+    install
+from django_zipkin.zipkin_data import ZipkinData
+
+
+__all__ = ['RedisCallTimerTestCase']
+
+
+class FakeRedis(object):
+    """
+    The parts of redis-py's StrictRedis and BasePipeline the instrumentation relies on
+    """
+    def __init__(self):
+        self.data = {}
+
+    def execute_command(self, *args, **options):
+        if args[0] == 'SET':
+            self.data[args[1]] = args[2]
+            return True
+        return self.data.get(args[1])
+
+    def pipeline(self):
+        return FakePipeline(self)
+
+
+class FakePipeline(object):
+    def __init__(self, client):
+        self.client = client
+        self.command_stack = []
+
+    def execute_command(self, *args, **options):
+        self.command_stack.append((args, options))
+        return self
+
+    def execute(self, raise_on_error=True):
+        stack, self.command_stack = self.command_stack, []
+        return [FakeRedis.execute_command.im_func(self.client, *args, **options) for args, options in stack]
+
+
+class RedisCallTimerTestCase(TestCase):
+    def setUp(self):
+        self.api = Mock(spec=ZipkinApi)
+        self.api.store = Mock(spec=BaseDataStore)
+        self.api.store.get.return_value = ZipkinData(sampled=True)
+        self.timestamps = iter(range(1000, 100000, 100))
+        self.api.get_timestamp.side_effect = lambda: next(self.timestamps)
+        self.timer = RedisCallTimer(self.api)
+        client_class = type('TimedRedis', (FakeRedis,), {})
+        pipeline_class = type('TimedPipeline', (FakePipeline,), {})
+        instrument_client_class(client_class, self.timer)
+        instrument_pipeline_class(pipeline_class, self.timer)
+        self.client = client_class()
+        self.pipeline = pipeline_class(self.client)
+
+    def test_commands_are_aggregated(self):
+        self.assertTrue(self.client.execute_command('SET', 'foo', 'bar'))
+        self.assertEqual(self.client.execute_command('GET', 'foo'), 'bar')
+        self.client.execute_command('get', 'baz')
+        self.assertListEqual(self.api.record_aggregate.mock_calls, [
+            call('redis.SET', 100), call('redis.GET', 100), call('redis.GET', 100)
+        ])
+        self.assertFalse(self.api.record_event.called)
+
+    def test_command_name_with_subcommand(self):
+        self.client.execute_command('CLIENT LIST', 'TYPE')
+        self.api.record_aggregate.assert_called_once_with('redis.CLIENT', 100)
+
+    def test_pipeline_is_recorded_once(self):
+        self.pipeline.execute_command('SET', 'foo', 'bar')
+        self.pipeline.execute_command('GET', 'foo')
+        self.assertEqual(self.pipeline.execute(), [True, 'bar'])
+        self.api.record_event.assert_called_once_with('redis.pipeline', 100, 1000)
+        self.api.record_aggregate.assert_called_once_with('redis.pipeline.commands', count=2)
+
+    def test_failing_command_is_recorded(self):
+        with self.assertRaises(IndexError):
+            self.client.execute_command()
+        self.api.record_aggregate.assert_called_once_with('redis.UNKNOWN', 100)
+
+    def test_recording_errors_dont_reach_the_caller(self):
+        self.api.record_aggregate.side_effect = ValueError
+        self.api.record_event.side_effect = ValueError
+        with patch('django_zipkin.redis_timing.logging') as mock_logging:
+            self.assertTrue(self.client.execute_command('SET', 'foo', 'bar'))
+            self.assertEqual(self.client.execute_command('GET', 'foo'), 'bar')
+            self.pipeline.execute_command('GET', 'foo')
+            self.assertEqual(self.pipeline.execute(), ['bar'])
+            with self.assertRaises(IndexError):
+                self.client.execute_command()
+        self.assertEqual(mock_logging.root.exception.call_count, 4)
+
+    def test_untraced_requests(self):
+        self.api.store.get.return_value = ZipkinData(sampled=False)
+        self.client.execute_command('SET', 'foo', 'bar')
+        self.pipeline.execute_command('GET', 'foo')
+        self.assertEqual(self.pipeline.execute(), ['bar'])
+        self.assertFalse(self.api.record_aggregate.called)
+        self.assertFalse(self.api.record_event.called)
+
+    def test_instrumenting_twice(self):
+        client_class = type(self.client)
+        method = client_class.execute_command
+        instrument_client_class(client_class, self.timer)
+        self.assertEqual(client_class.execute_command, method)
+
+    @skipUnless(has_redis, 'redis is not installed')
+    def test_install(self):
+        import redis
+        install(self.timer)
+        self.assertTrue(redis.StrictRedis.execute_command.zipkin_timed)
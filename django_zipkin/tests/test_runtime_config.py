@@ -0,0 +1,97 @@
+import os
+import json
+import shutil
+import tempfile
+
+from unittest2.case import TestCase
+from mock import patch
+
+from django.core.exceptions import ImproperlyConfigured
+
+from django_zipkin.runtime_config import RuntimeConfig, RuntimeUrlPolicyTable
+from django_zipkin import constants
+
+
+__all__ = ['RuntimeConfigTestCase']
+
+
+class RuntimeConfigTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'zipkin.json')
+        self.monotonic_patcher = patch('django_zipkin.runtime_config.monotonic')
+        self.mock_monotonic = self.monotonic_patcher.start()
+        self.mock_monotonic.return_value = 100.0
+        self.config = RuntimeConfig(self.path, poll_interval=1.0)
+
+    def tearDown(self):
+        self.monotonic_patcher.stop()
+        shutil.rmtree(self.dir)
+
+    def write(self, overrides):
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(overrides, f)
+        os.rename(self.path + '.tmp', self.path)
+
+    def test_defaults_from_settings(self):
+        snapshot = RuntimeConfig().get()
+        self.assertEqual(snapshot.sample_rate, 0.0)
+        self.assertIsNone(snapshot.url_policies.match_path('/'))
+
+    def test_missing_file_uses_settings(self):
+        self.assertEqual(self.config.get().sample_rate, 0.0)
+
+    def test_reads_file(self):
+        self.write({'sample_rate': 0.25, 'url_policies': [{'path': '^/health', 'trace': 'never'}]})
+        snapshot = self.config.get()
+        self.assertEqual(snapshot.sample_rate, 0.25)
+        self.assertEqual(snapshot.url_policies.match_path('/health').trace, constants.TRACE_NEVER)
+
+    def test_polls_at_most_once_per_interval(self):
+        snapshot = self.config.get()
+        self.write({'sample_rate': 0.5})
+        self.mock_monotonic.return_value = 100.5
+        self.assertIs(self.config.get(), snapshot)
+        self.mock_monotonic.return_value = 101.0
+        self.assertEqual(self.config.get().sample_rate, 0.5)
+
+    def test_snapshot_is_only_rebuilt_when_the_file_changes(self):
+        self.write({'sample_rate': 0.5})
+        snapshot = self.config.get()
+        self.mock_monotonic.return_value = 200.0
+        self.assertIs(self.config.get(), snapshot)
+
+    def test_invalid_file_keeps_previous_snapshot(self):
+        self.write({'sample_rate': 0.5})
+        snapshot = self.config.get()
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.mock_monotonic.return_value = 200.0
+        with patch('django_zipkin.runtime_config.logging'):
+            self.assertIs(self.config.get(), snapshot)
+
+    def test_update(self):
+        self.config.update(sample_rate=0.5)
+        self.config.update(url_policies=[{'url_name': 'admin', 'trace': 'always'}])
+        other_process = RuntimeConfig(self.path)
+        self.assertEqual(other_process.get().sample_rate, 0.5)
+        self.assertEqual(other_process.get().url_policies.match_url_name('admin').trace, constants.TRACE_ALWAYS)
+        self.assertEqual(self.config.get().sample_rate, 0.5)
+        self.assertListEqual(os.listdir(self.dir), ['zipkin.json'])
+
+    def test_update_validates_before_writing(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.config.update(url_policies=[{'path': '^/', 'trace': 'sometimes'}])
+        self.assertListEqual(os.listdir(self.dir), [])
+
+    def test_update_without_file(self):
+        with self.assertRaises(ValueError):
+            RuntimeConfig().update(sample_rate=1.0)
+
+    def test_runtime_url_policy_table(self):
+        table = RuntimeUrlPolicyTable(self.config)
+        self.assertIsNone(table.match_path('/health'))
+        self.write({'url_policies': [{'path': '^/health', 'trace': 'never'}, {'url_name': 'admin', 'trace': 'always'}]})
+        self.mock_monotonic.return_value = 200.0
+        self.assertEqual(table.match_path('/health').trace, constants.TRACE_NEVER)
+        self.assertEqual(table.match_url_name('admin').trace, constants.TRACE_ALWAYS)
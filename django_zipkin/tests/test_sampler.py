@@ -0,0 +1,72 @@
+from unittest2.case import TestCase
+from mock import Mock
+
+from django_zipkin.sampler import TailSampler, TraceIdRatioSampler
+from django_zipkin.id_generator import SimpleIdGenerator
+from django_zipkin.zipkin_data import ZipkinId
+from django_zipkin.runtime_config import RuntimeConfigSnapshot
+
+
+__all__ = ['TraceIdRatioSamplerTestCase', 'TailSamplerTestCase']
+
+
+class TraceIdRatioSamplerTestCase(TestCase):
+    def test_extreme_rates(self):
+        ids = [ZipkinId(ZipkinId.MIN_VAL), ZipkinId(-1), ZipkinId(0), ZipkinId(1), ZipkinId(ZipkinId.MAX_VAL)]
+        self.assertTrue(all(TraceIdRatioSampler(1.0).is_sampled(trace_id) for trace_id in ids))
+        self.assertFalse(any(TraceIdRatioSampler(0.0).is_sampled(trace_id) for trace_id in ids))
+
+    def test_decision_depends_only_on_trace_id(self):
+        sampler = TraceIdRatioSampler(0.5)
+        self.assertTrue(sampler.is_sampled(ZipkinId(2 ** 61)))
+        self.assertFalse(sampler.is_sampled(ZipkinId(2 ** 62)))
+        self.assertFalse(sampler.is_sampled(ZipkinId(-(2 ** 62))))
+        self.assertEqual(sampler.is_sampled(ZipkinId(12345)), TraceIdRatioSampler(0.5).is_sampled(ZipkinId(12345)))
+
+    def test_rate(self):
+        generator = SimpleIdGenerator()
+        sampler = TraceIdRatioSampler(0.1)
+        sampled = sum(1 for _ in range(10000) if sampler.is_sampled(generator.generate_trace_id()))
+        self.assertTrue(800 < sampled < 1200, sampled)
+
+    def test_rate_from_runtime_config(self):
+        runtime_config = Mock()
+        runtime_config.get.return_value = RuntimeConfigSnapshot({'sample_rate': 1.0})
+        sampler = TraceIdRatioSampler(runtime_config=runtime_config)
+        self.assertTrue(sampler.is_sampled(ZipkinId(42)))
+        runtime_config.get.return_value = RuntimeConfigSnapshot({'sample_rate': 0.0})
+        self.assertFalse(sampler.is_sampled(ZipkinId(42)))
+
+    def test_default_rate_from_settings(self):
+        self.assertFalse(TraceIdRatioSampler().is_sampled(ZipkinId(42)))
+
+
+class TailSamplerTestCase(TestCase):
+    def setUp(self):
+        self.sampler = TailSampler(latency_threshold=1000, url_name_latency_thresholds={'export': 5000},
+                                   min_status_code=500)
+
+    def test_keeps_slow_requests(self):
+        self.assertEqual(self.sampler.get_reason_to_keep('index', 200, 1000 * 1000), 'latency')
+        self.assertIsNone(self.sampler.get_reason_to_keep('index', 200, 999 * 1000))
+
+    def test_url_name_thresholds(self):
+        self.assertIsNone(self.sampler.get_reason_to_keep('export', 200, 4000 * 1000))
+        self.assertEqual(self.sampler.get_reason_to_keep('export', 200, 5000 * 1000), 'latency')
+
+    def test_keeps_failed_requests(self):
+        self.assertEqual(self.sampler.get_reason_to_keep('index', 503, 0), 'status_code')
+        self.assertIsNone(self.sampler.get_reason_to_keep('index', 404, 0))
+
+    def test_keeps_errors(self):
+        self.assertIsNone(self.sampler.get_reason_to_keep('index', 200, 0, error=True))
+        sampler = TailSampler(keep_errors=True)
+        self.assertEqual(sampler.get_reason_to_keep('index', 200, 0, error=True), 'error')
+        self.assertIsNone(sampler.get_reason_to_keep('index', 200, 0))
+
+    def test_unknown_duration(self):
+        self.assertIsNone(self.sampler.get_reason_to_keep('index', 200, None))
+
+    def test_disabled_rules(self):
+        sampler = TailSampler()
+        self.assertIsNone(sampler.get_reason_to_keep('index', 500, 10 ** 9))
@@ -0,0 +1,60 @@
+from unittest2 import TestCase
+from mock import Mock, patch, call, sentinel
+
+from django.template.base import Template
+from django.template.context import Context
+
+from django_zipkin.api import ZipkinApi
+from django_zipkin.data_store import BaseDataStore
+from django_zipkin.template_timing import TemplateRenderTimer, install
+from django_zipkin.zipkin_data import ZipkinData
+
+
+__all__ = ['TemplateRenderTimerTestCase']
+
+
+class TemplateRenderTimerTestCase(TestCase):
+    def setUp(self):
+        self.api = Mock(spec=ZipkinApi)
+        self.api.store = Mock(spec=BaseDataStore)
+        self.api.store.get.return_value = ZipkinData(sampled=True)
+        self.api.get_timestamp.side_effect = [1000, 1250]
+        self.api.record_aggregate.return_value = 1
+        self.timer = TemplateRenderTimer(self.api, max_renders=1)
+        self.render = Mock(return_value='rendered')
+        self.template = Mock(spec=Template)
+        self.template.name = 'index.html'
+
+    def test_records_render(self):
+        self.assertEqual(self.timer(self.render, self.template, sentinel.context), 'rendered')
+        self.render.assert_called_once_with(self.template, sentinel.context)
+        self.api.record_aggregate.assert_has_calls([call('django.template', 250),
+                                                    call('django.template:index.html', 250)])
+        self.api.record_event.assert_called_once_with('django.template:index.html', 250, 1000)
+
+    def test_only_aggregates_renders_above_limit(self):
+        self.api.record_aggregate.return_value = 2
+        self.timer(self.render, self.template, sentinel.context)
+        self.assertEqual(self.api.record_aggregate.call_count, 2)
+        self.assertFalse(self.api.record_event.called)
+
+    def test_recording_errors_dont_reach_the_caller(self):
+        self.api.record_aggregate.side_effect = ValueError
+        with patch('django_zipkin.template_timing.logging') as mock_logging:
+            self.assertEqual(self.timer(self.render, self.template, sentinel.context), 'rendered')
+        self.assertTrue(mock_logging.root.exception.called)
+
+    def test_untraced_requests(self):
+        self.api.store.get.return_value = ZipkinData(sampled=False)
+        self.timer(self.render, self.template, sentinel.context)
+        self.assertFalse(self.api.record_aggregate.called)
+        self.assertFalse(self.api.record_event.called)
+
+    @patch.object(Template, 'render', Template.__dict__['render'])
+    def test_install(self):
+        timer = Mock(side_effect=lambda render, template, context: render(template, context))
+        install(timer)
+        install(timer)
+        self.assertEqual(Template('{{ x }}').render(Context({'x': 'foo'})), 'foo')
+        self.assertEqual(timer.call_count, 1)
+
@@ -0,0 +1,128 @@
+import functools
+import logging
+import threading
+
+from unittest2 import TestCase, skipUnless
+from mock import Mock, patch
+
+from django_zipkin.api import ZipkinApi
+from django_zipkin.data_store import ThreadLocalDataStore
+from django_zipkin.id_generator import BaseIdGenerator
+from django_zipkin.threads import TraceContext, has_futures
+from django_zipkin.zipkin_data import ZipkinData, ZipkinId
+
+
+__all__ = ['TraceContextTestCase']
+
+
+def run_in_thread(func):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(func()))
+    thread.start()
+    thread.join()
+    return results[0] if results else None
+
+
+class TraceContextTestCase(TestCase):
+    def setUp(self):
+        self.local_patcher = patch.object(ThreadLocalDataStore, 'thread_local_data', threading.local())
+        self.local_patcher.start()
+        self.store = ThreadLocalDataStore()
+        self.store.clear()
+        self.data = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(7), sampled=True)
+        self.store.set(self.data)
+        self.store.set_endpoint(Mock())
+        self.api = Mock(spec=ZipkinApi)
+        self.api.store = self.store
+        self.api.get_timestamp.return_value = 1400000000000000
+        self.api.get_elapsed_time.return_value = 250
+        self.generator = Mock(spec=BaseIdGenerator)
+        self.generator.generate_span_id.return_value = ZipkinId(9)
+        self.context = self.get_context()
+
+    def tearDown(self):
+        self.local_patcher.stop()
+
+    def get_context(self):
+        context = TraceContext(self.store, self.api, self.generator)
+        context.logger = Mock(spec=logging.Logger)
+        return context
+
+    def get_worker_data(self):
+        data = self.store.get()
+        return data.trace_id.get_binary(), data.span_id.get_binary(), data.parent_span_id.get_binary(), data.sampled
+
+    def test_function_runs_in_child_span(self):
+        worker_data, worker_endpoint = run_in_thread(self.context.wrap(lambda: (self.get_worker_data(),
+                                                                                self.store.get_endpoint())))
+        self.assertEqual(worker_data, (42, 9, 7, True))
+        self.assertEqual(worker_endpoint, self.store.get_endpoint())
+        self.api.set_rpc_name.assert_called_once_with('<lambda>')
+        self.api.record_event.assert_any_call('thread.start', timestamp=1400000000000000)
+        self.api.record_event.assert_any_call('thread.finish', 250)
+        self.context.logger.info.assert_called_once_with(self.api.build_log_message.return_value)
+
+    def test_request_thread_keeps_its_span(self):
+        run_in_thread(self.context.wrap(lambda: None))
+        self.assertIs(self.store.get(), self.data)
+
+    def test_store_is_cleared_after_the_function(self):
+        thread_data = []
+
+        def worker():
+            self.context.run('first', lambda: None)
+            thread_data.append(self.store.get())
+        run_in_thread(worker)
+        self.assertIsNone(thread_data[0].trace_id)
+
+    def test_queue_wait(self):
+        self.context.created = 1399999999999000
+        run_in_thread(self.context.wrap(lambda: None))
+        self.api.record_event.assert_any_call('thread.queue.wait', 1000, 1399999999999000)
+
+    def test_error_is_recorded(self):
+        def fail():
+            raise ValueError
+        errors = []
+
+        def worker():
+            try:
+                self.context.run('fail', fail)
+            except ValueError as e:
+                errors.append(e)
+        run_in_thread(worker)
+        self.assertEqual(len(errors), 1)
+        self.api.record_key_value.assert_called_once_with('thread.error', 'ValueError')
+        self.assertTrue(self.context.logger.info.called)
+
+    def test_unsampled_trace_is_propagated_without_logging(self):
+        self.data.sampled = False
+        context = self.get_context()
+        self.assertEqual(run_in_thread(context.wrap(self.get_worker_data)), (42, 9, 7, False))
+        self.assertFalse(context.logger.info.called)
+
+    def test_without_trace(self):
+        self.store.clear()
+        context = self.get_context()
+        self.assertIsNone(run_in_thread(context.wrap(lambda: self.store.get().trace_id)))
+        self.assertFalse(self.api.set_rpc_name.called)
+
+    def test_inline_call_runs_in_current_span(self):
+        self.assertIs(self.context.wrap(self.store.get)(), self.data)
+        self.assertFalse(self.api.set_rpc_name.called)
+
+    def test_wrapping_partial(self):
+        wrapped = self.context.wrap(functools.partial(self.get_worker_data))
+        self.assertEqual(run_in_thread(wrapped), (42, 9, 7, True))
+        self.api.set_rpc_name.assert_called_once_with('<unknown>')
+
+    @skipUnless(has_futures, 'futures is not installed')
+    def test_thread_pool_executor(self):
+        from django_zipkin.threads import ZipkinThreadPoolExecutor
+        with patch('django_zipkin.threads.get_default_data_store', return_value=self.store), \
+                patch('django_zipkin.threads.get_default_api', return_value=self.api), \
+                patch('django_zipkin.threads.get_default_id_generator', return_value=self.generator):
+            with ZipkinThreadPoolExecutor(max_workers=2) as executor:
+                results = list(executor.map(lambda _: self.get_worker_data(), range(3)))
+        self.assertEqual(results, [(42, 9, 7, True)] * 3)
+        self.assertIs(self.store.get(), self.data)
@@ -0,0 +1,205 @@
+import logging
+
+from unittest2 import TestCase
+from mock import Mock, patch
+from thrift.Thrift import TMessageType
+from thrift.protocol.TBinaryProtocol import TBinaryProtocol
+from thrift.transport.TTransport import TTransportBase, TMemoryBuffer, TTransportException
+
+from django_zipkin._thrift.finagle.constants import CAN_TRACE_METHOD_NAME
+from django_zipkin._thrift.finagle.ttypes import RequestHeader, ResponseHeader, ConnectionOptions, UpgradeReply
+from django_zipkin._thrift.scribe import Scribe
+from django_zipkin._thrift.scribe.ttypes import LogEntry, ResultCode
+from django_zipkin.api import ZipkinApi
+from django_zipkin.data_store import BaseDataStore
+from django_zipkin.id_generator import BaseIdGenerator
+from django_zipkin.thrift_client import ZipkinThriftClient
+from django_zipkin.zipkin_data import ZipkinData, ZipkinId
+
+
+__all__ = ['ZipkinThriftClientTestCase']
+
+
+class LoopbackServer(object):
+    """
+    A Scribe server speaking the Finagle TTwitter protocol if upgradable, processing requests in-process
+    """
+    def __init__(self, upgradable):
+        self.upgradable = upgradable
+        self.upgraded = False
+        self.upgrade_requests = 0
+        self.request_headers = []
+        self.handler = Mock(spec=Scribe.Iface)
+        self.handler.Log.return_value = ResultCode.OK
+        self.processor = Scribe.Processor(self.handler)
+
+    def handle(self, request):
+        iprot = TBinaryProtocol(TMemoryBuffer(request))
+        oprot = TBinaryProtocol(TMemoryBuffer())
+        if self.upgraded:
+            header = RequestHeader()
+            header.read(iprot)
+            self.request_headers.append(header)
+            ResponseHeader().write(oprot)
+        elif self.upgradable:
+            name, _, seqid = iprot.readMessageBegin()
+            if name == CAN_TRACE_METHOD_NAME:
+                self.upgrade_requests += 1
+                ConnectionOptions().read(iprot)
+                iprot.readMessageEnd()
+                oprot.writeMessageBegin(name, TMessageType.REPLY, seqid)
+                UpgradeReply().write(oprot)
+                oprot.writeMessageEnd()
+                self.upgraded = True
+                return oprot.trans.getvalue()
+            iprot = TBinaryProtocol(TMemoryBuffer(request))
+        self.processor.process(iprot, oprot)
+        return oprot.trans.getvalue()
+
+
+class LoopbackTransport(TTransportBase):
+    def __init__(self, server):
+        self.server = server
+        self.wbuf = TMemoryBuffer()
+        self.rbuf = TMemoryBuffer()
+
+    def isOpen(self):
+        return True
+
+    def write(self, buf):
+        self.wbuf.write(buf)
+
+    def flush(self):
+        request = self.wbuf.getvalue()
+        self.wbuf = TMemoryBuffer()
+        self.rbuf = TMemoryBuffer(self.server.handle(request))
+
+    def read(self, sz):
+        return self.rbuf.read(sz)
+
+
+class ZipkinThriftClientTestCase(TestCase):
+    def setUp(self):
+        self.store = Mock(spec=BaseDataStore)
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(7), sampled=True)
+        self.api = Mock(spec=ZipkinApi)
+        self.api.get_timestamp.side_effect = [1000, 1250]
+        self.generator = Mock(spec=BaseIdGenerator)
+        self.generator.generate_span_id.return_value = ZipkinId(9)
+        self.generator.generate_trace_id.return_value = ZipkinId(11)
+        self.messages = [LogEntry(category='zipkin', message='span')]
+
+    def get_client(self, server, upgrade=True):
+        client = ZipkinThriftClient(Scribe.Client(TBinaryProtocol(LoopbackTransport(server))), upgrade,
+                                    self.store, self.api, self.generator)
+        client.logger = Mock(spec=logging.Logger)
+        return client
+
+    def test_trace_is_passed_to_upgraded_server(self):
+        server = LoopbackServer(upgradable=True)
+        client = self.get_client(server)
+        self.assertEqual(client.Log(self.messages), ResultCode.OK)
+        server.handler.Log.assert_called_once_with(self.messages)
+        self.assertEqual(server.upgrade_requests, 1)
+        header = server.request_headers[0]
+        self.assertEqual(header.trace_id, 42)
+        self.assertEqual(header.span_id, 9)
+        self.assertEqual(header.parent_span_id, 7)
+        self.assertTrue(header.sampled)
+        self.assertEqual(header.flags, 0)
+
+    def test_client_span_is_logged(self):
+        client = self.get_client(LoopbackServer(upgradable=True))
+        client.Log(self.messages)
+        self.api.build_child_span_log_message.assert_called_once_with(
+            self.generator.generate_span_id.return_value, 'Log', [('cs', 1000, None), ('cr', 1250, 250)], []
+        )
+        client.logger.info.assert_called_once_with(self.api.build_child_span_log_message.return_value)
+
+    def test_connection_is_upgraded_once(self):
+        server = LoopbackServer(upgradable=True)
+        client = self.get_client(server)
+        self.api.get_timestamp.side_effect = None
+        client.Log(self.messages)
+        client.Log(self.messages)
+        self.assertEqual(server.upgrade_requests, 1)
+        self.assertEqual(len(server.request_headers), 2)
+
+    def test_server_without_upgrade(self):
+        server = LoopbackServer(upgradable=False)
+        client = self.get_client(server)
+        self.assertEqual(client.Log(self.messages), ResultCode.OK)
+        server.handler.Log.assert_called_once_with(self.messages)
+        self.assertFalse(client.protocol.upgraded)
+        self.assertTrue(client.logger.info.called)
+
+    def test_failed_upgrade(self):
+        server = LoopbackServer(upgradable=False)
+        handle = server.handle
+        requests = []
+
+        def reset_upgrade_request(request):
+            requests.append(request)
+            if len(requests) == 1:
+                raise TTransportException(message='Connection reset')
+            return handle(request)
+        server.handle = reset_upgrade_request
+        client = self.get_client(server)
+        with patch('django_zipkin.thrift_client.logging') as mock_logging:
+            self.assertEqual(client.Log(self.messages), ResultCode.OK)
+        self.assertTrue(mock_logging.root.exception.called)
+        self.assertFalse(client.protocol.upgraded)
+        server.handler.Log.assert_called_once_with(self.messages)
+        self.assertTrue(client.logger.info.called)
+
+    def test_without_upgrade(self):
+        server = LoopbackServer(upgradable=True)
+        client = self.get_client(server, upgrade=False)
+        client.Log(self.messages)
+        self.assertEqual(server.upgrade_requests, 0)
+        self.assertTrue(client.logger.info.called)
+
+    def test_debug_flag(self):
+        self.store.get.return_value.flags = True
+        server = LoopbackServer(upgradable=True)
+        self.get_client(server).Log(self.messages)
+        self.assertEqual(server.request_headers[0].flags, 1)
+
+    def test_unsampled_call(self):
+        self.store.get.return_value.sampled = False
+        server = LoopbackServer(upgradable=True)
+        client = self.get_client(server)
+        client.Log(self.messages)
+        self.assertFalse(server.request_headers[0].sampled)
+        self.assertFalse(client.logger.info.called)
+
+    def test_provisional_span_is_not_logged(self):
+        self.store.get.return_value = ZipkinData(trace_id=ZipkinId(42), span_id=ZipkinId(7), provisional=True)
+        server = LoopbackServer(upgradable=True)
+        client = self.get_client(server)
+        client.Log(self.messages)
+        self.assertFalse(server.request_headers[0].sampled)
+        self.assertFalse(client.logger.info.called)
+
+    def test_call_outside_of_trace(self):
+        self.store.get.return_value = ZipkinData()
+        server = LoopbackServer(upgradable=True)
+        client = self.get_client(server)
+        client.Log(self.messages)
+        header = server.request_headers[0]
+        self.assertEqual(header.trace_id, 11)
+        self.assertIsNone(header.sampled)
+        self.assertFalse(client.logger.info.called)
+
+    def test_failed_call_is_recorded(self):
+        server = LoopbackServer(upgradable=True)
+        server.handler.Log.side_effect = ValueError
+        client = self.get_client(server)
+        with self.assertRaises(ValueError):
+            client.Log(self.messages)
+        self.assertEqual(self.api.build_child_span_log_message.call_args[0][3], [('thrift.error', 'ValueError')])
+        self.assertTrue(client.logger.info.called)
+
+    def test_non_rpc_attributes_are_not_wrapped(self):
+        client = self.get_client(LoopbackServer(upgradable=True))
+        self.assertIs(client.send_Log.__self__, client.client)
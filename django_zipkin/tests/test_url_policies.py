@@ -0,0 +1,77 @@
+from unittest2.case import TestCase
+
+from django.core.exceptions import ImproperlyConfigured
+
+from django_zipkin.url_policies import UrlPolicyTable
+from django_zipkin import constants
+
+
+__all__ = ['UrlPolicyTableTestCase']
+
+
+class UrlPolicyTableTestCase(TestCase):
+    def test_empty_table_matches_nothing(self):
+        table = UrlPolicyTable()
+        self.assertIsNone(table.match_path('/'))
+        self.assertIsNone(table.match_url_name('index'))
+
+    def test_match_path(self):
+        table = UrlPolicyTable([
+            {'path': r'^/health/?$', 'trace': 'never'},
+            {'path': r'^/admin/(?P<page>\w+)/', 'trace': 'always'},
+            {'path': r'^/api/(v1|v2)/', 'view_kwargs': False},
+        ])
+        self.assertEqual(table.match_path('/health').trace, constants.TRACE_NEVER)
+        self.assertEqual(table.match_path('/admin/users/').trace, constants.TRACE_ALWAYS)
+        policy = table.match_path('/api/v2/users')
+        self.assertIsNone(policy.trace)
+        self.assertTrue(policy.record_view_args)
+        self.assertFalse(policy.record_view_kwargs)
+        self.assertIsNone(table.match_path('/healthy'))
+
+    def test_first_matching_policy_wins(self):
+        table = UrlPolicyTable([
+            {'path': r'^/static/', 'trace': 'never'},
+            {'path': r'^/', 'trace': 'always'},
+            {'url_name': 'index', 'trace': 'never'},
+            {'url_name': 'index', 'trace': 'always'},
+        ])
+        self.assertEqual(table.match_path('/static/app.js').trace, constants.TRACE_NEVER)
+        self.assertEqual(table.match_path('/foo').trace, constants.TRACE_ALWAYS)
+        self.assertEqual(table.match_url_name('index').trace, constants.TRACE_NEVER)
+
+    def test_many_path_patterns(self):
+        table = UrlPolicyTable([{'path': r'^/(a)(b)?/%d/$' % i, 'trace': 'never'} for i in range(250)] +
+                               [{'path': r'^/last/$', 'trace': 'always'}])
+        self.assertEqual(len(table.path_regexes), 8)
+        self.assertIs(table.match_path('/a/199/'), table.path_policies[199])
+        self.assertEqual(table.match_path('/last/').trace, constants.TRACE_ALWAYS)
+
+    def test_match_url_name(self):
+        table = UrlPolicyTable([{'url_name': 'healthcheck', 'trace': 'never'}])
+        self.assertEqual(table.match_url_name('healthcheck').trace, constants.TRACE_NEVER)
+        self.assertIsNone(table.match_url_name('index'))
+
+    def test_invalid_policies(self):
+        with self.assertRaises(ImproperlyConfigured):
+            UrlPolicyTable([{'path': '^/', 'trace': 'sometimes'}])
+        with self.assertRaises(ImproperlyConfigured):
+            UrlPolicyTable([{'trace': 'never'}])
+        with self.assertRaises(ImproperlyConfigured):
+            UrlPolicyTable(['x'])
+        with self.assertRaises(ImproperlyConfigured):
+            UrlPolicyTable([{'path': '^/('}])
+        with self.assertRaises(ImproperlyConfigured):
+            UrlPolicyTable([{'path': '^/(?P<id>a)'}, {'path': '^/(?P<id>b)'}])
+        for path in [r'^/(\d)\1/', r'^/(a|(b))(?(2)c|d)', r'^/x+((\d)[a-z]\2)?$', r'^/(?P<x>\d)(\d)\2']:
+            with self.assertRaises(ImproperlyConfigured, msg=path):
+                UrlPolicyTable([{'path': path}])
+
+    def test_named_group_references(self):
+        table = UrlPolicyTable([{'path': r'^/foo/', 'trace': 'never'},
+                                {'path': r'^/(?P<digit>\d)(?P=digit)/', 'trace': 'always'},
+                                {'path': r'^/(?P<a>a)?(?(a)b|c)/', 'view_args': False}])
+        self.assertEqual(table.match_path('/11/').trace, 'always')
+        self.assertIsNone(table.match_path('/12/'))
+        self.assertFalse(table.match_path('/ab/').record_view_args)
+        self.assertFalse(table.match_path('/c/').record_view_args)
@@ -0,0 +1,62 @@
+import os
+import json
+import shutil
+import tempfile
+
+from unittest2.case import TestCase
+from mock import Mock, patch
+
+from django.test import RequestFactory
+
+from django_zipkin.runtime_config import RuntimeConfig
+from django_zipkin.views import runtime_config
+
+
+__all__ = ['RuntimeConfigViewTestCase']
+
+
+class RuntimeConfigViewTestCase(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.config = RuntimeConfig(os.path.join(self.dir, 'zipkin.json'))
+        self.config_patcher = patch('django_zipkin.views.default_runtime_config', self.config)
+        self.config_patcher.start()
+        self.request_factory = RequestFactory()
+
+    def tearDown(self):
+        self.config_patcher.stop()
+        shutil.rmtree(self.dir)
+
+    def request(self, method='get', data=None, is_staff=True):
+        if method == 'post':
+            request = self.request_factory.post('/', data=data, content_type='application/json')
+        else:
+            request = self.request_factory.get('/')
+        request.user = Mock(is_active=True, is_staff=is_staff)
+        return runtime_config(request)
+
+    def test_get(self):
+        response = self.request()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'sample_rate': 0.0, 'url_policies': []})
+
+    def test_post(self):
+        policies = [{'path': '^/health', 'trace': 'never'}]
+        response = self.request('post', json.dumps({'sample_rate': 0.5, 'url_policies': policies}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {'sample_rate': 0.5, 'url_policies': policies})
+        self.assertEqual(RuntimeConfig(self.config.path).get().sample_rate, 0.5)
+
+    def test_post_invalid(self):
+        for body in ['{not json', '[]', '{"sample_rate": "lots"}', '{"foo": 1}',
+                     '{"url_policies": [{"path": "^/", "trace": "sometimes"}]}', '{"url_policies": [{"path": "^/(", "trace": "never"}]}',
+                     '{"url_policies": ["x"]}', '{"url_policies": {"path": "^/"}}', '{"url_policies": [{"path": 5}]}']:
+            self.assertEqual(self.request('post', body).status_code, 400, body)
+        self.assertListEqual(os.listdir(self.dir), [])
+
+    def test_requires_staff(self):
+        with patch('django.contrib.auth.decorators.resolve_url', return_value='/login/'), \
+                patch('django.contrib.auth.views.redirect_to_login') as mock_redirect_to_login:
+            self.assertEqual(self.request('post', '{"sample_rate": 1.0}', is_staff=False),
+                             mock_redirect_to_login.return_value)
+        self.assertListEqual(os.listdir(self.dir), [])
@@ -0,0 +1,94 @@
+import io
+from wsgiref.util import FileWrapper
+
+from unittest2 import TestCase
+from mock import Mock, ANY, sentinel
+
+from django.test import RequestFactory
+
+from django_zipkin.middleware import ZipkinMiddleware
+from django_zipkin.wsgi import ZipkinWsgiMiddleware
+from django_zipkin.zipkin_data import ZipkinData
+from django_zipkin import constants
+
+
+__all__ = ['ZipkinWsgiMiddlewareTestCase']
+
+
+class ZipkinWsgiMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.middleware = Mock(spec=ZipkinMiddleware)
+        self.data = ZipkinData(sampled=True)
+
+        def start_span(request):
+            request._zipkin_url_policy = None
+            return self.data
+        self.middleware.start_span.side_effect = start_span
+        self.response = Mock()
+        self.application = Mock(return_value=self.response)
+        self.wsgi_middleware = ZipkinWsgiMiddleware(self.application, self.middleware)
+        self.environ = RequestFactory().get('/').environ
+        self.start_response = Mock()
+
+    def call_application(self, status='200 OK'):
+        def application(environ, start_response):
+            start_response(status, [])
+            return self.response
+        self.application.side_effect = application
+        return self.wsgi_middleware(self.environ, self.start_response)
+
+    def test_span_is_finished_when_response_is_closed(self):
+        result = self.call_application('404 NOT FOUND')
+        self.start_response.assert_called_once_with('404 NOT FOUND', [], None)
+        self.assertFalse(self.middleware.finish_span.called)
+        result.close()
+        self.response.close.assert_called_once_with()
+        self.assertEqual(self.middleware.finish_span.call_args[0][1:], (404, self.data))
+
+    def test_file_wrapper_is_passed_through(self):
+        filelike = io.BytesIO('foo')
+        self.environ['wsgi.file_wrapper'] = FileWrapper
+        self.response = FileWrapper(filelike)
+        response = self.call_application()
+        self.assertIs(response, self.response)
+        self.assertFalse(self.middleware.finish_span.called)
+        response.close()
+        self.assertTrue(filelike.closed)
+        self.assertEqual(self.middleware.finish_span.call_args[0][1:], (200, self.data))
+
+    def test_profilers_are_detached_in_serving_thread(self):
+        result = self.call_application()
+        self.middleware.detach_profilers.assert_called_once_with(ANY, self.data)
+        self.assertFalse(self.middleware.finish_span.called)
+        result.close()
+
+    def test_passes_response_through(self):
+        self.response = ['foo', 'bar']
+        self.assertListEqual(list(self.call_application()), ['foo', 'bar'])
+
+    def test_span_is_finished_on_exception(self):
+        self.application.side_effect = ValueError
+        self.assertRaises(ValueError, self.wsgi_middleware, self.environ, self.start_response)
+        self.assertEqual(self.middleware.finish_span.call_args[0][1:], (500, self.data))
+
+    def test_finishes_span_with_django_request(self):
+        self.environ[constants.WSGI_REQUEST_KEY] = sentinel.django_request
+        self.call_application().close()
+        self.assertEqual(self.middleware.finish_span.call_args[0][0], sentinel.django_request)
+
+    def test_untraced_requests(self):
+        self.middleware.start_span.side_effect = None
+        self.middleware.start_span.return_value = None
+        self.assertEqual(self.wsgi_middleware(self.environ, self.start_response), self.response)
+        self.assertNotIn(constants.WSGI_URL_POLICY_KEY, self.environ)
+
+    def test_django_middleware_joins_span(self):
+        self.call_application()
+        django_middleware = ZipkinMiddleware(store=Mock(), api=Mock())
+        request = RequestFactory().get('/')
+        request.META = self.environ
+        django_middleware.process_request(request)
+        django_middleware.process_response(request, Mock())
+        self.assertFalse(django_middleware.store.clear.called)
+        self.assertFalse(django_middleware.api.record_event.called)
+        self.assertIs(self.environ[constants.WSGI_REQUEST_KEY], request)
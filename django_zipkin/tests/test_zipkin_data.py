@@ -1,8 +1,8 @@
 from unittest2.case import TestCase
-from django_zipkin.zipkin_data import ZipkinId
+from django_zipkin.zipkin_data import ZipkinId, ZipkinData
 
 
-__all__ = ['ZipkinIdTestCase']
+__all__ = ['ZipkinIdTestCase', 'ZipkinDataTestCase']
 
 
 class ZipkinIdTestCase(TestCase):
@@ -37,3 +37,17 @@ class ZipkinIdTestCase(TestCase):
         self.assertIsNone(ZipkinId.from_hex(None))
         self.assertIsNone(ZipkinId.from_binary(None))
 
+
+
+class ZipkinDataTestCase(TestCase):
+    def test_is_tracing(self):
+        self.assertFalse(ZipkinData().is_tracing())
+        self.assertTrue(ZipkinData(sampled=True).is_tracing())
+        self.assertTrue(ZipkinData(flags=True).is_tracing())
+        self.assertTrue(ZipkinData(provisional=True).is_tracing())
+
+    def test_is_provisional(self):
+        self.assertFalse(ZipkinData().is_provisional())
+        self.assertTrue(ZipkinData(provisional=True).is_provisional())
+        self.assertFalse(ZipkinData(provisional=True, sampled=True).is_provisional())
+        self.assertFalse(ZipkinData(provisional=True, flags=True).is_provisional())
@@ -0,0 +1,119 @@
+import functools
+import logging
+import time
+
+from django.utils.decorators import available_attrs
+
+from zipkin_data import ZipkinData
+from data_store import get_default as get_default_data_store
+from id_generator import get_default as get_default_id_generator
+from api import get_default as get_default_api
+import constants
+import defaults as settings
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    has_futures = True
+except ImportError:
+    has_futures = False
+
+
+class TraceContext(object):
+    """
+    The trace of the current thread at the time of creation, to continue it in other threads
+
+    Functions run in the context get a span of their own, a child of the span current at creation, which is named
+    after the function and has "thread.start" and "thread.finish" annotations; the latter carries the duration.
+    "thread.queue.wait" is the time between creating the context and starting the function. Everything recorded by
+    the function through the api goes to its span, and downstream requests made by it carry its trace.
+    """
+    def __init__(self, store=None, api=None, id_generator=None):
+        self.store = store or get_default_data_store()
+        self.api = api or get_default_api()
+        self.id_generator = id_generator or get_default_id_generator()
+        self.logger = logging.getLogger(settings.ZIPKIN_LOGGER_NAME)
+        self.data = self.store.get()
+        self.endpoint = self.store.get_endpoint()
+        self.created = int(time.time() * 1000 * 1000)
+
+    def run(self, name, func, *args, **kwargs):
+        # Without a trace to continue, or in a thread already having one (like running inline in the thread of the
+        # request), the function simply runs as part of the current span
+        if self.data.trace_id is None or self.store.get().trace_id is not None:
+            return func(*args, **kwargs)
+        try:
+            self._start_span(name)
+        except Exception:
+            logging.root.exception('TraceContext failed to start the span of %s' % name)
+            return func(*args, **kwargs)
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        finally:
+            self._finish_span(name)
+
+    def wrap(self, func, name=None):
+        """
+        Return a function calling func in this context
+        """
+        name = name or getattr(func, '__name__', constants.UNKNOWN_THREAD_TASK_NAME)
+
+        @functools.wraps(func, assigned=available_attrs(func))
+        def run_in_context(*args, **kwargs):
+            return self.run(name, func, *args, **kwargs)
+        return run_in_context
+
+    def _start_span(self, name):
+        self.store.clear()
+        self.store.set(ZipkinData(
+            trace_id=self.data.trace_id,
+            span_id=self.id_generator.generate_span_id(),
+            parent_span_id=self.data.span_id,
+            sampled=self.data.sampled,
+            flags=self.data.flags
+        ))
+        self.store.set_endpoint(self.endpoint)
+        self.api.set_rpc_name(name)
+        start = self.api.get_timestamp()
+        self.api.record_event(constants.ANNOTATION_THREAD_QUEUE_WAIT, max(start - self.created, 0), self.created)
+        self.api.record_event(constants.ANNOTATION_THREAD_START, timestamp=start)
+
+    def _record_error(self, error):
+        try:
+            self.api.record_key_value(constants.ANNOTATION_THREAD_ERROR, error.__class__.__name__)
+        except Exception:
+            logging.root.exception('TraceContext failed to record an error')
+
+    def _finish_span(self, name):
+        try:
+            self.api.record_event(constants.ANNOTATION_THREAD_FINISH, self.api.get_elapsed_time())
+            if self.store.get().is_tracing():
+                self.logger.info(self.api.build_log_message())
+        except Exception:
+            logging.root.exception('TraceContext failed to record the span of %s' % name)
+        finally:
+            # Pool threads run unrelated functions next, they must not find the trace in the store
+            self.store.clear()
+
+
+def propagate_trace(func, name=None):
+    """
+    Bind func to the trace of the current thread, to be run in another one
+
+    Use it where the function is handed over to the other thread, like threading.Thread(target=propagate_trace(f)),
+    the trace is captured when propagate_trace is called.
+    """
+    return TraceContext().wrap(func, name)
+
+
+if has_futures:
+    class ZipkinThreadPoolExecutor(ThreadPoolExecutor):
+        """
+        A ThreadPoolExecutor running the submitted functions in the trace of the thread submitting them
+
+        Each call gets a span of its own, see TraceContext.
+        """
+        def submit(self, fn, *args, **kwargs):
+            return super(ZipkinThreadPoolExecutor, self).submit(TraceContext().wrap(fn), *args, **kwargs)
@@ -0,0 +1,143 @@
+import logging
+import threading
+
+from thrift.Thrift import TMessageType, TApplicationException
+
+from django_zipkin._thrift.zipkinCore.constants import CLIENT_SEND, CLIENT_RECV
+from django_zipkin._thrift.finagle.constants import CAN_TRACE_METHOD_NAME
+from django_zipkin._thrift.finagle.ttypes import RequestHeader, ResponseHeader, ClientId, ConnectionOptions, \
+    UpgradeReply
+from data_store import get_default as get_default_data_store
+from id_generator import get_default as get_default_id_generator
+from api import get_default as get_default_api
+import constants
+import defaults as settings
+
+
+class FinagleProtocol(object):
+    """
+    Wraps a Thrift protocol to send the RequestHeader of the Finagle TTwitter protocol before each request message,
+    and to read the ResponseHeader before each response, once the connection is upgraded
+    """
+    def __init__(self, protocol):
+        self.protocol = protocol
+        self.upgraded = False
+        self.request_header = None
+
+    def writeMessageBegin(self, name, type, seqid):
+        if self.upgraded:
+            self.request_header.write(self.protocol)
+        self.protocol.writeMessageBegin(name, type, seqid)
+
+    def readMessageBegin(self):
+        if self.upgraded:
+            ResponseHeader().read(self.protocol)
+        return self.protocol.readMessageBegin()
+
+    def __getattr__(self, name):
+        return getattr(self.protocol, name)
+
+
+class ZipkinThriftClient(object):
+    """
+    Wraps a generated Thrift client to record a client span for each RPC and pass the trace on to the server
+
+    The span is named after the method, and has cs and cr annotations; cr carries the duration. The trace context
+    is sent the way Finagle does: on the first call the client asks the server to upgrade the connection to the
+    TTwitter protocol, and if it agrees, each request is preceded by a RequestHeader. Servers that don't support it
+    see plain Thrift, and still the client span is recorded.
+
+    Only use the wrapper for calls, the client (and its protocols) must not be used directly afterwards.
+    """
+    def __init__(self, client, upgrade=True, store=None, api=None, id_generator=None):
+        self.client = client
+        self.store = store or get_default_data_store()
+        self.api = api or get_default_api()
+        self.id_generator = id_generator or get_default_id_generator()
+        self.logger = logging.getLogger(settings.ZIPKIN_LOGGER_NAME)
+        self.upgrade = upgrade
+        self.upgrade_lock = threading.Lock()
+        self.upgrade_attempted = False
+        self.iprot = client._iprot
+        self.oprot = client._oprot
+        self.protocol = client._oprot = FinagleProtocol(client._oprot)
+        if client._iprot is self.oprot:
+            client._iprot = self.protocol
+        else:
+            client._iprot = FinagleProtocol(client._iprot)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if name.startswith(('_', 'send_', 'recv_')) or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return self._call(name, attribute, args, kwargs)
+        call.__name__ = name
+        return call
+
+    def _call(self, name, method, args, kwargs):
+        if self.upgrade and not self.upgrade_attempted:
+            self._upgrade()
+        data = self.store.get()
+        if data.trace_id is None:
+            if self.protocol.upgraded:
+                # The header is required once upgraded, without a sampling decision the server makes its own
+                trace_id = self.id_generator.generate_trace_id().get_binary()
+                self._set_request_header(RequestHeader(trace_id=trace_id, span_id=trace_id, contexts=[]))
+            return method(*args, **kwargs)
+        span_id = self.id_generator.generate_span_id()
+        # Provisional spans of tail sampling may be dropped, the child span would be left without its parent
+        sampled = bool(data.sampled or data.flags)
+        self._set_request_header(RequestHeader(
+            trace_id=data.trace_id.get_binary(),
+            span_id=span_id.get_binary(),
+            parent_span_id=data.span_id.get_binary() if data.span_id is not None else None,
+            sampled=sampled,
+            client_id=ClientId(name=settings.ZIPKIN_SERVICE_NAME) if settings.ZIPKIN_SERVICE_NAME else None,
+            flags=constants.FINAGLE_DEBUG_FLAG if data.flags else 0,
+            contexts=[]
+        ))
+        if not sampled:
+            return method(*args, **kwargs)
+        key_values = []
+        start = self.api.get_timestamp()
+        try:
+            return method(*args, **kwargs)
+        except Exception as e:
+            key_values.append((constants.ANNOTATION_THRIFT_ERROR, e.__class__.__name__))
+            raise
+        finally:
+            end = self.api.get_timestamp()
+            try:
+                self.logger.info(self.api.build_child_span_log_message(
+                    span_id, name, [(CLIENT_SEND, start, None), (CLIENT_RECV, end, end - start)], key_values
+                ))
+            except Exception:
+                logging.root.exception('ZipkinThriftClient failed to record span of %s' % name)
+
+    def _set_request_header(self, request_header):
+        self.protocol.request_header = request_header
+
+    def _upgrade(self):
+        with self.upgrade_lock:
+            if self.upgrade_attempted:
+                return
+            self.upgrade_attempted = True
+            try:
+                self.oprot.writeMessageBegin(CAN_TRACE_METHOD_NAME, TMessageType.CALL, 0)
+                ConnectionOptions().write(self.oprot)
+                self.oprot.writeMessageEnd()
+                self.oprot.trans.flush()
+                _, message_type, _ = self.iprot.readMessageBegin()
+                reply = TApplicationException() if message_type == TMessageType.EXCEPTION else UpgradeReply()
+                reply.read(self.iprot)
+                self.iprot.readMessageEnd()
+                upgraded = message_type != TMessageType.EXCEPTION
+            except Exception:
+                # Calls go on in plain Thrift, a failed negotiation mustn't fail them
+                logging.root.exception('ZipkinThriftClient failed to upgrade the connection')
+                upgraded = False
+            self.protocol.upgraded = upgraded
+            if isinstance(self.client._iprot, FinagleProtocol):
+                self.client._iprot.upgraded = upgraded
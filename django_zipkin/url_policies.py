@@ -0,0 +1,110 @@
+import re
+import sre_parse
+import sre_constants
+
+from django.core.exceptions import ImproperlyConfigured
+
+import constants
+
+
+class UrlPolicy(object):
+    """
+    How requests to a URL are traced
+
+    trace is constants.TRACE_ALWAYS, constants.TRACE_NEVER or None to leave the decision to the caller
+    """
+    def __init__(self, trace=None, record_view_args=True, record_view_kwargs=True):
+        if trace not in (None, constants.TRACE_ALWAYS, constants.TRACE_NEVER):
+            raise ImproperlyConfigured("Invalid ZIPKIN_URL_POLICIES trace value %r" % trace)
+        self.trace = trace
+        self.record_view_args = record_view_args
+        self.record_view_kwargs = record_view_kwargs
+
+
+class UrlPolicyTable(object):
+    """
+    Looks up the UrlPolicy of a request by its path or URL name
+
+    Policies are given as a list of dicts like the ZIPKIN_URL_POLICIES setting. Path patterns are combined into
+    as few regular expressions as the re module allows, so a lookup is a single match in the common case. The
+    first matching policy wins.
+    """
+    def __init__(self, policies=()):
+        self.url_name_policies = {}
+        self.path_policies = []
+        self.path_regexes = []
+        patterns = []
+        for spec in policies:
+            if not isinstance(spec, dict):
+                raise ImproperlyConfigured("ZIPKIN_URL_POLICIES entries must be dicts: %r" % (spec,))
+            policy = UrlPolicy(
+                trace=spec.get('trace'),
+                record_view_args=spec.get('view_args', True),
+                record_view_kwargs=spec.get('view_kwargs', True)
+            )
+            if spec.get('url_name') is None and spec.get('path') is None:
+                raise ImproperlyConfigured("ZIPKIN_URL_POLICIES entries need a 'path' or a 'url_name': %r" % (spec,))
+            if spec.get('url_name') is not None:
+                self.url_name_policies.setdefault(spec['url_name'], policy)
+            if spec.get('path') is not None:
+                try:
+                    re.compile(spec['path'])
+                except (re.error, TypeError) as e:
+                    raise ImproperlyConfigured("Invalid ZIPKIN_URL_POLICIES path %r: %s" % (spec['path'], e))
+                if self._has_numbered_group_reference(spec['path']):
+                    raise ImproperlyConfigured("ZIPKIN_URL_POLICIES paths can't refer to groups by number, as "
+                                               "they are renumbered when combined: %r" % (spec['path'],))
+                patterns.append(spec['path'])
+                self.path_policies.append(policy)
+        batch, groups = [], 0
+        for index, pattern in enumerate(patterns):
+            pattern_groups = re.compile(pattern).groups + 1
+            if batch and groups + pattern_groups > constants.MAX_REGEX_GROUPS:
+                self.path_regexes.append(self._combine(batch))
+                batch, groups = [], 0
+            batch.append((index, pattern))
+            groups += pattern_groups
+        if batch:
+            self.path_regexes.append(self._combine(batch))
+
+    @staticmethod
+    def _has_numbered_group_reference(pattern):
+        # References to named groups are resolved by name, which combining leaves alone
+        parsed = sre_parse.parse(pattern)
+        named_groups = set(parsed.pattern.groupdict.values())
+        subpatterns = [parsed]
+        while subpatterns:
+            for op, av in subpatterns.pop():
+                if op == sre_constants.GROUPREF and av not in named_groups:
+                    return True
+                if op == sre_constants.GROUPREF_EXISTS and av[0] not in named_groups:
+                    return True
+                subpatterns.extend(UrlPolicyTable._get_subpatterns(av))
+        return False
+
+    @staticmethod
+    def _get_subpatterns(av):
+        if isinstance(av, sre_parse.SubPattern):
+            return [av]
+        if isinstance(av, (tuple, list)):
+            return [subpattern for item in av for subpattern in UrlPolicyTable._get_subpatterns(item)]
+        return []
+
+    @staticmethod
+    def _combine(patterns):
+        try:
+            return re.compile('|'.join('(?P<_zipkin_%d>%s)' % (index, pattern) for index, pattern in patterns))
+        except re.error as e:
+            # Like group names used in several patterns
+            raise ImproperlyConfigured("ZIPKIN_URL_POLICIES paths can't be combined: %s" % e)
+
+    def match_path(self, path):
+        for regex in self.path_regexes:
+            match = regex.match(path)
+            if match is not None:
+                # The group around the whole pattern is the last one to close, so it's always lastgroup
+                return self.path_policies[int(match.lastgroup[len('_zipkin_'):])]
+        return None
+
+    def match_url_name(self, url_name):
+        return self.url_name_policies.get(url_name)
@@ -1,6 +1,39 @@
+import time
+import functools
+import threading
+
+
 # http://stackoverflow.com/a/8255024/583780
 def import_class(cl):
     d = cl.rfind(".")
     classname = cl[d+1:len(cl)]
     m = __import__(cl[0:d], globals(), locals(), [classname])
     return getattr(m, classname)
+
+
+def memoize(factory):
+    """
+    Decorates a function without arguments so it's only called once, the first time its result is needed
+    """
+    result = []
+    lock = threading.Lock()
+
+    @functools.wraps(factory)
+    def f():
+        if not result:
+            with lock:
+                if not result:
+                    result.append(factory())
+        return result[0]
+    return f
+
+
+def truncate(value, max_length, suffix):
+    if max_length is None or len(value) <= max_length:
+        return value
+    return value[:max(max_length - len(suffix), 0)] + suffix
+
+
+# A clock that doesn't jump with the wall clock, for measuring elapsed time. Python 2 has no such clock in the
+# standard library, so there we fall back to time.time.
+monotonic = getattr(time, 'perf_counter', None) or getattr(time, 'monotonic', None) or time.time
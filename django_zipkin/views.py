@@ -0,0 +1,31 @@
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.views.decorators.http import require_http_methods
+
+from runtime_config import default as default_runtime_config
+import defaults as settings
+
+
+@staff_member_required
+@require_http_methods(['GET', 'POST'])
+def runtime_config(request):
+    """
+    Returns the runtime config as JSON; POSTing a JSON object with some of its keys updates it on the whole host
+    """
+    if request.method == 'POST':
+        body = request.body if hasattr(request, 'body') else request.raw_post_data
+        try:
+            overrides = json.loads(body)
+            if not isinstance(overrides, dict):
+                raise ValueError("Expected a JSON object")
+            default_runtime_config.update(**dict((str(key), value) for key, value in overrides.items()))
+        except (ValueError, TypeError, ImproperlyConfigured) as e:
+            return HttpResponseBadRequest(str(e), content_type='text/plain')
+    snapshot = default_runtime_config.get()
+    return HttpResponse(json.dumps({
+        'sample_rate': snapshot.sample_rate,
+        'url_policies': snapshot.overrides.get('url_policies', list(settings.ZIPKIN_URL_POLICIES)),
+    }), content_type='application/json')
@@ -0,0 +1,101 @@
+import logging
+
+from django.core.handlers.wsgi import WSGIRequest
+
+from middleware import ZipkinMiddleware
+import constants
+
+
+class ClosingIterable(object):
+    """
+    Passes through a WSGI response iterable, calling callback once it's closed
+    """
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.iterable.close()
+        finally:
+            self.callback()
+
+
+class ZipkinWsgiMiddleware(object):
+    """
+    Traces requests from the start of the WSGI call until the response is closed
+
+    Wrap the Django WSGI application with it to include the time spent in the WSGI handler and in the middleware
+    before ZipkinMiddleware in the span. ZipkinMiddleware (or ZipkinCallableMiddleware) still records the view
+    annotations into the same span, but leaves opening and closing it to the wrapper.
+    """
+    def __init__(self, application, middleware=None):
+        self.application = application
+        self.middleware = middleware or ZipkinMiddleware()
+
+    def __call__(self, environ, start_response):
+        try:
+            request = WSGIRequest(environ)
+            data = self.middleware.start_span(request)
+        except Exception:
+            logging.root.exception('ZipkinWsgiMiddleware failed to start span')
+            data = None
+        if data is None:
+            return self.application(environ, start_response)
+        environ[constants.WSGI_URL_POLICY_KEY] = request._zipkin_url_policy
+        status_codes = []
+
+        def start_response_recording_status(status, headers, exc_info=None):
+            status_codes.append(int(status.split(' ', 1)[0]))
+            return start_response(status, headers, exc_info)
+
+        def finish_span():
+            try:
+                # Django's request has the resolved URL, which is needed by tail sampling
+                django_request = environ.pop(constants.WSGI_REQUEST_KEY, request)
+                self.middleware.finish_span(django_request, status_codes[-1] if status_codes else 500, data)
+            except Exception:
+                logging.root.exception('ZipkinWsgiMiddleware failed to finish span')
+
+        try:
+            response = self.application(environ, start_response_recording_status)
+        except Exception:
+            finish_span()
+            raise
+        try:
+            # The server may close the response from another thread
+            self.middleware.detach_profilers(request, data)
+        except Exception:
+            logging.root.exception('ZipkinWsgiMiddleware failed to detach profilers')
+        if self._is_file_wrapper(response, environ.get('wsgi.file_wrapper')):
+            # Servers only send files with sendfile when they get their own wrapper back, its close is hooked instead
+            return self._close_with(response, finish_span)
+        return ClosingIterable(response, finish_span)
+
+    @staticmethod
+    def _is_file_wrapper(response, file_wrapper):
+        # The server's wrapper may be a function rather than a class
+        try:
+            return file_wrapper is not None and isinstance(response, file_wrapper)
+        except TypeError:
+            return False
+
+    @staticmethod
+    def _close_with(response, callback):
+        close = getattr(response, 'close', None)
+
+        def close_and_call_back():
+            try:
+                if close is not None:
+                    close()
+            finally:
+                callback()
+        try:
+            response.close = close_and_call_back
+        except (AttributeError, TypeError):
+            return ClosingIterable(response, callback)
+        return response
@@ -43,13 +43,20 @@ class ZipkinId(object):
 class ZipkinData(object):
     """
     The tracing data being passed between services via HTTP headers
+
+    provisional is not propagated: it means the span is recorded without a sampling decision, and it's up to
+    tail sampling to decide whether it's sent to Zipkin once the request is finished.
     """
-    def __init__(self, trace_id=None, span_id=None, parent_span_id=None, sampled=False, flags=False):
+    def __init__(self, trace_id=None, span_id=None, parent_span_id=None, sampled=False, flags=False, provisional=False):
         self.trace_id = trace_id
         self.span_id = span_id
         self.parent_span_id = parent_span_id
         self.sampled = sampled
         self.flags = flags
+        self.provisional = provisional
 
     def is_tracing(self):
-        return self.sampled or self.flags
+        return self.sampled or self.flags or self.provisional
+
+    def is_provisional(self):
+        return self.provisional and not (self.sampled or self.flags)